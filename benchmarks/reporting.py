@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares reading ``ResourceViews`` rows as ORM instances with reading
+them as report rows (:func:`nti.analytics_database.reporting.report_rows`),
+in time and in the memory the materialized rows take, scaled to a
+million rows.
+
+    python benchmarks/reporting.py [rows]
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import gc
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+from sqlalchemy.orm import Session
+
+from nti.analytics_database import Base
+from nti.analytics_database import load_models
+
+from nti.analytics_database.reporting import report_rows
+
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.resources import Resources
+
+#: Columns a typical report reads
+FIELDS = ('user_id', 'session_id', 'resource_ds_id', 'time_length', 'timestamp')
+
+
+def populate(engine, rows):
+    load_models()
+    Base.metadata.create_all(engine)
+    timestamp = datetime(2018, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(Resources.__table__.insert(),
+                     [{'resource_id': idx, 'resource_ds_id': u'tag:nti:%s' % idx}
+                      for idx in range(100)])
+        batch = []
+        for idx in range(rows):
+            batch.append({'resource_view_id': idx + 1,
+                          'resource_id': idx % 100,
+                          'user_id': idx % 1000,
+                          'session_id': idx % 5000,
+                          'time_length': idx % 600,
+                          'timestamp': timestamp})
+            if len(batch) == 10000:
+                conn.execute(ResourceViews.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(ResourceViews.__table__.insert(), batch)
+
+
+def orm_rows(session):
+    return session.query(ResourceViews).all()
+
+
+def compact_rows(session):
+    return list(report_rows(session, ResourceViews, FIELDS))
+
+
+def read(session, reader):
+    result = reader(session)
+    # What reports read
+    for row in result:
+        row.Duration, row.ResourceId  # pylint: disable=pointless-statement
+    return result
+
+
+def measure(engine, reader):
+    """
+    Return the number of rows, the seconds taken to read them and the
+    bytes they take once read (measured in a second, traced, read).
+    """
+    session = Session(engine)
+    try:
+        start = time.time()
+        count = len(read(session, reader))
+        elapsed = time.time() - start
+    finally:
+        session.close()
+    session = Session(engine)
+    try:
+        gc.collect()
+        tracemalloc.start()
+        result = read(session, reader)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+    finally:
+        session.close()
+    return count, elapsed, memory
+
+
+def main(rows=100000):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        engine = create_engine('sqlite:///%s' % os.path.join(tmp_dir, 'report.db'))
+        populate(engine, rows)
+        scale = 1000000 / rows
+        print('%-8s %12s %14s' % ('rows', 'seconds/1M', 'MiB/1M'))
+        for name, reader in (('orm', orm_rows), ('compact', compact_rows)):
+            count, elapsed, memory = measure(engine, reader)
+            assert count == rows
+            print('%-8s %12.2f %14.1f' % (name,
+                                         elapsed * scale,
+                                         memory * scale / (1024 * 1024)))
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+
+if __name__ == '__main__':
+    main(*(int(x) for x in sys.argv[1:]))
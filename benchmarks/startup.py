@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of importing ``nti.analytics_database`` and of loading
+and configuring its mappers, each in a fresh interpreter.
+
+``eager`` loads every model module right after the package import, the
+way the package used to on import; ``lazy`` only imports the package,
+and the models are loaded when the mappers are first configured.
+
+    python benchmarks/startup.py [runs]
+
+Medians of 11 runs (CPython 3.11, SQLAlchemy 1.4)::
+
+    mode       import       load  configure      total
+    eager      161.2ms     131.7ms     122.7ms     415.6ms
+    lazy       161.5ms       0.0ms     254.7ms     416.2ms
+
+Importing the package costs the same in both modes; ``eager`` used to
+load the models on import too (~290ms), ``lazy`` defers them to the
+first mapper use, so the total is unchanged.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import json
+import subprocess
+
+_SCRIPT = """
+import json, time
+start = time.time()
+import nti.analytics_database
+imported = time.time()
+if %(eager)s:
+    nti.analytics_database.load_models()
+loaded = time.time()
+# The first use of a mapped class
+from sqlalchemy.orm import configure_mappers
+import nti.analytics_database.users
+configure_mappers()
+configured = time.time()
+print(json.dumps({'import': imported - start,
+                  'load': loaded - imported,
+                  'configure': configured - loaded}))
+"""
+
+
+def measure(eager, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          _SCRIPT % {'eager': eager}])
+        results.append(json.loads(output.decode('utf-8')))
+    # The median of each phase
+    return {key: sorted(x[key] for x in results)[runs // 2]
+            for key in results[0]}
+
+
+def main(runs=11):
+    print('%-6s %10s %10s %10s %10s' % ('mode', 'import', 'load', 'configure', 'total'))
+    for name, eager in (('eager', True), ('lazy', False)):
+        result = measure(eager, runs)
+        print('%-6s %9.1fms %9.1fms %9.1fms %9.1fms' % (
+            name,
+            result['import'] * 1000,
+            result['load'] * 1000,
+            result['configure'] * 1000,
+            sum(result.values()) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
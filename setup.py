@@ -8,10 +8,13 @@ entry_points = {
 
 TESTS_REQUIRE = [
     'fudge',
+    'greenlet',
     'nti.testing',
     'nti.monkey',
     'pymysql',
     'zope.testrunner',
+    "pyarrow; platform_python_implementation == 'CPython' and python_version >= '3.6'",
+    "aiosqlite; python_version >= '3.7'",
 ]
 
 
@@ -52,6 +55,7 @@ setup(
         'setuptools',
         'nti.property',
         'simplejson',
+        'six',
         'sqlalchemy',
         'zope.component',
         'zope.dottedname',
@@ -60,6 +64,12 @@ setup(
     ],
     extras_require={
         'test': TESTS_REQUIRE,
+        'async': [
+            'aiosqlite',
+        ],
+        'columnar': [
+            'pyarrow',
+        ],
         'docs': [
             'Sphinx',
             'repoze.sphinx.autointerface',
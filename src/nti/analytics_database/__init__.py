@@ -8,14 +8,19 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import importlib
+
 from zope import component
 
+from sqlalchemy import event
 from sqlalchemy import String
 from sqlalchemy import Integer
 from sqlalchemy import BigInteger
 
 from sqlalchemy.ext.declarative import declarative_base
 
+from sqlalchemy.orm import Mapper
+
 Base = declarative_base()
 
 # The column type for session ids
@@ -31,10 +36,48 @@ INTID_COLUMN_TYPE = BigInteger
 #: '/' is illegal in ntiid strings
 CONTEXT_PATH_SEPARATOR = '/'
 
-# Init so these exist in our Base
-import os
-for module in os.listdir(os.path.dirname(__file__)):
-    if module == '__init__.py' or module[-3:] != '.py':
-        continue
-    __import__(module[:-3], locals(), globals())
-del module
+#: The modules declaring our mapped classes, loaded by :func:`load_models`
+MODEL_MODULES = (
+    'assessments',
+    'blogs',
+    'boards',
+    'enrollments',
+    'lti',
+    'metadata',
+    'mime_types',
+    'profile_views',
+    'resource_tags',
+    'resource_views',
+    'resources',
+    'rollups',
+    'root_context',
+    'scorm',
+    'search',
+    'sequences',
+    'sessions',
+    'social',
+    'surveys',
+    'users',
+)
+
+_models_loaded = []
+
+
+def load_models():
+    """
+    Import all of :data:`MODEL_MODULES` so that their tables exist in
+    ``Base.metadata`` and their classes can be named in relationships.
+    Cheap after the first call.
+
+    This happens by itself before SQLAlchemy first configures the
+    mappers (e.g. on the first query), so importing this package (for
+    ``Base`` or a constant) does not pay for every mapper.
+    """
+    if _models_loaded:
+        return
+    for name in MODEL_MODULES:
+        importlib.import_module('%s.%s' % (__name__, name))
+    _models_loaded.append(True)
+
+
+event.listen(Mapper, 'before_configured', load_models)
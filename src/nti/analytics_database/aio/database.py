@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+An asyncio counterpart of
+:class:`~nti.analytics_database.database.AnalyticsDB`, built on
+SQLAlchemy's async engine.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import asyncio
+
+from collections import OrderedDict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from sqlalchemy.orm import sessionmaker
+
+from sqlalchemy.pool import StaticPool
+
+from zope import interface
+
+from zope.cachedescriptors.property import Lazy
+
+from nti.analytics_database import Base
+
+from nti.analytics_database import load_models
+
+from nti.analytics_database.batching import get_table
+
+from nti.analytics_database.database import read_config
+from nti.analytics_database.database import _make_safe_for_logging
+
+from nti.analytics_database.interfaces import IAsyncAnalyticsDB
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The async driver used for each dialect when the URI does not name one
+ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'mysql': 'aiomysql',
+    'postgresql': 'asyncpg',
+}
+
+#: Drivers that are already async
+_ASYNC_DRIVER_NAMES = ('aiosqlite', 'aiomysql', 'asyncmy', 'asyncpg')
+
+
+def async_uri(dburi):
+    """
+    Return the given (sync) database URI with an async driver, e.g.
+    ``sqlite:///x.db`` becomes ``sqlite+aiosqlite:///x.db``.
+    """
+    scheme, rest = dburi.split('://', 1)
+    for prefix in ('gevent+', 'gevent_'):
+        if scheme.startswith(prefix):
+            scheme = scheme[len(prefix):]
+    dialect, _, driver = scheme.partition('+')
+    if driver not in _ASYNC_DRIVER_NAMES:
+        try:
+            driver = ASYNC_DRIVERS[dialect]
+        except KeyError:
+            raise ValueError("No async driver for '%s'" % dialect)
+    return '%s+%s://%s' % (dialect, driver, rest)
+
+
+@interface.implementer(IAsyncAnalyticsDB)
+class AsyncAnalyticsDB(object):
+    """
+    Takes the same configuration as
+    :class:`~nti.analytics_database.database.AnalyticsDB` (options that
+    only apply to the thread based database, such as two-phase commit or
+    read replicas, are ignored) and maps the URI to an async driver.
+
+    Tables are created by awaiting :meth:`create_tables`.
+    """
+
+    pool_size = 5
+    max_overflow = 5
+    pool_recycle = 300
+
+    def __init__(self, dburi=None, echo=False, defaultSQLite=False, testmode=False,
+                 config=None, pool_size=None, max_overflow=None, pool_recycle=None):
+        self.dburi = dburi
+        self.echo = echo
+        self.testmode = testmode
+        self.defaultSQLite = defaultSQLite
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if max_overflow is not None:
+            self.max_overflow = max_overflow
+        if pool_recycle is not None:
+            self.pool_recycle = pool_recycle
+        if defaultSQLite and not dburi:
+            data_dir = os.getenv('DATASERVER_DATA_DIR') or '/tmp'
+            data_dir = os.path.expanduser(data_dir)
+            data_file = os.path.join(data_dir, 'analytics-sqlite.db')
+            self.dburi = "sqlite:///%s" % data_file
+        elif config:
+            options = read_config(config)
+            for name in ('dburi', 'pool_size', 'max_overflow', 'pool_recycle'):
+                if name in options:
+                    setattr(self, name, options[name])
+
+    @Lazy
+    def engine(self):
+        dburi = async_uri(self.dburi)
+        logger.info("Connecting to async database at '%s' (testmode=%s)",
+                    _make_safe_for_logging(dburi), self.testmode)
+        if self.dburi == 'sqlite://':
+            # In-memory databases are per connection; share one (tests).
+            return create_async_engine(dburi,
+                                       connect_args={'check_same_thread': False},
+                                       echo=self.echo,
+                                       poolclass=StaticPool)
+        if dburi.startswith('sqlite'):
+            return create_async_engine(dburi, echo=self.echo)
+        return create_async_engine(dburi,
+                                   pool_size=self.pool_size,
+                                   max_overflow=self.max_overflow,
+                                   pool_recycle=self.pool_recycle,
+                                   echo=self.echo)
+
+    @Lazy
+    def sessionmaker(self):
+        return sessionmaker(bind=self.engine,
+                            class_=AsyncSession,
+                            expire_on_commit=False)
+
+    def session(self):
+        """
+        Return a new :class:`AsyncSession`, to be used as
+        ``async with db.session() as session``.
+        """
+        return self.sessionmaker()
+
+    async def create_tables(self):
+        load_models()
+        async with self.engine.begin() as conn:
+            await conn.run_sync(getattr(Base, 'metadata').create_all)
+
+    async def insert_many(self, model, rows, batch_size=None):
+        """
+        Insert the given row dicts into the mapped class (or table) with
+        multi-row inserts of up to ``batch_size`` rows, in one transaction.
+        Returns the number of rows inserted.
+        """
+        table = get_table(model)
+        rows = list(rows)
+        batch_size = batch_size or AsyncBatchedWriter.batch_size
+        async with self.engine.begin() as conn:
+            for idx in range(0, len(rows), batch_size):
+                await conn.execute(table.insert(), rows[idx:idx + batch_size])
+        return len(rows)
+
+    @Lazy
+    def batch_writer(self):
+        # Batches rows from many concurrent writers into few connections.
+        return AsyncBatchedWriter(self)
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+
+class AsyncBatchedWriter(object):
+    """
+    Buffers plain row dicts per mapped table from any number of
+    coroutines and writes them with multi-row inserts, one transaction per
+    flush. Buffers are flushed when a table holds ``batch_size`` rows (the
+    adding coroutine waits for that flush, which bounds the buffer) and,
+    once :meth:`start` ed, every ``flush_interval`` seconds. Rows of a
+    failed flush are kept for the next one.
+    """
+
+    batch_size = 500
+    flush_interval = 1
+
+    def __init__(self, db, batch_size=None, flush_interval=None):
+        self.db = db
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self._buffers = OrderedDict()
+        self._lock = None
+        self._task = None
+
+    @property
+    def lock(self):
+        # Created on first use so it belongs to the running loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def pending(self):
+        return sum(len(x) for x in self._buffers.values())
+
+    async def add(self, model, values=None, **kwargs):
+        """
+        Buffer a single row for the given mapped class (or table).
+        """
+        await self.add_all(model, (dict(values or (), **kwargs),))
+
+    async def add_all(self, model, rows):
+        buffer = self._buffers.setdefault(get_table(model), [])
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write all buffered rows. Returns the number of rows written.
+        """
+        async with self.lock:
+            buffers, self._buffers = self._buffers, OrderedDict()
+            count = sum(len(x) for x in buffers.values())
+            if not count:
+                return 0
+            try:
+                async with self.db.engine.begin() as conn:
+                    for table, rows in buffers.items():
+                        await conn.execute(table.insert(), rows)
+            except BaseException:
+                # Rolled back (or cancelled); keep the rows for the next
+                # flush, ahead of those added meanwhile.
+                self._restore(buffers)
+                raise
+        logger.debug("Flushed %s batched analytics rows", count)
+        return count
+
+    def _restore(self, buffers):
+        for table, rows in self._buffers.items():
+            buffers.setdefault(table, []).extend(rows)
+        self._buffers = buffers
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to flush batched analytics rows")
+
+    def start(self):
+        """
+        Start flushing every ``flush_interval`` seconds on the running
+        loop.
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def close(self):
+        """
+        Stop the periodic flush and write what is still buffered.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        return await self.flush()
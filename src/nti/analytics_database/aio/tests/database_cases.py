@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import not_none
+from hamcrest import assert_that
+from hamcrest import has_property
+
+import os
+import shutil
+import asyncio
+import tempfile
+
+import fudge
+
+from six.moves import configparser
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from zope import component
+
+import nti.testing.base
+
+from nti.analytics_database.aio.database import async_uri
+from nti.analytics_database.aio.database import AsyncAnalyticsDB
+from nti.analytics_database.aio.database import AsyncBatchedWriter
+
+from nti.analytics_database.interfaces import IAsyncAnalyticsDB
+
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+ZCML_STRING = """
+<configure    xmlns="http://namespaces.zope.org/zope"
+            xmlns:adb="http://nextthought.com/analytics/database">
+
+    <include package="zope.component" file="meta.zcml" />
+    <include package="zope.component" />
+    <include package="nti.analytics_database.aio" file="meta.zcml" />
+
+    <configure>
+        <adb:registerAsyncAnalyticsDB dburi="sqlite://"
+                                      twophase="True"
+                                      pool_size="2" />
+    </configure>
+</configure>
+"""
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _view(idx):
+    return {'user_id': 1, 'resource_id': 1, 'time_length': idx}
+
+
+class TestAsyncDatabase(AnalyticsDatabaseTest):
+
+    def test_async_uri(self):
+        assert_that(async_uri('sqlite://'), is_('sqlite+aiosqlite://'))
+        assert_that(async_uri('gevent+sqlite:////tmp/a.db'),
+                    is_('sqlite+aiosqlite:////tmp/a.db'))
+        assert_that(async_uri('mysql+pymysql://u:p@host/Analytics'),
+                    is_('mysql+aiomysql://u:p@host/Analytics'))
+        assert_that(async_uri('gevent_mysql://u:p@host/Analytics'),
+                    is_('mysql+aiomysql://u:p@host/Analytics'))
+        assert_that(async_uri('mysql+asyncmy://u:p@host/Analytics'),
+                    is_('mysql+asyncmy://u:p@host/Analytics'))
+        assert_that(async_uri('postgresql://host/Analytics'),
+                    is_('postgresql+asyncpg://host/Analytics'))
+        assert_that(calling(async_uri).with_args('oracle://host/Analytics'),
+                    raises(ValueError))
+
+    def test_session(self):
+        db = AsyncAnalyticsDB(dburi='sqlite://', testmode=True)
+
+        async def _test():
+            await db.create_tables()
+            async with db.session() as session:
+                session.add(Users(user_ds_id=1, username=u'ichigo'))
+                await session.commit()
+            async with db.session() as session:
+                user = (await session.execute(select([Users]))).scalars().one()
+            await db.dispose()
+            return user
+
+        user = _run(_test())
+        assert_that(user, has_property('username', u'ichigo'))
+
+    def test_batched(self):
+        db = AsyncAnalyticsDB(dburi='sqlite://')
+
+        async def _count():
+            async with db.engine.connect() as conn:
+                query = select([func.count()]).select_from(ResourceViews.__table__)
+                return (await conn.execute(query)).scalar()
+
+        async def _test():
+            await db.create_tables()
+            assert_that(await db.insert_many(ResourceViews,
+                                             [_view(x) for x in range(5)],
+                                             batch_size=2),
+                        is_(5))
+
+            writer = AsyncBatchedWriter(db, batch_size=10, flush_interval=0.01)
+            # Many concurrent writers share one connection
+            await asyncio.gather(*[writer.add(ResourceViews, _view(x))
+                                   for x in range(25)])
+            # Rows added while a flush is running go into the next one
+            assert_that(await _count() + writer.pending, is_(30))
+
+            writer.start()
+            writer.start()
+            await writer.add(ResourceViews, **_view(1))
+            await asyncio.sleep(0.1)
+            assert_that(writer.pending, is_(0))
+            assert_that(await _count(), is_(31))
+
+            await writer.add(ResourceViews, _view(1))
+            assert_that(await writer.close(), is_(1))
+            assert_that(await writer.flush(), is_(0))
+            assert_that(db.batch_writer, has_property('db', db))
+            await db.dispose()
+
+        _run(_test())
+
+    def test_flush_retry(self):
+        db = AsyncAnalyticsDB(dburi='sqlite://')
+
+        class Failing(object):
+
+            async def __aenter__(self):
+                # A row added while the flush runs
+                await writer.add(ResourceViews, _view(2))
+                raise ValueError()
+
+            async def __aexit__(self, *unused_args):  # pragma: no cover
+                pass
+
+        class Engine(object):
+            failed = False
+
+            def begin(self):
+                if not self.failed:
+                    self.failed = True
+                    return Failing()
+                return db.engine.begin()
+
+        writer = AsyncBatchedWriter(fudge.Fake().has_attr(engine=Engine()))
+
+        async def _test():
+            await db.create_tables()
+            await writer.add(ResourceViews, _view(1))
+            with self.assertRaises(ValueError):
+                await writer.flush()
+            # The rows of the failed flush are written by the next one,
+            # ahead of those added meanwhile
+            assert_that(writer.pending, is_(2))
+            assert_that(await writer.flush(), is_(2))
+            async with db.engine.connect() as conn:
+                query = select([ResourceViews.time_length]) \
+                        .order_by(ResourceViews.resource_view_id)
+                lengths = [x[0] for x in await conn.execute(query)]
+            await db.dispose()
+            return lengths
+
+        assert_that(_run(_test()), is_([1, 2]))
+
+    @fudge.patch('nti.analytics_database.aio.database.AsyncBatchedWriter.flush')
+    def test_flush_failure(self, fake_flush):
+        async def _fail():
+            raise ValueError()
+        fake_flush.expects_call().calls(_fail)
+
+        async def _test():
+            writer = AsyncBatchedWriter(None, flush_interval=0).start()
+            await asyncio.sleep(0.01)
+            writer._task.cancel()
+
+        _run(_test())
+
+    @fudge.patch('nti.analytics_database.aio.database.create_async_engine')
+    def test_server_engine(self, fake_create):
+        fake_create.expects_call().with_args('mysql+aiomysql://u:p@host/Analytics',
+                                             pool_size=3,
+                                             max_overflow=1,
+                                             pool_recycle=60,
+                                             echo=False).returns('engine')
+        db = AsyncAnalyticsDB(dburi='mysql+pymysql://u:p@host/Analytics',
+                              pool_size=3, max_overflow=1, pool_recycle=60)
+        assert_that(db.engine, is_('engine'))
+
+    def test_engines(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db = AsyncAnalyticsDB(dburi='sqlite:///%s' % os.path.join(tmp_dir, 'a.db'))
+            assert_that(str(db.engine.url), is_('sqlite+aiosqlite:///%s/a.db' % tmp_dir))
+
+            config = configparser.RawConfigParser()
+            config.add_section('analytics')
+            config.set('analytics', 'dburi', 'sqlite://')
+            config.set('analytics', 'pool_size', '7')
+            config.set('analytics', 'twophase', 'True')
+            config.set('analytics', 'readers', 'sqlite://, sqlite://')
+            config_file = os.path.join(tmp_dir, 'analytics.cfg')
+            with open(config_file, 'w') as stream:
+                config.write(stream)
+            db = AsyncAnalyticsDB(config=config_file)
+            assert_that(db, has_property('dburi', 'sqlite://'))
+            assert_that(db, has_property('pool_size', 7))
+
+            os.environ['DATASERVER_DATA_DIR'] = tmp_dir
+            try:
+                db = AsyncAnalyticsDB(defaultSQLite=True)
+            finally:
+                del os.environ['DATASERVER_DATA_DIR']
+            assert_that(db.dburi, is_('sqlite:///%s/analytics-sqlite.db' % tmp_dir))
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+
+class TestAsyncZcml(nti.testing.base.ConfiguringTestBase):
+
+    def test_registration(self):
+        self.configure_string(ZCML_STRING)
+        db = component.queryUtility(IAsyncAnalyticsDB)
+        assert_that(db, is_(not_none()))
+        assert_that(db, has_property('dburi', 'sqlite://'))
+        assert_that(db, has_property('pool_size', 2))
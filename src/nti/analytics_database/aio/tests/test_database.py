@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=unused-import
+
+import sys
+import unittest
+
+try:
+    import aiosqlite
+except ImportError:  # pragma: no cover
+    aiosqlite = None
+
+#: The asyncio tests (in ``database_cases``, which the test runner does
+#: not collect by itself) use syntax needing Python 3 and aiosqlite,
+#: installed on Python 3.7 or later.
+SUPPORTED = sys.version_info >= (3, 7) and aiosqlite is not None
+
+if SUPPORTED:
+    from nti.analytics_database.aio.tests.database_cases import TestAsyncZcml
+    from nti.analytics_database.aio.tests.database_cases import TestAsyncDatabase
+else:  # pragma: no cover
+    @unittest.skip("asyncio support needs Python 3.7 or later and aiosqlite")
+    class TestAsyncDatabase(unittest.TestCase):
+
+        def test_async(self):
+            pass
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import functools
+
+from zope.component.zcml import utility
+
+from nti.analytics_database.aio.database import AsyncAnalyticsDB
+
+from nti.analytics_database.interfaces import IAsyncAnalyticsDB
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def registerAsyncAnalyticsDB(_context, dburi=None, defaultSQLite=False, testmode=False,
+                             config=None, echo=False, pool_size=None, max_overflow=None,
+                             pool_recycle=None, **unused_kwargs):
+    """
+    Register the async db; takes the same attributes as
+    ``registerAnalyticsDB``.
+    """
+    factory = functools.partial(AsyncAnalyticsDB,
+                                dburi=dburi,
+                                defaultSQLite=defaultSQLite,
+                                testmode=testmode,
+                                echo=echo,
+                                config=config,
+                                pool_size=pool_size,
+                                max_overflow=max_overflow,
+                                pool_recycle=pool_recycle)
+    utility(_context, provides=IAsyncAnalyticsDB, factory=factory)
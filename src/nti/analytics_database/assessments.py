@@ -97,10 +97,19 @@ class AssignmentsTaken(Base, AssignmentMixin):
     def Grader(self):
         return self.grade and self.grade.grader
 
+    _submission = None
+
     @property
     def Submission(self):
-        id_utility = component.getUtility(IAnalyticsIntidIdentifier)
-        return id_utility.get_object(self.submission_id)
+        result = self._submission
+        if result is None:
+            id_utility = component.getUtility(IAnalyticsIntidIdentifier)
+            result = id_utility.get_object(self.submission_id)
+        return result
+
+    @Submission.setter
+    def Submission(self, submission):
+        self._submission = submission
 
 
 class AssignmentSubmissionMixin(BaseTableMixin):
@@ -310,10 +319,19 @@ class SelfAssessmentsTaken(Base, AssignmentMixin):
                                 Sequence('self_assessment_seq'),
                                 index=True, nullable=False, primary_key=True)
 
+    _submission = None
+
     @property
     def Submission(self):
-        id_utility = component.getUtility(IAnalyticsIntidIdentifier)
-        return id_utility.get_object(self.submission_id)
+        result = self._submission
+        if result is None:
+            id_utility = component.getUtility(IAnalyticsIntidIdentifier)
+            result = id_utility.get_object(self.submission_id)
+        return result
+
+    @Submission.setter
+    def Submission(self, submission):
+        self._submission = submission
 
 # SelfAssessments will not have feedback or multiple graders
 
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Batched, multi-row writes for high-volume event tables.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import threading
+
+from collections import OrderedDict
+
+import transaction
+
+from sqlalchemy import Table
+
+from zope.sqlalchemy import mark_changed
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def get_table(model):
+    """
+    Return the :class:`sqlalchemy.Table` for the given mapped class
+    or table.
+    """
+    if isinstance(model, Table):
+        return model
+    return getattr(model, '__table__')
+
+
+class _BatchSavepoint(object):
+
+    def __init__(self, writer, state):
+        self.writer = writer
+        # Rows flushed after the savepoint are rolled back by the session,
+        # so whatever was buffered at the savepoint is buffered again.
+        self.buffers = [(k, list(v)) for k, v in state.buffers.items()]
+
+    def rollback(self):
+        self.writer._restore(self.buffers)
+
+
+class _BatchDataManager(object):
+    """
+    Ties a writer's buffered rows to the current transaction. The rows
+    themselves are written through the (zope.sqlalchemy registered) session
+    in a before-commit hook; this manager only makes sure they are thrown
+    away if the transaction aborts or rolls back to a savepoint.
+    """
+
+    def __init__(self, writer, txn_manager):
+        self.writer = writer
+        self.transaction_manager = txn_manager
+
+    def abort(self, unused_txn):
+        self.writer.discard()
+        self.writer._reset()
+
+    def tpc_begin(self, unused_txn):
+        pass
+
+    def commit(self, unused_txn):
+        pass
+
+    def tpc_vote(self, unused_txn):
+        pass
+
+    def tpc_finish(self, unused_txn):
+        self.writer._reset()
+
+    def tpc_abort(self, unused_txn):
+        self.abort(unused_txn)
+
+    def savepoint(self):
+        return _BatchSavepoint(self.writer, self.writer._state)
+
+    def sortKey(self):
+        return 'analytics_batch:%d' % id(self)
+
+
+class BatchedWriter(object):
+    """
+    Buffers plain row dicts per mapped table and writes them with a single
+    multi-row ``INSERT`` (``executemany``) through the analytics session.
+
+    Buffers are flushed when a table holds ``batch_size`` rows, when
+    ``flush_interval`` seconds have passed since the first buffered row, or
+    just before the surrounding transaction commits. Rows are discarded if
+    the transaction aborts, so the batch commits or aborts with it.
+
+    With ``allocate_ids``, rows of tables with a sequence primary key are
+    given their id up front from the database's block id allocator (see
+    :class:`.BlockIdAllocator` for what it needs of each database).
+    """
+
+    batch_size = 500
+    flush_interval = 5
+
+    def __init__(self, db, batch_size=None, flush_interval=None,
+                 transaction_manager=None, allocate_ids=False):
+        self.db = db
+        self.allocate_ids = allocate_ids
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self.transaction_manager = transaction_manager or transaction.manager
+        self._local = threading.local()
+
+    @property
+    def _state(self):
+        state = self._local
+        if not hasattr(state, 'buffers'):
+            state.buffers = OrderedDict()
+            state.txn = None
+            state.started = None
+        return state
+
+    def _join(self):
+        state = self._state
+        txn = self.transaction_manager.get()
+        if state.txn is not txn:
+            state.txn = txn
+            txn.join(_BatchDataManager(self, self.transaction_manager))
+            txn.addBeforeCommitHook(self.flush)
+
+    def add(self, model, values=None, **kwargs):
+        """
+        Buffer a single row for the given mapped class (or table).
+        Returns the row's pre-assigned primary key, if any.
+        """
+        row = dict(values or (), **kwargs)
+        return self.add_all(model, (row,))[0]
+
+    def _assign_ids(self, table, rows):
+        allocator = self.db.get_id_allocator(table)
+        name = allocator.column.key
+        for row in rows:
+            if row.get(name) is None:
+                row[name] = allocator.next_id()
+        return [row[name] for row in rows]
+
+    def add_all(self, model, rows):
+        """
+        Buffer many rows for the given mapped class (or table). Returns
+        their pre-assigned primary keys (or Nones).
+        """
+        self._join()
+        state = self._state
+        table = get_table(model)
+        rows = list(rows)
+        if self.allocate_ids:
+            result = self._assign_ids(table, rows)
+        else:
+            result = [None] * len(rows)
+        buffer = state.buffers.setdefault(table, [])
+        buffer.extend(rows)
+        if state.started is None:
+            state.started = time.time()
+        if     len(buffer) >= self.batch_size \
+            or time.time() - state.started >= self.flush_interval:
+            self.flush()
+        return result
+
+    @property
+    def pending(self):
+        """
+        The number of buffered rows not yet written.
+        """
+        return sum(len(x) for x in self._state.buffers.values())
+
+    def flush(self):
+        """
+        Write all buffered rows to the session. Returns the number of rows
+        written.
+        """
+        state = self._state
+        if not state.buffers:
+            return 0
+        session = self.db.session
+        count = 0
+        for table, rows in state.buffers.items():
+            if rows:
+                session.execute(table.insert(), rows)
+                count += len(rows)
+        state.buffers.clear()
+        state.started = None
+        mark_changed(session())
+        logger.debug("Flushed %s batched analytics rows", count)
+        return count
+
+    def discard(self):
+        """
+        Drop all buffered rows without writing them.
+        """
+        state = self._state
+        state.buffers.clear()
+        state.started = None
+
+    def _reset(self):
+        self._state.txn = None
+
+    def _restore(self, buffers):
+        state = self._state
+        state.buffers = OrderedDict((k, list(v)) for k, v in buffers)
+        if not state.buffers:
+            state.started = None
+        elif state.started is None:
+            state.started = time.time()
@@ -119,10 +119,19 @@ class TopicsCreated(Base, BaseTableMixin, ForumMixin, DeletedMixin, RatingsMixin
     topic_id = Column('topic_id', Integer, Sequence('topic_seq'), 
 					  index=True, nullable=False, primary_key=True)
 
+    _topic = None
+
     @property
     def Topic(self):
-        id_utility = component.getUtility(IAnalyticsIntidIdentifier)
-        return id_utility.get_object(self.topic_ds_id)
+        result = self._topic
+        if result is None:
+            id_utility = component.getUtility(IAnalyticsIntidIdentifier)
+            result = id_utility.get_object(self.topic_ds_id)
+        return result
+
+    @Topic.setter
+    def Topic(self, topic):
+        self._topic = topic
 
 
 class ForumCommentsCreated(Base, CommentsMixin, TopicMixin, RatingsMixin):
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Columnar (Parquet or Arrow IPC) export of analytics tables, partitioned by
+course and month.
+
+Requires :mod:`pyarrow`, installed with the ``columnar`` extra.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+
+from collections import OrderedDict
+
+from sqlalchemy import Date
+from sqlalchemy import Enum
+from sqlalchemy import Text
+from sqlalchemy import Float
+from sqlalchemy import String
+from sqlalchemy import Boolean
+from sqlalchemy import Integer
+from sqlalchemy import Numeric
+from sqlalchemy import DateTime
+from sqlalchemy import Interval
+from sqlalchemy import BigInteger
+from sqlalchemy import LargeBinary
+from sqlalchemy import SmallInteger
+
+from nti.analytics_database.batching import get_table
+
+from nti.analytics_database.export import CHUNK_SIZE
+from nti.analytics_database.export import iter_chunks
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The partition directory name used for rows without a course or timestamp
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+FORMATS = ('parquet', 'arrow')
+
+#: The rows per Parquet row group (or Arrow record batch)
+ROW_GROUP_SIZE = 65536
+
+#: The rows buffered across all partitions before the largest buffer is
+#: written out
+MAX_BUFFERED = 4 * ROW_GROUP_SIZE
+
+#: The partition files open at once
+MAX_OPEN = 32
+
+
+def _check_pyarrow():
+    if pyarrow is None:  # pragma: no cover
+        raise ImportError("Columnar export requires pyarrow")
+
+
+def arrow_type(column):
+    """
+    Return the Arrow type for the given :class:`sqlalchemy.Column`.
+    """
+    _check_pyarrow()
+    column_type = column.type
+    # Order matters; e.g. BigInteger and Enum are subclasses of
+    # Integer and String.
+    if isinstance(column_type, BigInteger):
+        return pyarrow.int64()
+    if isinstance(column_type, SmallInteger):
+        return pyarrow.int16()
+    if isinstance(column_type, Integer):
+        return pyarrow.int32()
+    if isinstance(column_type, Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, DateTime):
+        return pyarrow.timestamp('us', tz='UTC' if column_type.timezone else None)
+    if isinstance(column_type, Date):
+        return pyarrow.date32()
+    if isinstance(column_type, Interval):
+        return pyarrow.duration('us')
+    if isinstance(column_type, Float):
+        return pyarrow.float64()
+    if isinstance(column_type, Numeric):
+        if column_type.precision and column_type.asdecimal:
+            return pyarrow.decimal128(column_type.precision,
+                                      column_type.scale or 0)
+        return pyarrow.float64()
+    if isinstance(column_type, (Enum, Text, String)):
+        return pyarrow.string()
+    if isinstance(column_type, LargeBinary):
+        return pyarrow.binary()
+    raise TypeError("No Arrow type for column %s (%s)" % (column, column_type))
+
+
+def arrow_schema(model, exclude=()):
+    """
+    Return the Arrow schema of the given mapped class (or table).
+    """
+    table = get_table(model)
+    return pyarrow.schema([pyarrow.field(column.name, arrow_type(column),
+                                         nullable=column.nullable)
+                           for column in table.columns
+                           if column.name not in exclude])
+
+
+def _partition(row, course_column, time_column):
+    """
+    The Hive style partition path of a row.
+    """
+    parts = []
+    if course_column is not None:
+        course_id = row[course_column]
+        parts.append('course_id=%s' % (NULL_PARTITION if course_id is None else course_id))
+    if time_column is not None:
+        timestamp = row[time_column]
+        parts.append('month=%s' % (NULL_PARTITION if timestamp is None
+                                   else timestamp.strftime('%Y-%m')))
+    return os.path.join(*parts) if parts else ''
+
+
+class _PartitionWriters(object):
+    """
+    Buffers record batches per partition and writes a partition's rows
+    once they fill a row group, or when more than ``max_buffered`` rows
+    are buffered overall (the largest buffer first). At most ``max_open``
+    file writers are kept open; the least recently written is closed, and
+    its partition continues in a new ``part-<n>`` file if it gets more
+    rows.
+    """
+
+    def __init__(self, path, schema, file_format, row_group_size=ROW_GROUP_SIZE,
+                 max_buffered=MAX_BUFFERED, max_open=MAX_OPEN):
+        self.path = path
+        self.schema = schema
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.max_buffered = max_buffered
+        self.max_open = max_open
+        self.buffers = {}
+        self.sizes = {}
+        self.buffered = 0
+        # Open writers, least recently written first
+        self.writers = OrderedDict()
+        # The number of files opened per partition
+        self.parts = {}
+
+    def _open(self, partition):
+        directory = os.path.join(self.path, partition)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        part = self.parts.get(partition, 0)
+        self.parts[partition] = part + 1
+        filename = os.path.join(directory, 'part-%d.%s' % (part, self.file_format))
+        if self.file_format == 'parquet':
+            return pyarrow.parquet.ParquetWriter(filename, self.schema)
+        return pyarrow.ipc.new_file(filename, self.schema)
+
+    def _writer(self, partition):
+        writer = self.writers.pop(partition, None)
+        if writer is None:
+            if len(self.writers) >= self.max_open:
+                self.writers.popitem(last=False)[1].close()
+            writer = self._open(partition)
+        self.writers[partition] = writer
+        return writer
+
+    def _flush(self, partition):
+        table = pyarrow.Table.from_batches(self.buffers.pop(partition))
+        self.buffered -= self.sizes.pop(partition)
+        writer = self._writer(partition)
+        if self.file_format == 'parquet':
+            writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            writer.write_table(table.combine_chunks(), max_chunksize=self.row_group_size)
+
+    def write(self, partition, batch):
+        self.buffers.setdefault(partition, []).append(batch)
+        self.sizes[partition] = self.sizes.get(partition, 0) + batch.num_rows
+        self.buffered += batch.num_rows
+        if self.sizes[partition] >= self.row_group_size:
+            self._flush(partition)
+        while self.buffered > self.max_buffered:
+            self._flush(max(self.sizes, key=self.sizes.get))
+
+    def finish(self):
+        """
+        Write everything still buffered.
+        """
+        for partition in list(self.buffers):
+            self._flush(partition)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+def export_columnar(engine, model, path, file_format='parquet', partition=True,
+                    chunk_size=CHUNK_SIZE, row_group_size=ROW_GROUP_SIZE,
+                    max_buffered=MAX_BUFFERED, max_open=MAX_OPEN, **kwargs):
+    """
+    Write the rows of the given mapped class (or table) as typed columnar
+    files under ``path``.
+
+    With ``partition``, files are laid out Hive style as
+    ``course_id=<id>/month=<YYYY-MM>/part-0.<format>`` (by whichever of the
+    ``course_id`` and ``timestamp`` columns the table has); the course is
+    then dropped from the file columns. Rows are read in keyset chunks
+    (see :func:`nti.analytics_database.export.iter_chunks`, which also
+    takes ``research`` and ``where``) and buffered per partition until
+    they fill a row group of ``row_group_size`` rows. Memory is bounded
+    by ``max_buffered`` rows and open files by ``max_open``; a partition
+    whose file was closed continues in ``part-1`` and so on.
+
+    Returns the number of rows written.
+    """
+    _check_pyarrow()
+    if file_format not in FORMATS:
+        raise ValueError("Unknown columnar format %r" % (file_format,))
+    table = get_table(model)
+    course_column = time_column = None
+    if partition:
+        course_column = table.c.get('course_id')
+        time_column = table.c.get('timestamp')
+    exclude = () if course_column is None else ('course_id',)
+    schema = arrow_schema(table, exclude)
+    columns = [table.c[name] for name in schema.names]
+
+    writers = _PartitionWriters(path, schema, file_format, row_group_size,
+                                max_buffered, max_open)
+    count = 0
+    try:
+        for chunk in iter_chunks(engine, table, chunk_size=chunk_size, **kwargs):
+            partitions = OrderedDict()
+            for row in chunk:
+                key = _partition(row, course_column, time_column)
+                partitions.setdefault(key, []).append(row)
+            for key, rows in partitions.items():
+                arrays = [pyarrow.array([row[column] for row in rows], type=field.type)
+                          for column, field in zip(columns, schema)]
+                writers.write(key, pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+            count += len(chunk)
+        writers.finish()
+    finally:
+        writers.close()
+    logger.info("Exported %s rows of %s to %s in %s partitions",
+                count, table.name, path, len(writers.parts))
+    return count
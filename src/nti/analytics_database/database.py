@@ -10,6 +10,11 @@ from __future__ import absolute_import
 
 import os
 import re
+import atexit
+import itertools
+import threading
+
+import six
 
 from six.moves import configparser
 
@@ -17,24 +22,66 @@ import transaction
 
 from six.moves import urllib_parse
 
+from transaction.interfaces import AlreadyInTransaction
+
 from sqlalchemy import event
 from sqlalchemy import create_engine
 
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import scoped_session
 
 from sqlalchemy.pool import StaticPool
 
+from sqlalchemy.sql.expression import UpdateBase
+
 from zope import interface
 
 from zope.cachedescriptors.property import Lazy
 
 from zope.sqlalchemy import register
 
+from nti.analytics_database.batching import get_table
+from nti.analytics_database.batching import BatchedWriter
+
+from nti.analytics_database.dimensions import DimensionCache
+
+from nti.analytics_database.dimensions import get_or_create
+from nti.analytics_database.dimensions import get_dimension
+from nti.analytics_database.dimensions import get_or_create_many
+
 from nti.analytics_database.interfaces import IAnalyticsDB
 
+from nti.analytics_database.group_commit import GroupCommitter
+from nti.analytics_database.group_commit import GroupCommitWriter
+
+from nti.analytics_database.lazy_loads import LazyLoadDetector
+
 from nti.analytics_database.metadata import AnalyticsMetadata
 
+from nti.analytics_database.metrics import StatementMetrics
+
+from nti.analytics_database.pool import PoolMetrics
+from nti.analytics_database.pool import AdaptiveOverflow
+from nti.analytics_database.pool import InstrumentedQueuePool
+
+from nti.analytics_database.retries import RetryPolicy
+
+from nti.analytics_database.scoping import SESSION_SCOPES
+
+from nti.analytics_database.scoping import greenlet_local
+from nti.analytics_database.scoping import make_scoped_session
+
+from nti.analytics_database.sequences import BlockIdAllocator
+
+from nti.analytics_database.slow_queries import SlowQueryLog
+
+from nti.analytics_database.sqlite_tuning import acquire_maintenance
+from nti.analytics_database.sqlite_tuning import release_maintenance
+
+from nti.analytics_database.sqlite_tuning import tune
+
+from nti.analytics_database.write_behind import WriteBehindQueue
+
 logger = __import__('logging').getLogger(__name__)
 
 
@@ -71,18 +118,136 @@ def _make_safe_for_logging(uri):
     return urllib_parse.urlunparse(parts)
 
 
+def _split_uris(uris):
+    if not uris:
+        return ()
+    if isinstance(uris, six.string_types):
+        uris = uris.split()
+    return tuple(uris)
+
+
+#: The options of the ``[analytics]`` config section, and the
+#: :class:`~configparser.ConfigParser` method reading each
+CONFIG_OPTIONS = (
+    ('dburi', 'get'),
+    ('twophase', 'getboolean'),
+    ('autocommit', 'getboolean'),
+    ('writebehind', 'getboolean'),
+    ('readers', 'get'),
+    ('reader_policy', 'get'),
+    ('metrics', 'getboolean'),
+    ('slow_query_threshold', 'getfloat'),
+    ('slow_query_log', 'get'),
+    ('pool_size', 'getint'),
+    ('max_overflow', 'getint'),
+    ('pool_recycle', 'getint'),
+    ('adaptive_max_overflow', 'getint'),
+    ('pool_timeout', 'getfloat'),
+    ('session_scope', 'get'),
+    ('sqlite_tuning', 'getboolean'),
+    ('force_schema', 'getboolean'),
+    ('retry_attempts', 'getint'),
+    ('retry_max_delay', 'getfloat'),
+    ('group_commit', 'getboolean'),
+    ('group_commit_window', 'getfloat'),
+    ('lazy_load_threshold', 'getint'),
+)
+
+
+def read_config(config):
+    """
+    Return the options set in the ``[analytics]`` section of the given
+    config file.
+    """
+    parser = configparser.ConfigParser()
+    parser.read([os.path.expandvars(config)])
+    result = {}
+    for name, getter in CONFIG_OPTIONS:
+        if parser.has_option('analytics', name):
+            result[name] = getattr(parser, getter)('analytics', name)
+    if 'readers' in result:
+        result['readers'] = _split_uris(result['readers'])
+    return result
+
+
+class ReplicaSession(Session):
+    """
+    A session that reads from a replica engine of its :class:`AnalyticsDB`,
+    chosen once per session, while flushes and DML statements go to
+    the primary.
+    """
+
+    def __init__(self, db=None, **kwargs):
+        super(ReplicaSession, self).__init__(**kwargs)
+        self._analytics_db = db
+        self._reader = None
+
+    def get_bind(self, mapper=None, clause=None, *unused_args, **unused_kwargs):
+        # pylint: disable=arguments-differ
+        if self._flushing or isinstance(clause, UpdateBase):
+            return self._analytics_db.engine
+        if self._reader is None:
+            self._reader = self._analytics_db.reader_engine()
+        return self._reader
+
+    def close(self):
+        super(ReplicaSession, self).close()
+        self._reader = None
+
+
 @interface.implementer(IAnalyticsDB)
 class AnalyticsDB(object):
 
     pool_size = 30
     max_overflow = 10
     pool_recycle = 300
+    pool_timeout = 30
+
+    #: The (shared) :class:`.SQLiteMaintenance` of a tuned SQLite file
+    #: database
+    sqlite_maintenance = None
+
+    #: How a reader engine is picked: ``round-robin`` or ``least-busy``
+    #: (fewest checked out connections).
+    READER_POLICIES = ('round-robin', 'least-busy')
 
     def __init__(self, dburi=None, twophase=False, autocommit=False, echo=False,
-                 defaultSQLite=False, testmode=False, config=None, metadata=True):
+                 defaultSQLite=False, testmode=False, config=None, metadata=True,
+                 writebehind=False, readers=None, reader_policy='round-robin',
+                 metrics=False, slow_query_threshold=None, slow_query_log=None,
+                 pool_size=None, max_overflow=None, pool_recycle=None,
+                 adaptive_max_overflow=None, pool_timeout=None, session_scope='thread',
+                 sqlite_tuning=False, force_schema=False, retry_attempts=None,
+                 retry_max_delay=None, group_commit=False, group_commit_window=None,
+                 lazy_load_threshold=None):
         self.dburi = dburi
+        self.lazy_load_threshold = lazy_load_threshold
+        self.group_commit = group_commit
+        self.group_commit_window = group_commit_window
+        self.retry_attempts = retry_attempts
+        self.retry_max_delay = retry_max_delay
+        self.force_schema = force_schema
+        self.sqlite_tuning = sqlite_tuning
+        if pool_timeout is not None:
+            self.pool_timeout = pool_timeout
+        self.session_scope = session_scope
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if max_overflow is not None:
+            self.max_overflow = max_overflow
+        if pool_recycle is not None:
+            self.pool_recycle = pool_recycle
+        self.adaptive_max_overflow = adaptive_max_overflow
+        self.metrics = metrics
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_query_log = slow_query_log
+        self._id_allocators = {}
+        self._id_allocators_lock = threading.Lock()
+        self.readers = _split_uris(readers)
+        self.reader_policy = reader_policy
         self.twophase = twophase
         self.autocommit = autocommit
+        self.writebehind = writebehind
         self.echo = echo
         self.testmode = testmode
         self.defaultSQLite = defaultSQLite
@@ -94,51 +259,139 @@ class AnalyticsDB(object):
             # See relstorage and nti.monkey
             self.dburi = "gevent+sqlite:///%s" % data_file
         elif config:
-            config_name = os.path.expandvars(config)
-            parser = configparser.ConfigParser()
-            parser.read([config_name])
-            if parser.has_option('analytics', 'dburi'):
-                self.dburi = parser.get('analytics', 'dburi')
-            if parser.has_option('analytics', 'twophase'):
-                self.twophase = parser.getboolean('analytics', 'twophase')
-            if parser.has_option('analytics', 'autocommit'):
-                self.autocommit = parser.getboolean('analytics', 'autocommit')
+            for name, value in read_config(config).items():
+                setattr(self, name, value)
 
+        if self.reader_policy not in self.READER_POLICIES:
+            raise ValueError("Unknown reader policy '%s'" % self.reader_policy)
+        if self.session_scope not in SESSION_SCOPES:
+            raise ValueError("Unknown session scope '%s'" % self.session_scope)
+        if      self.session_scope == 'greenlet' \
+            and not greenlet_local(type(transaction.manager)):
+            # Sessions would be per greenlet but their transaction per thread
+            logger.warning("Greenlet scoped analytics sessions share the "
+                           "transaction of their thread; monkey patch threading "
+                           "before importing transaction.")
         if metadata:
             logger.info("Connecting to database at '%s' (twophase=%s) (testmode=%s)",
                         _make_safe_for_logging(self.dburi), self.twophase, self.testmode)
-            self.metadata = AnalyticsMetadata(self.engine)
+            self.metadata = AnalyticsMetadata(self.engine, force=self.force_schema)
         else:
             self.metadata = None
 
-    @Lazy
-    def engine(self):
-        if self.dburi == 'sqlite://':
+    def _create_engine(self, dburi, name='primary'):
+        if dburi == 'sqlite://':
             # In-memory connections have a different db per connection, so let's make
             # them share a db connection to avoid missing metadata issues.
             # Only for tests.
-            result = create_engine(self.dburi,
+            result = create_engine(dburi,
                                    connect_args={'check_same_thread': False},
                                    echo=self.echo,
                                    poolclass=StaticPool)
 
-        elif   self.dburi.startswith('sqlite') \
-            or self.dburi.startswith('gevent+sqlite'):
-            result = create_engine(self.dburi,
-                                   echo=self.echo)
+        elif   dburi.startswith('sqlite') \
+            or dburi.startswith('gevent+sqlite'):
+            kwargs = {}
+            if self.session_scope == 'greenlet' or self.sqlite_tuning:
+                # SQLite files get a NullPool by default, connecting on
+                # every checkout; keep a bounded pool instead, so that
+                # many greenlets queue for connections and tuned
+                # connections keep their pragmas and page cache.
+                kwargs = {'connect_args': {'check_same_thread': False},
+                          'poolclass': InstrumentedQueuePool,
+                          'pool_size': self.pool_size,
+                          'max_overflow': self.max_overflow,
+                          'pool_timeout': self.pool_timeout}
+            result = create_engine(dburi,
+                                   echo=self.echo,
+                                   **kwargs)
+            if self.sqlite_tuning:
+                tune(result)
+                if name == 'primary':
+                    self.sqlite_maintenance = acquire_maintenance(result)
 
             @event.listens_for(result, "begin")
             def do_begin(conn):
                 conn.execute("BEGIN DEFERRED TRANSACTION")
         else:
-            result = create_engine(self.dburi,
+            result = create_engine(dburi,
+                                   poolclass=InstrumentedQueuePool,
                                    pool_size=self.pool_size,
                                    max_overflow=self.max_overflow,
                                    pool_recycle=self.pool_recycle,
+                                   pool_timeout=self.pool_timeout,
                                    echo=self.echo,
                                    echo_pool=False)
+            if self.adaptive_max_overflow is not None:
+                result.pool.sizer = AdaptiveOverflow(self.max_overflow,
+                                                     self.adaptive_max_overflow)
+        if self.statement_metrics is not None:
+            self.statement_metrics.attach(result)
+        if self.pool_metrics is not None:
+            self.pool_metrics.attach(result, name)
+        if self.slow_queries is not None:
+            self.slow_queries.attach(result)
+        if self.lazy_loads is not None:
+            self.lazy_loads.attach(result)
         return result
 
+    @Lazy
+    def statement_metrics(self):
+        # Latency histograms per statement kind and table for all of our
+        # engines, if enabled.
+        return StatementMetrics() if self.metrics else None
+
+    @Lazy
+    def pool_metrics(self):
+        # Checkout waits and pool events per engine, if enabled.
+        return PoolMetrics() if self.metrics else None
+
+    @Lazy
+    def slow_queries(self):
+        # Logs the plans of statements over the threshold, if set.
+        if self.slow_query_threshold is None:
+            return None
+        return SlowQueryLog(self.slow_query_threshold,
+                            log_file=self.slow_query_log)
+
+    @Lazy
+    def lazy_loads(self):
+        # Counts statements and lazy loads per transaction, logging
+        # N+1 lazy loads, if a threshold is set.
+        if self.lazy_load_threshold is None:
+            return None
+        return LazyLoadDetector(self.lazy_load_threshold)
+
+    @Lazy
+    def engine(self):
+        return self._create_engine(self.dburi)
+
+    @Lazy
+    def reader_engines(self):
+        for uri in self.readers:
+            logger.info("Using analytics read replica at '%s'",
+                        _make_safe_for_logging(uri))
+        return tuple(self._create_engine(uri, 'reader%d' % idx)
+                     for idx, uri in enumerate(self.readers))
+
+    @Lazy
+    def _reader_cycle(self):
+        return itertools.cycle(self.reader_engines)
+
+    def reader_engine(self):
+        """
+        Return the engine read-only work should use: one of the
+        replicas, or the primary if there are none.
+        """
+        if not self.reader_engines:
+            return self.engine
+        if self.reader_policy == 'least-busy':
+            def checkedout(engine):
+                pool = engine.pool
+                return pool.checkedout() if hasattr(pool, 'checkedout') else 0
+            return min(self.reader_engines, key=checkedout)
+        return next(self._reader_cycle)
+
     @Lazy
     def sessionmaker(self):
         if self.autocommit:
@@ -157,19 +410,173 @@ class AnalyticsDB(object):
             result = sessionmaker(bind=self.engine,
                                   autoflush=True,
                                   twophase=self.twophase)
+        if self.lazy_loads is not None:
+            self.lazy_loads.attach_session(result)
         return result
 
     @Lazy
     def session(self):
         # This session_scoped object acts as a proxy to the underlying,
-        # thread-local session objects.
-        result = scoped_session(self.sessionmaker)
+        # thread (or greenlet) local session objects.
+        result = make_scoped_session(self.sessionmaker, self.session_scope)
         if self.dburi != 'sqlite://' or not self.autocommit:
             # Tests
             register(result)
         return result
 
+    @Lazy
+    def reader_sessionmaker(self):
+        result = sessionmaker(class_=ReplicaSession, db=self)
+        if self.lazy_loads is not None:
+            self.lazy_loads.attach_session(result)
+        return result
+
+    @Lazy
+    def reader_session(self):
+        # Reporting and dashboard queries that do not need to see this
+        # transaction's writes; they run against a read replica so they do
+        # not compete with ingestion for the primary's pool.
+        result = make_scoped_session(self.reader_sessionmaker, self.session_scope)
+        register(result)
+        return result
+
+    @Lazy
+    def dimension_cache(self):
+        return DimensionCache()
+
+    def get_dimension_ids(self, model, natural_ids):
+        """
+        Map the natural (dataserver) ids of a dimension table such as
+        :class:`.Users` or :class:`.Resources` to their surrogate ids,
+        resolving cache misses with a single query. Unknown ids are
+        absent from the result.
+        """
+        return self.dimension_cache.resolve(self.session, model, natural_ids)
+
+    def get_dimension_id(self, model, natural_id):
+        return self.get_dimension_ids(model, (natural_id,)).get(natural_id)
+
+    def cache_dimension_id(self, model, natural_id, surrogate_id):
+        """
+        Cache a newly created dimension row; other threads see it once
+        the transaction commits, and it is dropped if the transaction
+        aborts.
+        """
+        self.dimension_cache.put(model, natural_id, surrogate_id)
+
+    def get_or_create_dimension_id(self, model, values):
+        """
+        Return the surrogate id of the dimension row identified by the
+        natural key in ``values``, upserting it if needed.
+        """
+        natural_id = get_dimension(model).natural_id(values)
+        result = self.dimension_cache.get(model, natural_id)
+        if result is None:
+            result = get_or_create(self.session, model, values)
+            self.cache_dimension_id(model, natural_id, result)
+        return result
+
+    def get_or_create_dimension_ids(self, model, rows):
+        """
+        Bulk :meth:`get_or_create_dimension_id`, returning a dict of
+        natural id to surrogate id.
+        """
+        dimension = get_dimension(model)
+        rows = {dimension.natural_id(x): x for x in rows}
+        result = self.dimension_cache.get_many(model, rows)
+        missing = [v for k, v in rows.items() if k not in result]
+        if missing:
+            created = get_or_create_many(self.session, model, missing)
+            self.dimension_cache.put_many(model, created)
+            result.update(created)
+        return result
+
+    def get_id_allocator(self, model):
+        """
+        Return the process-wide :class:`.BlockIdAllocator` for the given
+        mapped class (or table).
+        """
+        table = get_table(model)
+        with self._id_allocators_lock:
+            result = self._id_allocators.get(table)
+            if result is None:
+                result = BlockIdAllocator(self.engine, table)
+                self._id_allocators[table] = result
+        return result
+
+    @Lazy
+    def batch_writer(self):
+        # Multi-row inserts for high-volume event tables; rows commit
+        # or abort with the surrounding transaction.
+        return BatchedWriter(self)
+
+    @Lazy
+    def writebehind_queue(self):
+        # Events queued here are persisted by a background worker with
+        # its own engine, outside of the request transaction.
+        if not self.writebehind:
+            return None
+        # In-memory databases are per-connection, so share ours (tests).
+        engine = self.engine if self.dburi == 'sqlite://' else None
+        result = WriteBehindQueue(self.dburi, engine=engine,
+                                  retry_policy=self.retry_policy).start()
+        atexit.register(result.close)
+        return result
+
+    @Lazy
+    def group_commit_writer(self):
+        # Rows added here are written when their transaction commits,
+        # together with those of other transactions committing within
+        # the same few milliseconds, in one database commit.
+        if not self.group_commit:
+            return None
+        committer = GroupCommitter(self.engine,
+                                   window=self.group_commit_window,
+                                   retry_policy=self.retry_policy).start()
+        atexit.register(committer.close)
+        return GroupCommitWriter(committer)
+
+    @Lazy
+    def retry_policy(self):
+        # Retries (and counts per table) units of work that hit a
+        # deadlock or lock timeout.
+        return RetryPolicy(attempts=self.retry_attempts,
+                           max_delay=self.retry_max_delay)
+
+    def run_in_transaction(self, func, *args, **kwargs):
+        """
+        Call ``func`` in a transaction of its own and commit it, running
+        the whole transaction again (with :attr:`retry_policy`) if it
+        fails on a deadlock or lock timeout. Returns what ``func``
+        returns.
+
+        Work joined to a transaction owned by the caller (e.g. the
+        dataserver request) cannot be retried here; the owner's retry
+        loop has to run it again. Beginning a transaction would abort
+        that work, so :class:`~transaction.interfaces.AlreadyInTransaction`
+        is raised instead when the current transaction has any.
+        """
+        txn = transaction.get()
+        # pylint: disable=protected-access
+        if txn._resources or any(txn.getBeforeCommitHooks()):
+            raise AlreadyInTransaction("Cannot run in a transaction of its own "
+                                       "while the current one has pending work")
+
+        def attempt():
+            with transaction.manager:
+                return func(*args, **kwargs)
+        return self.retry_policy(attempt)
+
     def savepoint(self):
         if not self.testmode and not self.defaultSQLite:
             return transaction.savepoint()
         return None
+
+    def close(self):
+        """
+        Stop the background work this database started for its SQLite
+        file (shared maintenance stops when its last user closes).
+        """
+        maintenance = self.__dict__.pop('sqlite_maintenance', None)
+        if maintenance is not None:
+            release_maintenance(maintenance)
@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Dimension tables and a process-wide cache of their surrogate keys.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import threading
+
+from collections import OrderedDict
+
+import transaction
+
+from sqlalchemy import func
+from sqlalchemy import tuple_
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+from sqlalchemy.orm import scoped_session
+
+from zope.cachedescriptors.property import Lazy
+
+from zope.sqlalchemy import mark_changed
+
+from nti.analytics_database.enrollments import EnrollmentTypes
+
+from nti.analytics_database.mime_types import FileMimeTypes
+
+from nti.analytics_database.resources import Resources
+
+from nti.analytics_database.root_context import Books
+from nti.analytics_database.root_context import Courses
+from nti.analytics_database.root_context import set_context_types
+
+from nti.analytics_database.sessions import Location
+from nti.analytics_database.sessions import UserAgents
+from nti.analytics_database.sessions import user_agent_hash
+
+from nti.analytics_database.users import Users
+
+try:
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+except ImportError:  # pragma: no cover
+    # SQLAlchemy < 1.4
+    sqlite_insert = None
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class Dimension(object):
+    """
+    Describes how a dimension table maps a natural (dataserver) id to
+    its surrogate key. The natural key may be a single column name or a
+    tuple of names, in which case natural ids are tuples.
+    """
+
+    #: Keep ``IN`` lists under SQLite's bound parameter limit
+    chunk_size = 500
+
+    def __init__(self, model, natural_key, id_column):
+        self.model = model
+        self.natural_key = natural_key
+        self.id_column = id_column
+
+    @property
+    def table(self):
+        return self.model.__table__
+
+    @property
+    def natural_keys(self):
+        if isinstance(self.natural_key, tuple):
+            return self.natural_key
+        return (self.natural_key,)
+
+    @property
+    def natural_column(self):
+        if isinstance(self.natural_key, tuple):
+            return tuple_(*[getattr(self.model, x) for x in self.natural_key])
+        return getattr(self.model, self.natural_key)
+
+    @property
+    def id_attr(self):
+        return getattr(self.model, self.id_column)
+
+    @Lazy
+    def unique(self):
+        """
+        Whether the natural key is backed by a unique constraint or index,
+        which dialect upserts need to detect conflicts.
+        """
+        keys = set(self.natural_keys)
+        table = self.table
+        if len(keys) == 1 and table.c[self.natural_keys[0]].unique:
+            return True
+        for constraint in list(table.indexes) + list(table.constraints):
+            if     getattr(constraint, 'unique', False) \
+                or constraint.__class__.__name__ == 'UniqueConstraint':
+                if set(x.name for x in constraint.columns) == keys:
+                    return True
+        return False
+
+    def natural_id(self, values):
+        if isinstance(self.natural_key, tuple):
+            return tuple(values[x] for x in self.natural_key)
+        return values[self.natural_key]
+
+    def inserted(self, session, surrogate_ids):
+        """
+        Called with the ids of rows :func:`get_or_create` and
+        :func:`get_or_create_many` may have just inserted.
+        """
+
+    def lookup(self, session, natural_ids):
+        """
+        Resolve the given natural ids with a single ``IN (...)`` query
+        (per ``chunk_size`` ids), returning a dict of the ids found.
+        """
+        result = {}
+        natural_ids = list(natural_ids)
+        columns = [getattr(self.model, x) for x in self.natural_keys]
+        composite = isinstance(self.natural_key, tuple)
+        for idx in range(0, len(natural_ids), self.chunk_size):
+            chunk = natural_ids[idx:idx + self.chunk_size]
+            rows = session.query(self.id_attr, *columns) \
+                          .filter(self.natural_column.in_(chunk)) \
+                          .order_by(self.id_attr)
+            for row in rows:
+                natural_id = tuple(row[1:]) if composite else row[1]
+                # Keep the oldest row if there are duplicates.
+                result.setdefault(natural_id, row[0])
+        return result
+
+
+class UserAgentDimension(Dimension):
+    """
+    Looks user agents up through the indexed ``user_agent_hash`` column
+    and the full string, as distinct user agents may share a hash.
+
+    Neither is unique, so missing user agents are inserted after a
+    lookup rather than upserted; rows concurrent writers duplicate are
+    harmless, as lookups return the oldest.
+    """
+
+    def __init__(self):
+        super(UserAgentDimension, self).__init__(UserAgents, 'user_agent', 'user_agent_id')
+
+    def lookup(self, session, natural_ids):
+        result = {}
+        natural_ids = sorted(set(natural_ids))
+        for idx in range(0, len(natural_ids), self.chunk_size):
+            chunk = natural_ids[idx:idx + self.chunk_size]
+            wanted = set(chunk)
+            hashes = set(user_agent_hash(x) for x in chunk)
+            rows = session.query(UserAgents.user_agent_id, UserAgents.user_agent) \
+                          .filter(UserAgents.user_agent_hash.in_(hashes)) \
+                          .filter(UserAgents.user_agent.in_(chunk)) \
+                          .order_by(UserAgents.user_agent_id)
+            for surrogate_id, user_agent in rows:
+                # Case insensitive (mysql) collations match other cases
+                if user_agent in wanted:
+                    result.setdefault(user_agent, surrogate_id)
+        return result
+
+
+class RootContextDimension(Dimension):
+    """
+    Books and courses, whose inserts here bypass the ORM event recording
+    their table on the ``ContextId`` row; this records it instead.
+    """
+
+    def __init__(self, model):
+        super(RootContextDimension, self).__init__(model, 'context_ds_id', 'context_id')
+
+    def inserted(self, session, surrogate_ids):
+        set_context_types(session, self.model, surrogate_ids)
+
+
+#: The dimension tables resolved by natural id.
+DIMENSIONS = {
+    Users: Dimension(Users, 'user_ds_id', 'user_id'),
+    Resources: Dimension(Resources, 'resource_ds_id', 'resource_id'),
+    Courses: RootContextDimension(Courses),
+    Books: RootContextDimension(Books),
+    UserAgents: UserAgentDimension(),
+    FileMimeTypes: Dimension(FileMimeTypes, 'mime_type', 'file_mime_type_id'),
+    EnrollmentTypes: Dimension(EnrollmentTypes, 'type_name', 'type_id'),
+    Location: Dimension(Location, ('latitude', 'longitude'), 'location_id'),
+}
+
+
+def get_dimension(model):
+    try:
+        return DIMENSIONS[model]
+    except KeyError:
+        raise TypeError("%s is not a dimension table" % model)
+
+
+class _CacheSavepoint(object):
+
+    def __init__(self, dm):
+        self.dm = dm
+        self.entries = OrderedDict(dm.entries)
+
+    def rollback(self):
+        self.dm.entries = OrderedDict(self.entries)
+
+
+class _DimensionCacheDataManager(object):
+    """
+    Holds the cache entries populated during a transaction, visible only
+    to that transaction, and publishes them to the shared cache when it
+    has committed; those rows may have been created (and only flushed)
+    by it. Aborting, or rolling back to a savepoint, drops them.
+    """
+
+    def __init__(self, cache, txn_manager):
+        self.cache = cache
+        self.transaction_manager = txn_manager
+        self.entries = OrderedDict()
+
+    def abort(self, unused_txn):
+        self.entries.clear()
+        self.cache._local.dm = None
+
+    tpc_abort = abort
+
+    def tpc_begin(self, unused_txn):
+        pass
+
+    def commit(self, unused_txn):
+        pass
+
+    def tpc_vote(self, unused_txn):
+        pass
+
+    def tpc_finish(self, unused_txn):
+        self.cache._publish(self.entries)
+        self.entries.clear()
+        self.cache._local.dm = None
+
+    def savepoint(self):
+        return _CacheSavepoint(self)
+
+    def sortKey(self):
+        return 'analytics_dimension_cache:%d' % id(self)
+
+
+class DimensionCache(object):
+    """
+    A size-bounded LRU cache of ``(table, natural id) -> surrogate id``,
+    shared by all threads.
+
+    Entries put during a transaction are only seen by that transaction
+    until it commits, so other threads never get the id of a row that
+    is not committed.
+    """
+
+    maxsize = 50000
+
+    def __init__(self, maxsize=None, transaction_manager=None):
+        if maxsize is not None:
+            self.maxsize = maxsize
+        self.transaction_manager = transaction_manager or transaction.manager
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _key(self, model, natural_id):
+        return (get_dimension(model).model, natural_id)
+
+    def _dm(self, join=False):
+        """
+        The data manager holding the current transaction's entries.
+        """
+        txn = self.transaction_manager.get()
+        dm = getattr(self._local, 'dm', None)
+        if dm is None or getattr(self._local, 'txn', None) is not txn:
+            if not join:
+                return None
+            dm = _DimensionCacheDataManager(self, self.transaction_manager)
+            txn.join(dm)
+            self._local.dm = dm
+            self._local.txn = txn
+        return dm
+
+    def get(self, model, natural_id):
+        return self.get_many(model, (natural_id,)).get(natural_id)
+
+    def get_many(self, model, natural_ids):
+        result = {}
+        dm = self._dm()
+        pending = dm.entries if dm is not None else {}
+        with self._lock:
+            for natural_id in natural_ids:
+                key = self._key(model, natural_id)
+                try:
+                    surrogate_id = pending[key]
+                except KeyError:
+                    try:
+                        surrogate_id = self._data.pop(key)
+                    except KeyError:
+                        self.misses += 1
+                        continue
+                    self._data[key] = surrogate_id
+                result[natural_id] = surrogate_id
+                self.hits += 1
+        return result
+
+    def put(self, model, natural_id, surrogate_id):
+        self.put_many(model, {natural_id: surrogate_id})
+
+    def put_many(self, model, values):
+        """
+        Cache the given natural ids' surrogate ids once the current
+        transaction commits.
+        """
+        entries = self._dm(join=True).entries
+        for natural_id, surrogate_id in values.items():
+            entries[self._key(model, natural_id)] = surrogate_id
+
+    def _publish(self, entries):
+        with self._lock:
+            for key, surrogate_id in entries.items():
+                self._data.pop(key, None)
+                self._data[key] = surrogate_id
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, model, natural_ids):
+        keys = [self._key(model, x) for x in natural_ids]
+        dm = self._dm()
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                if dm is not None:
+                    dm.entries.pop(key, None)
+
+    def clear(self):
+        dm = self._dm()
+        with self._lock:
+            self._data.clear()
+            if dm is not None:
+                dm.entries.clear()
+
+    def resolve(self, session, model, natural_ids):
+        """
+        Cache-aside resolution of natural ids to surrogate ids; all misses
+        are looked up with a single query. Ids that do not exist are
+        absent from the result.
+        """
+        natural_ids = set(natural_ids)
+        result = self.get_many(model, natural_ids)
+        missing = natural_ids.difference(result)
+        if missing:
+            found = get_dimension(model).lookup(session, missing)
+            if found:
+                self.put_many(model, found)
+                result.update(found)
+        return result
+
+
+def _real_session(session):
+    return session() if isinstance(session, scoped_session) else session
+
+
+def _dialect_name(session, dimension):
+    return session.get_bind(mapper=dimension.model.__mapper__).dialect.name
+
+
+def _insert_ignore(dialect_name, dimension):
+    """
+    Return an ``INSERT`` for the dimension table that skips rows whose
+    natural key already exists, or None if the dialect (or table) does
+    not support it.
+    """
+    table = dimension.table
+    if not dimension.unique:
+        return None
+    if dialect_name == 'postgresql':
+        return postgresql_insert(table).on_conflict_do_nothing(
+            index_elements=dimension.natural_keys)
+    if dialect_name == 'sqlite' and sqlite_insert is not None:
+        return sqlite_insert(table).on_conflict_do_nothing(
+            index_elements=dimension.natural_keys)
+    if dialect_name in ('mysql', 'mariadb'):
+        stmt = mysql_insert(table)
+        key = dimension.natural_keys[0]
+        return stmt.on_duplicate_key_update({key: stmt.inserted[key]})
+    return None
+
+
+def get_or_create(session, model, values):
+    """
+    Return the surrogate id of the dimension row with the natural key in
+    ``values``, inserting the row (with all of ``values``) if needed.
+
+    On PostgreSQL and MySQL this is a single upsert statement; SQLite uses
+    ``INSERT ... ON CONFLICT DO NOTHING`` followed by a lookup. Tables
+    without a unique natural key fall back to a lookup followed by an
+    insert.
+    """
+    dimension = get_dimension(model)
+    session = _real_session(session)
+    natural_id = dimension.natural_id(values)
+    dialect_name = _dialect_name(session, dimension)
+    table = dimension.table
+    id_column = table.c[dimension.id_column]
+    result = None
+    inserted = True
+    if dimension.unique and dialect_name == 'postgresql':
+        key = dimension.natural_keys[0]
+        stmt = postgresql_insert(table).values(**values)
+        # A no-op update so the existing row is returned on conflict
+        stmt = stmt.on_conflict_do_update(index_elements=dimension.natural_keys,
+                                          set_={key: stmt.excluded[key]})
+        result = session.execute(stmt.returning(id_column)).scalar()
+    elif dimension.unique and dialect_name in ('mysql', 'mariadb'):
+        stmt = mysql_insert(table).values(**values)
+        # LAST_INSERT_ID(expr) makes lastrowid the existing row's id
+        stmt = stmt.on_duplicate_key_update(
+            {dimension.id_column: func.last_insert_id(id_column)})
+        result = session.execute(stmt).lastrowid
+    else:
+        stmt = _insert_ignore(dialect_name, dimension)
+        if stmt is not None:
+            session.execute(stmt.values(**values))
+        else:
+            result = dimension.lookup(session, (natural_id,)).get(natural_id)
+            if result is None:
+                result = session.execute(table.insert().values(**values)) \
+                                .inserted_primary_key[0]
+            else:
+                inserted = False
+        if result is None:
+            result = dimension.lookup(session, (natural_id,))[natural_id]
+    if inserted:
+        dimension.inserted(session, (result,))
+    mark_changed(session)
+    return result
+
+
+def get_or_create_many(session, model, rows):
+    """
+    Bulk :func:`get_or_create`: return a dict of natural id to surrogate id
+    for all the given rows, using one lookup for existing keys, one
+    multi-row insert for missing ones and one lookup for their ids.
+    """
+    dimension = get_dimension(model)
+    session = _real_session(session)
+    rows = {dimension.natural_id(x): x for x in rows}
+    result = dimension.lookup(session, rows)
+    missing = [v for k, v in rows.items() if k not in result]
+    if missing:
+        stmt = _insert_ignore(_dialect_name(session, dimension), dimension)
+        if stmt is None:
+            stmt = dimension.table.insert()
+        session.execute(stmt, missing)
+        mark_changed(session)
+        created = dimension.lookup(session, [dimension.natural_id(x) for x in missing])
+        dimension.inserted(session, created.values())
+        result.update(created)
+    return result
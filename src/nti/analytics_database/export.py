@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Streaming export of analytics tables.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import csv
+import json
+
+from datetime import date
+from datetime import datetime
+
+from sqlalchemy import or_
+from sqlalchemy import and_
+from sqlalchemy import true
+from sqlalchemy import select
+
+from nti.analytics_database.batching import get_table
+
+from nti.analytics_database.users import Users
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The default number of rows fetched per keyset query
+CHUNK_SIZE = 1000
+
+
+def _after(columns, values):
+    """
+    A clause selecting rows whose ``columns`` sort after ``values``,
+    spelled out so it does not depend on row-value comparison support.
+    """
+    clauses = []
+    for idx, column in enumerate(columns):
+        equal = [c == v for c, v in zip(columns[:idx], values[:idx])]
+        clauses.append(and_(*(equal + [column > values[idx]])))
+    return or_(*clauses)
+
+
+def export_query(model, research=False, where=None):
+    """
+    Return the base select for exporting the given mapped class (or
+    table). With ``research``, only rows of users who allow research are
+    selected; the table must then have a ``user_id`` column.
+    """
+    table = get_table(model)
+    query = select([table])
+    if research:
+        users = Users.__table__
+        if table is users:
+            query = query.where(users.c.allow_research == true())
+        elif 'user_id' in table.c:
+            query = query.select_from(table.join(users, users.c.user_id == table.c.user_id)) \
+                         .where(users.c.allow_research == true())
+        else:
+            raise TypeError("%s has no user_id to filter research exports by" % table.name)
+    if where is not None:
+        query = query.where(where)
+    return query
+
+
+def iter_chunks(engine, model, chunk_size=CHUNK_SIZE, research=False, where=None):
+    """
+    Iterate over lists of up to ``chunk_size`` rows of the given mapped
+    class (or table), in primary key order.
+
+    Each chunk is its own keyset query (``WHERE pk > last ORDER BY pk
+    LIMIT n``) executed with ``stream_results``, so neither the driver nor
+    this process ever holds more than one chunk.
+    """
+    table = get_table(model)
+    keys = list(table.primary_key.columns)
+    base = export_query(table, research, where).order_by(*keys).limit(chunk_size)
+    last = None
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        while True:
+            query = base if last is None else base.where(_after(keys, last))
+            rows = conn.execute(query).fetchall()
+            if not rows:
+                break
+            yield rows
+            if len(rows) < chunk_size:
+                break
+            last = [rows[-1][c] for c in keys]
+
+
+def iter_rows(engine, model, **kwargs):
+    """
+    Iterate over the rows of the given mapped class (or table); see
+    :func:`iter_chunks`.
+    """
+    for chunk in iter_chunks(engine, model, **kwargs):
+        for row in chunk:
+            yield row
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def export_csv(engine, model, stream, **kwargs):
+    """
+    Write the rows of the given mapped class (or table) to ``stream``
+    as CSV with a header row. Returns the number of rows written.
+    """
+    table = get_table(model)
+    writer = csv.writer(stream)
+    writer.writerow(table.c.keys())
+    count = 0
+    for chunk in iter_chunks(engine, table, **kwargs):
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+
+def export_jsonl(engine, model, stream, **kwargs):
+    """
+    Write the rows of the given mapped class (or table) to ``stream``
+    as JSON Lines. Returns the number of rows written.
+    """
+    table = get_table(model)
+    names = table.c.keys()
+    count = 0
+    for chunk in iter_chunks(engine, table, **kwargs):
+        for row in chunk:
+            stream.write(json.dumps(dict(zip(names, row)),
+                                    default=_json_default,
+                                    sort_keys=True))
+            stream.write('\n')
+        count += len(chunk)
+    return count
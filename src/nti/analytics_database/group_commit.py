@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Group commit: the rows of many small transactions written in one
+physical database commit.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import threading
+
+from collections import OrderedDict
+
+import transaction
+
+from six.moves import queue
+
+from nti.analytics_database.batching import get_table
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Placed on the queue by :meth:`GroupCommitter.close` to stop the worker
+_STOP = object()
+
+
+class _Submission(object):
+
+    def __init__(self, buffers):
+        self.buffers = buffers
+        self.rows = sum(len(x) for x in buffers.values())
+        self.error = None
+        self.done = threading.Event()
+        self.started = False
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def claim(self):
+        """
+        Called by the worker before writing; whether it may be written.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self.started = True
+            return self.started
+
+    def cancel(self):
+        """
+        Called by a submitter that timed out; whether it is cancelled,
+        i.e. the worker has not started writing it.
+        """
+        with self._lock:
+            if not self.started:
+                self.cancelled = True
+            return self.cancelled
+
+
+class GroupCommitter(object):
+    """
+    Writes the rows submitted by any number of threads (or greenlets)
+    from a single worker thread, coalescing all the submissions that
+    arrive within ``window`` seconds of the first one (up to
+    ``max_rows`` rows) into one transaction on ``engine``.
+
+    Each submitter waits for the commit of its group and gets its own
+    outcome: if a group fails, its submissions are written again one
+    transaction each, so only the submissions that fail by themselves
+    see an error. A submission still queued after ``timeout`` seconds is
+    cancelled, and never written.
+    """
+
+    window = 0.005
+    max_rows = 5000
+    #: Seconds a submitter waits for its group to commit
+    timeout = 30
+
+    def __init__(self, engine, window=None, max_rows=None, retry_policy=None):
+        self.engine = engine
+        if window is not None:
+            self.window = window
+        if max_rows is not None:
+            self.max_rows = max_rows
+        self.retry_policy = retry_policy
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # metrics
+        self.submissions = 0
+        self.commits = 0
+        self.rows = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if not self.running:
+                self._thread = threading.Thread(target=self._run,
+                                                name='analytics-group-commit')
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def submit(self, buffers):
+        """
+        Write the given rows (lists of row dicts by table) with the next
+        group and wait for it; raises what writing them raised.
+        """
+        submission = _Submission(buffers)
+        self.start()
+        self._queue.put(submission)
+        if not submission.done.wait(self.timeout):
+            if submission.cancel():
+                raise RuntimeError("Timed out waiting for the analytics group commit")
+            # Too late to cancel, it is being written
+            submission.done.wait()
+        if submission.error is not None:
+            raise submission.error
+
+    def _collect(self, first):
+        group = [first]
+        rows = first.rows
+        deadline = time.time() + self.window
+        while rows < self.max_rows:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return group, True
+            group.append(item)
+            rows += item.rows
+        return group, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            group, stop = self._collect(item)
+            self._process(group)
+        # Whatever was submitted while stopping
+        group = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                group.append(item)
+        self._process(group)
+
+    def _process(self, group):
+        # Skip the submissions whose submitter gave up waiting
+        claimed = [x for x in group if x.claim()]
+        self.cancelled += len(group) - len(claimed)
+        if claimed:
+            self.submissions += len(claimed)
+            self._commit(claimed)
+
+    def _write(self, group):
+        def write():
+            with self.engine.begin() as conn:
+                buffers = OrderedDict()
+                for submission in group:
+                    for table, rows in submission.buffers.items():
+                        buffers.setdefault(table, []).extend(rows)
+                for table, rows in buffers.items():
+                    conn.execute(table.insert(), rows)
+        if self.retry_policy is not None:
+            self.retry_policy(write)
+        else:
+            write()
+        self.commits += 1
+
+    def _commit(self, group):
+        try:
+            self._write(group)
+        except Exception as e:  # pylint: disable=broad-except
+            if len(group) > 1:
+                # Find the culprits
+                for submission in group:
+                    self._commit([submission])
+                return
+            logger.warning("Failed to write %s analytics rows: %s", group[0].rows, e)
+            group[0].error = e
+            self.failed += 1
+        else:
+            self.rows += sum(x.rows for x in group)
+        for submission in group:
+            submission.done.set()
+
+    def close(self):
+        if self.running:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        return {'submissions': self.submissions,
+                'commits': self.commits,
+                'rows': self.rows,
+                'failed': self.failed,
+                'cancelled': self.cancelled}
+
+
+class _GroupCommitSavepoint(object):
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.lengths = {k: len(v) for k, v in writer._state.buffers.items()}
+
+    def rollback(self):
+        buffers = self.writer._state.buffers
+        for table in list(buffers):
+            length = self.lengths.get(table, 0)
+            if length:
+                del buffers[table][length:]
+            else:
+                del buffers[table]
+
+
+class _GroupCommitDataManager(object):
+    """
+    Hands a writer's buffered rows to its :class:`GroupCommitter` when
+    the transaction votes, after every other resource manager has voted
+    (it sorts after zope.sqlalchemy's ``~sqlalchemy`` manager, which
+    commits a one-phase session in its vote), so a failure to write
+    them aborts the transaction, and rows are only written once the
+    rest of the transaction could commit.
+    """
+
+    def __init__(self, writer, txn_manager):
+        self.writer = writer
+        self.transaction_manager = txn_manager
+
+    def abort(self, unused_txn):
+        self.writer.discard()
+        self.writer._reset()
+
+    def tpc_begin(self, unused_txn):
+        pass
+
+    def commit(self, unused_txn):
+        pass
+
+    def tpc_vote(self, unused_txn):
+        buffers = self.writer._state.buffers
+        if buffers:
+            self.writer.committer.submit(OrderedDict(buffers))
+
+    def tpc_finish(self, unused_txn):
+        self.writer.discard()
+        self.writer._reset()
+
+    def tpc_abort(self, unused_txn):
+        self.abort(unused_txn)
+
+    def savepoint(self):
+        return _GroupCommitSavepoint(self.writer)
+
+    def sortKey(self):
+        return '~~analytics_group_commit:%d' % id(self)
+
+
+class GroupCommitWriter(object):
+    """
+    Buffers plain row dicts per mapped table for the current transaction;
+    when it commits, they are written by the ``committer`` together with
+    the rows of other transactions committing at the same time, and the
+    transaction fails if its rows could not be written. Rows are
+    discarded if the transaction aborts.
+
+    Rows are written in the committer's own database transaction, not
+    the analytics session's: they cannot be read back before commit and
+    are committed even if another resource manager fails to finish.
+    """
+
+    def __init__(self, committer, transaction_manager=None):
+        self.committer = committer
+        self.transaction_manager = transaction_manager or transaction.manager
+        self._local = threading.local()
+
+    @property
+    def _state(self):
+        state = self._local
+        if not hasattr(state, 'buffers'):
+            state.buffers = OrderedDict()
+            state.txn = None
+        return state
+
+    def _join(self):
+        state = self._state
+        txn = self.transaction_manager.get()
+        if state.txn is not txn:
+            state.buffers.clear()
+            state.txn = txn
+            txn.join(_GroupCommitDataManager(self, self.transaction_manager))
+
+    def add(self, model, values=None, **kwargs):
+        """
+        Buffer a single row for the given mapped class (or table).
+        """
+        self.add_all(model, (dict(values or (), **kwargs),))
+
+    def add_all(self, model, rows):
+        self._join()
+        self._state.buffers.setdefault(get_table(model), []).extend(rows)
+
+    @property
+    def pending(self):
+        return sum(len(x) for x in self._state.buffers.values())
+
+    def discard(self):
+        self._state.buffers.clear()
+
+    def _reset(self):
+        self._state.txn = None
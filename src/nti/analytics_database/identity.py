@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Batch resolution of the dataserver objects behind analytics rows.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from sqlalchemy import inspect
+
+from sqlalchemy.orm import object_session
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from zope import component
+from zope import interface
+
+from nti.analytics_database.assessments import AssignmentsTaken
+from nti.analytics_database.assessments import SelfAssessmentsTaken
+
+from nti.analytics_database.boards import TopicMixin
+from nti.analytics_database.boards import ForumMixin
+from nti.analytics_database.boards import TopicsCreated
+from nti.analytics_database.boards import ForumsCreated
+
+from nti.analytics_database.interfaces import IAnalyticsDSIdentifier
+from nti.analytics_database.interfaces import IAnalyticsIntidIdentifier
+from nti.analytics_database.interfaces import IAnalyticsRootContextResolver
+
+from nti.analytics_database.meta_mixins import UserMixin
+from nti.analytics_database.meta_mixins import CourseMixin
+from nti.analytics_database.meta_mixins import CommentsMixin
+from nti.analytics_database.meta_mixins import ReplyToMixin
+from nti.analytics_database.meta_mixins import RootContextMixin
+
+from nti.analytics_database.resource_tags import NoteMixin
+from nti.analytics_database.resource_tags import NotesCreated
+
+from nti.analytics_database.root_context import Books
+from nti.analytics_database.root_context import Courses
+from nti.analytics_database.root_context import RootContextId
+
+from nti.analytics_database.users import Users
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The most ids we put in one ``IN`` clause
+CHUNK_SIZE = 500
+
+#: The properties :func:`preload` resolves: the property, the class
+#: declaring it, its override slot, the foreign key column, and the
+#: mapped class and column holding the dataserver id (or Nones if the
+#: row's own column holds it)
+PROPERTIES = (
+    ('user', UserMixin, '_user', 'user_id', Users, 'user_ds_id'),
+    ('RepliedToUser', ReplyToMixin, '_replied_to_user', 'parent_user_id', Users, 'user_ds_id'),
+    ('Forum', ForumMixin, '_forum', 'forum_id', ForumsCreated, 'forum_ds_id'),
+    ('Topic', TopicMixin, '_topic', 'topic_id', TopicsCreated, 'topic_ds_id'),
+    ('Note', NoteMixin, '_note', 'note_id', NotesCreated, 'note_ds_id'),
+    ('user', Users, '_user', 'user_ds_id', None, None),
+    ('Topic', TopicsCreated, '_topic', 'topic_ds_id', None, None),
+    ('Note', NotesCreated, '_note', 'note_ds_id', None, None),
+    ('Comment', CommentsMixin, '_comment', 'comment_id', None, None),
+    ('Submission', AssignmentsTaken, '_submission', 'submission_id', None, None),
+    ('Submission', SelfAssessmentsTaken, '_submission', 'submission_id', None, None),
+)
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for idx in range(0, len(values), size):
+        yield values[idx:idx + size]
+
+
+@interface.implementer(IAnalyticsDSIdentifier)
+class AnalyticsDSIdentifier(object):
+    """
+    A base for :class:`.IAnalyticsDSIdentifier` utilities, whose
+    :meth:`get_objects` calls :meth:`get_object` once per id. Utilities
+    that can look objects up in batches override it.
+    """
+
+    def get_id(self, obj):
+        raise NotImplementedError()
+
+    def get_object(self, obj_id):
+        raise NotImplementedError()
+
+    def get_objects(self, obj_ids):
+        return {x: self.get_object(x) for x in set(obj_ids)}
+
+
+def get_objects(id_utility, obj_ids):
+    """
+    Return a dict of the given dataserver ids to their objects (or None)
+    with the utility's ``get_objects``, or one ``get_object`` call per
+    id for utilities that neither have one nor derive from
+    :class:`AnalyticsDSIdentifier`.
+    """
+    obj_ids = set(obj_ids)
+    batch = getattr(id_utility, 'get_objects', None)
+    if batch is not None:
+        return dict(batch(obj_ids))
+    return {x: id_utility.get_object(x) for x in obj_ids}
+
+
+def _ds_ids(session, model, column, keys):
+    key = inspect(model).primary_key[0]
+    result = {}
+    for chunk in _chunks(keys):
+        query = session.query(key, getattr(model, column)).filter(key.in_(chunk))
+        result.update(query)
+    return result
+
+
+def preload(rows, names=None, id_utility=None, session=None):
+    """
+    Resolve the dataserver objects behind the :data:`PROPERTIES` (or
+    the given property ``names``) of all the given rows with (at most)
+    one query and one ``get_objects`` call per property, and store them
+    in the rows' override slots (``_user``, ``_note``...), so that reading the
+    properties does no further lookups. Slots already set are kept.
+
+    The queries use the given ``session``, or that of the rows. Without
+    either (detached rows), properties needing a query are left to be
+    resolved when read. Returns the rows.
+    """
+    rows = list(rows)
+    if id_utility is None:
+        id_utility = component.getUtility(IAnalyticsIntidIdentifier)
+    for name, mixin, slot, key, model, column in PROPERTIES:
+        if names is not None and name not in names:
+            continue
+        targets = [x for x in rows
+                   if isinstance(x, mixin)
+                   and getattr(x, slot) is None
+                   and getattr(x, key) is not None]
+        if not targets:
+            continue
+        keys = {getattr(x, key) for x in targets}
+        if model is None:
+            ds_ids = {x: x for x in keys}
+        else:
+            query_session = session
+            if query_session is None:
+                query_session = object_session(targets[0])
+            if query_session is None:
+                continue
+            ds_ids = _ds_ids(query_session, model, column, keys)
+        objects = get_objects(id_utility, (x for x in ds_ids.values() if x is not None))
+        for row in targets:
+            obj = objects.get(ds_ids.get(getattr(row, key)))
+            if obj is not None:
+                setattr(row, slot, obj)
+    return rows
+
+
+def _root_contexts(session, context_ids):
+    query = session.query(RootContextId, Books, Courses) \
+                   .outerjoin(Books, Books.context_id == RootContextId.context_id) \
+                   .outerjoin(Courses, Courses.context_id == RootContextId.context_id)
+    result = {}
+    for chunk in _chunks(context_ids):
+        for record, book, course in query.filter(RootContextId.context_id.in_(chunk)):
+            result[record.context_id] = (record, book, course)
+    return result
+
+
+def preload_root_contexts(rows, resolve=True, session=None):
+    """
+    Load the book or course records of all the given rows with one
+    query (per :data:`CHUNK_SIZE` context ids), so reading their
+    ``_root_context_record`` (or ``_course_record``) does no further
+    queries.
+
+    If ``resolve`` is true, and there is an
+    :class:`.IAnalyticsRootContextResolver`, also set the ``RootContext``
+    of the rows not having one, calling the resolver once per distinct
+    root (and entity root) context rather than once per row.
+
+    As with :func:`preload`, records are queried with the given
+    ``session`` or that of the rows, and not loaded without either.
+    Returns the rows.
+    """
+    rows = list(rows)
+    contexts = [x for x in rows if isinstance(x, RootContextMixin)]
+    courses = [x for x in rows if isinstance(x, CourseMixin)]
+    context_ids = {x.root_context_id for x in contexts}
+    context_ids.update(x.course_id for x in courses)
+    context_ids.discard(None)
+    if context_ids and session is None:
+        session = object_session((contexts or courses)[0])
+    if context_ids and session is not None:
+        records = _root_contexts(session, context_ids)
+        # Root contexts are keyed by their context id, so ids without
+        # one have no record either
+        missing = (None, None, None)
+        for row in contexts:
+            if row.root_context_id is not None:
+                record, book, course = records.get(row.root_context_id, missing)
+                set_committed_value(row, '_root_context_id_record', record)
+                set_committed_value(row, '_book_context_record', book)
+                set_committed_value(row, '_course_context_record', course)
+        for row in courses:
+            record = records.get(row.course_id, missing)
+            set_committed_value(row, '_course_record', record[2])
+    resolver = component.queryUtility(IAnalyticsRootContextResolver) if resolve else None
+    if resolver is not None:
+        resolved = {}
+        for row in contexts:
+            # pylint: disable=protected-access
+            if row._RootContext is None:
+                key = (row.root_context_id, row.entity_root_context_id)
+                if key not in resolved:
+                    resolved[key] = resolver(row)
+                row._RootContext = resolved[key]
+    return rows
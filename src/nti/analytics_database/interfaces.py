@@ -35,6 +35,20 @@ class IAnalyticsDB(IAnalyticsDatabase):
     """
 
 
+class IAsyncAnalyticsDB(interface.Interface):
+    """
+    An utility interface for the asyncio Analytics database
+    """
+
+    engine = interface.Attribute("SQLAlchemy async engine")
+    sessionmaker = interface.Attribute("SQLAlchemy async session maker")
+
+    def session():
+        """
+        Return a new async session.
+        """
+
+
 class IAnalyticsDSIdentifier(interface.Interface):
     """
     A utility that gets dataserver identities for objects
@@ -53,6 +67,17 @@ class IAnalyticsDSIdentifier(interface.Interface):
         dataserver object.
         """
 
+    def get_objects(obj_ids):
+        """
+        For the given dataserver identifiers, return a mapping of
+        identifier to dataserver object (or None), resolved in as few
+        lookups as possible.
+
+        Utilities deriving from
+        :class:`nti.analytics_database.identity.AnalyticsDSIdentifier`
+        inherit one calling :meth:`get_object` per id.
+        """
+
 
 class IAnalyticsNTIIDIdentifier(IAnalyticsDSIdentifier):
     """
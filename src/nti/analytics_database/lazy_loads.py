@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Detection of repeated (N+1) relationship lazy loads, and statement
+counts per transaction.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import threading
+import traceback
+
+from collections import deque
+from collections import defaultdict
+
+import sqlalchemy
+
+from sqlalchemy import event
+
+from nti.analytics_database.metrics import Histogram
+
+from nti.analytics_database.metrics import escape
+from nti.analytics_database.metrics import write_text
+from nti.analytics_database.metrics import format_histogram
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Statements per transaction histogram bucket upper bounds
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_SQLALCHEMY_DIR = os.path.dirname(sqlalchemy.__file__) + os.sep
+
+_PACKAGE_DIR = os.path.dirname(__file__) + os.sep
+
+_TESTS_DIR = os.path.join(_PACKAGE_DIR, 'tests') + os.sep
+
+_COUNTS_KEY = 'analytics_lazy_load_counts'
+
+
+def _internal(filename):
+    return filename.startswith(_SQLALCHEMY_DIR) \
+        or (filename.startswith(_PACKAGE_DIR) and not filename.startswith(_TESTS_DIR))
+
+
+def call_site():
+    """
+    Return the innermost ``file:line in function`` of the current stack
+    outside of SQLAlchemy and our models, or None.
+    """
+    for filename, lineno, name, unused_line in reversed(traceback.extract_stack()):
+        if not _internal(filename):
+            return '%s:%s in %s' % (filename, lineno, name)
+    return None  # pragma: no cover
+
+
+class _TransactionCounts(object):
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.statements = 0
+        self.lazy_loads = defaultdict(int)
+        # The info dicts of the connections counting for us
+        self.infos = []
+
+
+class LazyLoadDetector(object):
+    """
+    Counts the lazy loads of each relationship and the statements
+    executed in each (root) transaction of the sessions it is attached
+    to, logging the call site of a relationship lazily loaded
+    ``threshold`` times in one transaction, the N+1 query pattern.
+
+    Statements are counted on the engines it is attached to. The counts
+    of each transaction are kept in ``recent``, and statements per
+    transaction are exported as a histogram per endpoint, the label
+    set with :meth:`set_endpoint` in the thread running the transaction.
+    """
+
+    threshold = 10
+    #: The number of transactions kept in ``recent``
+    history = 100
+
+    def __init__(self, threshold=None, prefix='nti_analytics_db'):
+        if threshold is not None:
+            self.threshold = threshold
+        self.prefix = prefix
+        self.recent = deque(maxlen=self.history)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._statements = {}
+        self._lazy_loads = defaultdict(int)
+        self._repeated = defaultdict(int)
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def attach_session(self, target):
+        """
+        Listen to the given session, session class or sessionmaker.
+        """
+        event.listen(target, 'after_transaction_create', self.after_transaction_create)
+        event.listen(target, 'after_begin', self.after_begin)
+        event.listen(target, 'do_orm_execute', self.do_orm_execute)
+        event.listen(target, 'after_transaction_end', self.after_transaction_end)
+
+    def set_endpoint(self, name=None):
+        """
+        Label the transactions of the current thread with the given
+        endpoint name (until set again).
+        """
+        self._local.endpoint = name
+
+    def after_transaction_create(self, session, transaction):
+        if transaction.parent is None:
+            endpoint = getattr(self._local, 'endpoint', None) or ''
+            session.info[_COUNTS_KEY] = _TransactionCounts(endpoint)
+
+    def after_begin(self, session, unused_transaction, connection):
+        counts = session.info.get(_COUNTS_KEY)
+        if counts is not None:
+            connection.info[_COUNTS_KEY] = counts
+            counts.infos.append(connection.info)
+
+    def before_cursor_execute(self, conn, *unused_args):
+        counts = conn.info.get(_COUNTS_KEY)
+        if counts is not None:
+            counts.statements += 1
+
+    def do_orm_execute(self, orm_execute_state):
+        state = orm_execute_state.lazy_loaded_from
+        counts = orm_execute_state.session.info.get(_COUNTS_KEY)
+        if state is None or counts is None:
+            return
+        prop = orm_execute_state.loader_strategy_path.path[-1]
+        key = '%s.%s' % (state.class_.__name__, prop.key)
+        counts.lazy_loads[key] += 1
+        if counts.lazy_loads[key] == self.threshold:
+            logger.warning("%s lazily loaded %s times in one transaction, at %s",
+                           key, self.threshold, call_site())
+
+    def after_transaction_end(self, session, transaction):
+        counts = session.info.get(_COUNTS_KEY)
+        if transaction.parent is not None or counts is None:
+            return
+        del session.info[_COUNTS_KEY]
+        for info in counts.infos:
+            # Unless another transaction has the connection already
+            if info.get(_COUNTS_KEY) is counts:
+                del info[_COUNTS_KEY]
+        if not counts.statements and not counts.lazy_loads:
+            return
+        repeated = sorted(k for k, v in counts.lazy_loads.items() if v >= self.threshold)
+        self.recent.append({'endpoint': counts.endpoint,
+                            'statements': counts.statements,
+                            'lazy_loads': dict(counts.lazy_loads),
+                            'repeated': repeated})
+        with self._lock:
+            histogram = self._statements.get(counts.endpoint)
+            if histogram is None:
+                histogram = Histogram(STATEMENT_BUCKETS)
+                self._statements[counts.endpoint] = histogram
+            histogram.observe(counts.statements)
+            for key, count in counts.lazy_loads.items():
+                self._lazy_loads[key] += count
+            for key in repeated:
+                self._repeated[key] += 1
+
+    def snapshot(self):
+        """
+        Return a dict of the ``statements`` histogram (``count``, ``sum``
+        and cumulative ``buckets``) per endpoint, and the ``lazy_loads``
+        and the transactions with ``repeated`` lazy loads per relationship.
+        """
+        with self._lock:
+            return {'statements': {k: {'count': x.count,
+                                       'sum': x.sum,
+                                       'buckets': x.cumulative()}
+                                   for k, x in self._statements.items()},
+                    'lazy_loads': dict(self._lazy_loads),
+                    'repeated': dict(self._repeated)}
+
+    def prometheus_text(self):
+        name = self.prefix + '_transaction_statements'
+        with self._lock:
+            statements = sorted((k, v.copy()) for k, v in self._statements.items())
+            counters = (('lazy_loads', 'Relationship lazy loads.',
+                         sorted(self._lazy_loads.items())),
+                        ('repeated_lazy_loads',
+                         'Transactions lazily loading a relationship past the threshold.',
+                         sorted(self._repeated.items())))
+        lines = ['# HELP %s Analytics database statements per transaction.' % name,
+                 '# TYPE %s histogram' % name]
+        for endpoint, histogram in statements:
+            lines.extend(format_histogram(name, 'endpoint="%s"' % escape(endpoint),
+                                          histogram))
+        for key, help_text, values in counters:
+            metric = '%s_%s_total' % (self.prefix, key)
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s counter' % metric)
+            for relationship, count in values:
+                lines.append('%s{relationship="%s"} %d'
+                             % (metric, escape(relationship), count))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, target):
+        """
+        Write :meth:`prometheus_text` to ``target``; see
+        :func:`nti.analytics_database.metrics.write_text`.
+        """
+        write_text(target, self.prometheus_text())
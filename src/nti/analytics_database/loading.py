@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Named relationship loading profiles for common read paths.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from sqlalchemy import inspect
+
+from sqlalchemy.orm import noload
+from sqlalchemy.orm import lazyload
+from sqlalchemy.orm import raiseload
+from sqlalchemy.orm import defaultload
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import selectinload
+
+from nti.analytics_database.assessments import AssignmentsTaken
+from nti.analytics_database.assessments import AssignmentFeedback
+from nti.analytics_database.assessments import SelfAssessmentsTaken
+
+from nti.analytics_database.blogs import BlogsCreated
+from nti.analytics_database.blogs import BlogCommentsCreated
+
+from nti.analytics_database.boards import TopicsCreated
+from nti.analytics_database.boards import ForumsCreated
+from nti.analytics_database.boards import ForumCommentsCreated
+
+from nti.analytics_database.resource_tags import NotesCreated
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The loader option of each strategy name
+STRATEGIES = {
+    'joined': joinedload,
+    'selectin': selectinload,
+    'select': lazyload,
+    'noload': noload,
+    'raise': raiseload,
+}
+
+
+class LoadingProfile(object):
+    """
+    A named set of relationship loading strategies: for each mapped
+    class, ``(path, strategy)`` pairs, where the path is a relationship
+    name, or dotted names through relationships (``details.grade``), and
+    the strategy one of the :data:`STRATEGIES`. Relationships not named
+    keep the strategy of their mapping.
+
+    In strict mode, any other relationship of the queried and the
+    loaded objects that is not eagerly loaded by its mapping raises
+    instead of emitting a lazy load.
+    """
+
+    #: Whether :meth:`apply` is strict by default; tests set it
+    strict = False
+
+    def __init__(self, name, strategies):
+        self.name = name
+        self.strategies = strategies
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+    @staticmethod
+    def _option(model, path, loader):
+        option = None
+        names = path.split('.')
+        for idx, name in enumerate(names):
+            attr = getattr(model, name)
+            current = loader if idx == len(names) - 1 else defaultload
+            if option is None:
+                option = current(attr)
+            else:
+                option = getattr(option, current.__name__)(attr)
+            model = attr.property.mapper.class_
+        return option
+
+    def _strict_options(self, model, prefix, paths):
+        # Raise on the lazy loads of the objects loaded at prefix, except
+        # those eagerly loaded by their mapping
+        target = model
+        for name in prefix.split('.') if prefix else ():
+            target = getattr(target, name).property.mapper.class_
+        result = []
+        for rel in inspect(target).relationships:
+            path = '%s.%s' % (prefix, rel.key) if prefix else rel.key
+            if path not in paths and rel.lazy in ('joined', 'selectin'):
+                result.append(self._option(model, path, STRATEGIES[rel.lazy]))
+        if prefix:
+            option = self._option(model, prefix, defaultload)
+            result.append(option.raiseload('*', sql_only=True))
+        else:
+            result.append(raiseload('*', sql_only=True))
+        return result
+
+    def options(self, model, strict=None):
+        """
+        The loader options of this profile for queries over ``model``.
+        """
+        strict = self.strict if strict is None else strict
+        strategies = self.strategies.get(model, ())
+        result = [self._option(model, path, STRATEGIES[strategy])
+                  for path, strategy in strategies]
+        if strict:
+            paths = {path for path, _ in strategies}
+            loaded = [path for path, strategy in strategies
+                      if strategy not in ('noload', 'raise')]
+            for prefix in [''] + loaded:
+                result.extend(self._strict_options(model, prefix, paths))
+        return result
+
+    def apply(self, query, strict=None):
+        """
+        Return the given query with the options of this profile for
+        its (first) mapped entity.
+        """
+        for description in query.column_descriptions:
+            model = description.get('entity')
+            if model is not None:
+                return query.options(*self.options(model, strict))
+        return query
+
+
+GRADEBOOK = LoadingProfile('gradebook', {
+    AssignmentsTaken: (('_user_record', 'joined'),
+                       ('grade', 'joined'),
+                       ('grade._grader_record', 'joined'),
+                       ('details', 'selectin'),
+                       ('details.grade', 'joined')),
+    SelfAssessmentsTaken: (('_user_record', 'joined'),
+                           ('details', 'selectin')),
+    AssignmentFeedback: (('_user_record', 'joined'),
+                         ('_file_mime_types', 'selectin')),
+})
+
+ACTIVITY_FEED = LoadingProfile('activity-feed', {
+    AssignmentsTaken: (('_user_record', 'joined'),
+                       ('details', 'raise')),
+    ForumsCreated: (('_user_record', 'joined'),),
+    TopicsCreated: (('_user_record', 'joined'),
+                    ('_forum_record', 'joined')),
+    ForumCommentsCreated: (('_user_record', 'joined'),
+                           ('_topic_record', 'joined'),
+                           ('_file_mime_types', 'raise')),
+    BlogsCreated: (('_user_record', 'joined'),),
+    BlogCommentsCreated: (('_user_record', 'joined'),
+                          ('_blog_record', 'joined'),
+                          ('_file_mime_types', 'raise')),
+    NotesCreated: (('_user_record', 'joined'),
+                   ('_resource', 'joined'),
+                   ('_file_mime_types', 'raise')),
+})
+
+EXPORT = LoadingProfile('export', {
+    AssignmentsTaken: (('_user_record', 'selectin'),
+                       ('grade', 'selectin'),
+                       ('details', 'selectin'),
+                       ('details.grade', 'selectin')),
+    AssignmentFeedback: (('_user_record', 'selectin'),
+                         ('_file_mime_types', 'selectin')),
+    ForumCommentsCreated: (('_user_record', 'selectin'),
+                           ('_file_mime_types', 'selectin')),
+    BlogCommentsCreated: (('_user_record', 'selectin'),
+                          ('_file_mime_types', 'selectin')),
+    NotesCreated: (('_user_record', 'selectin'),
+                   ('_resource', 'selectin'),
+                   ('_file_mime_types', 'selectin')),
+})
+
+#: The loading profiles by name
+PROFILES = {x.name: x for x in (GRADEBOOK, ACTIVITY_FEED, EXPORT)}
+
+
+def get_profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError("Unknown loading profile %s" % name)
+
+
+def load_profile(query, name, strict=None):
+    """
+    Return the given query with the options of the named loading profile.
+    """
+    return get_profile(name).apply(query, strict)
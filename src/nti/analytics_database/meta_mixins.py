@@ -32,6 +32,7 @@ from nti.analytics_database.interfaces import IAnalyticsRootContextResolver
 
 from nti.analytics_database.root_context import Books
 from nti.analytics_database.root_context import Courses
+from nti.analytics_database.root_context import RootContextId
 
 from nti.analytics_database.users import Users
 
@@ -180,8 +181,24 @@ class RootContextMixin(object):
         return relationship('Users', lazy="select", foreign_keys=[self.entity_root_context_id],
                             primaryjoin=lambda: Users.user_id == self.entity_root_context_id)
 
+    @declared_attr
+    def _root_context_id_record(self):
+        return relationship('RootContextId', lazy="select", foreign_keys=[self.root_context_id],
+                            primaryjoin=lambda: RootContextId.context_id == self.root_context_id,
+                            viewonly=True)
+
     @property
     def _root_context_record(self):
+        loaded = self.__dict__
+        if '_book_context_record' not in loaded and '_course_context_record' not in loaded:
+            # The context id row says which table to look in; it is
+            # fetched by primary key once per session, not once per row.
+            # pylint: disable=no-member
+            context_type = getattr(self._root_context_id_record, 'context_type', None)
+            if context_type == Books.__tablename__:
+                return self._book_context_record
+            if context_type == Courses.__tablename__:
+                return self._course_context_record
         return self._book_context_record or self._course_context_record
 
     @_root_context_record.setter
@@ -327,6 +344,8 @@ class ReplyToMixin(object):
 
 class CommentsMixin(BaseTableMixin, DeletedMixin, ReplyToMixin):
 
+    _comment = None
+
     CommentLength = alias('comment_length')
 
     # comment_id should be the DS intid
@@ -341,8 +360,15 @@ class CommentsMixin(BaseTableMixin, DeletedMixin, ReplyToMixin):
 
     @property
     def Comment(self):
-        id_util = component.queryUtility(IAnalyticsIntidIdentifier)
-        return id_util.get_object(self.comment_id) if id_util is not None else None
+        result = self._comment
+        if result is None:
+            id_util = component.queryUtility(IAnalyticsIntidIdentifier)
+            result = id_util.get_object(self.comment_id) if id_util is not None else None
+        return result
+
+    @Comment.setter
+    def Comment(self, comment):
+        self._comment = comment
 
 
 class FileMimeTypeMixin(object):
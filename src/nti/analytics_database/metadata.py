@@ -8,16 +8,118 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import exc
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import DateTime
+
+from sqlalchemy.schema import Sequence
+
 logger = __import__('logging').getLogger(__name__)
 
 from nti.analytics_database import Base
 
+from nti.analytics_database import load_models
+
+#: The :class:`SchemaVersion` row of our metadata
+SCHEMA_NAME = 'analytics'
+
+
+class SchemaVersion(Base):
+    """
+    The fingerprint of the metadata the database schema was last created
+    from.
+    """
+
+    __tablename__ = 'SchemaVersion'
+
+    name = Column('name', String(64), primary_key=True)
+
+    fingerprint = Column('fingerprint', String(64), nullable=False)
+
+    timestamp = Column('timestamp', DateTime, nullable=False)
+
+
+def _describe_column(column):
+    sequence = column.default.name if isinstance(column.default, Sequence) else None
+    server_default = column.server_default
+    if server_default is not None:
+        server_default = str(getattr(server_default, 'arg', server_default))
+    return (column.name, repr(column.type), column.nullable,
+            column.primary_key, sequence, server_default)
+
+
+def _describe_table(table):
+    indexes = sorted((x.name or '', bool(x.unique), tuple(c.name for c in x.columns))
+                     for x in table.indexes)
+    constraints = sorted((type(x).__name__, x.name or '', tuple(c.name for c in x.columns))
+                         for x in table.constraints)
+    foreign_keys = sorted((x.parent.name, x.target_fullname)
+                          for x in table.foreign_keys)
+    return (table.name,
+            tuple(_describe_column(x) for x in table.columns),
+            tuple(indexes), tuple(constraints), tuple(foreign_keys))
+
+
+def schema_fingerprint(metadata):
+    """
+    Return a hex digest of the tables, columns, indexes and constraints
+    of the given metadata.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(metadata.tables):
+        digest.update(repr(_describe_table(metadata.tables[name])).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stored_fingerprint(engine, name=SCHEMA_NAME):
+    """
+    Return the fingerprint recorded in the database, or None.
+    """
+    table = SchemaVersion.__table__
+    query = table.select().with_only_columns([table.c.fingerprint]) \
+                          .where(table.c.name == name)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(query).scalar()
+    except exc.DBAPIError:
+        # No SchemaVersion table yet
+        return None
+
+
+def store_fingerprint(engine, fingerprint, name=SCHEMA_NAME):
+    table = SchemaVersion.__table__
+    values = {'fingerprint': fingerprint, 'timestamp': datetime.utcnow()}
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(table.update().where(table.c.name == name), values)
+            if not result.rowcount:
+                conn.execute(table.insert(), dict(values, name=name))
+    except exc.IntegrityError:
+        # Another process recorded it at the same time.
+        pass
+
 
 class AnalyticsMetadata(object):
+    """
+    Creates any missing tables and indexes of our metadata, unless the
+    database records the same schema fingerprint (or ``force`` is set);
+    introspecting every table on each process start is slow.
+    """
 
-    __slots__ = ('metadata',)
+    __slots__ = ('metadata', 'fingerprint', 'created')
 
-    def __init__(self, engine):
+    def __init__(self, engine, force=False):
         logger.info("Initializing database")
+        load_models()
         self.metadata = getattr(Base, 'metadata')
-        self.metadata.create_all(engine)
+        self.fingerprint = schema_fingerprint(self.metadata)
+        self.created = force or stored_fingerprint(engine) != self.fingerprint
+        if self.created:
+            self.metadata.create_all(engine)
+            store_fingerprint(engine, self.fingerprint)
+        else:
+            logger.info("Database schema is current (%s)", self.fingerprint)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Per-statement timing of analytics engines, exportable in the Prometheus
+text format.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import re
+import time
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Latency histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+_KIND_PATTERN = re.compile(r'^\s*(\w+)')
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+[`"\[]?(\w+)',
+                            re.IGNORECASE)
+
+
+def classify(statement):
+    """
+    Return the ``(kind, table)`` of a SQL statement, e.g.
+    ``('select', 'Users')``. The table is the first one referenced, or
+    the empty string.
+    """
+    match = _KIND_PATTERN.match(statement)
+    kind = match.group(1).lower() if match else 'other'
+    match = _TABLE_PATTERN.search(statement)
+    table = match.group(1) if match else ''
+    return kind, table
+
+
+class Histogram(object):
+    """
+    A cumulative latency histogram.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.rows = 0
+
+    def copy(self):
+        result = Histogram(self.buckets)
+        result.counts = list(self.counts)
+        result.count = self.count
+        result.sum = self.sum
+        result.rows = self.rows
+        return result
+
+    def observe(self, value, rows=None):
+        idx = 0
+        while idx < len(self.buckets) and value > self.buckets[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+        if rows is not None and rows >= 0:
+            self.rows += rows
+
+    def cumulative(self):
+        """
+        Return ``(upper bound, count)`` pairs, ending with ``+Inf``.
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def write_text(target, text):
+    """
+    Hand ``text`` to ``target``: a callable, or a file path, which is
+    replaced atomically (suitable for a node exporter textfile collector).
+    """
+    if callable(target):
+        target(text)
+        return
+    directory = os.path.dirname(os.path.abspath(target))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as stream:
+        stream.write(text)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, target)
+
+
+def format_histogram(name, labels, histogram):
+    """
+    Return the Prometheus sample lines of a :class:`Histogram`.
+    """
+    lines = []
+    for bound, count in histogram.cumulative():
+        lines.append('%s_bucket{%s,le="%s"} %d'
+                     % (name, labels, _format_bound(bound), count))
+    lines.append('%s_sum{%s} %r' % (name, labels, float(histogram.sum)))
+    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+    return lines
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StatementMetrics(object):
+    """
+    Latency histograms and rows affected per statement kind and target
+    table, fed by cursor execution events of the engines it is attached
+    to.
+    """
+
+    #: The number of distinct statements whose classification is cached
+    cache_size = 2000
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='nti_analytics_db'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._classified = OrderedDict()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, unused_conn, unused_cursor, unused_statement,
+                              unused_parameters, context, unused_executemany):
+        # Kept on the execution context, which goes away with the
+        # statement even if it fails (and after_cursor_execute never runs)
+        if context is not None:
+            context._analytics_query_start = time.time()
+
+    def after_cursor_execute(self, unused_conn, cursor, statement,
+                             unused_parameters, context, unused_executemany):
+        start = getattr(context, '_analytics_query_start', None)
+        if start is None:
+            return
+        elapsed = time.time() - start
+        self.observe(statement, elapsed, getattr(cursor, 'rowcount', None))
+
+    def _classify(self, statement):
+        # Callers hold the lock
+        result = self._classified.get(statement)
+        if result is None:
+            result = self._classified[statement] = classify(statement)
+            if len(self._classified) > self.cache_size:
+                self._classified.popitem(last=False)
+        return result
+
+    def observe(self, statement, elapsed, rows=None):
+        with self._lock:
+            key = self._classify(statement)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(elapsed, rows)
+
+    def snapshot(self):
+        """
+        Return a dict of ``(kind, table)`` to a dict of ``count``, ``sum``
+        (seconds), ``rows`` and cumulative ``buckets``.
+        """
+        with self._lock:
+            return {key: {'count': x.count,
+                          'sum': x.sum,
+                          'rows': x.rows,
+                          'buckets': x.cumulative()}
+                    for key, x in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def prometheus_text(self):
+        """
+        Return the snapshot in the Prometheus text exposition format.
+        """
+        name = self.prefix + '_statement_seconds'
+        rows_name = self.prefix + '_statement_rows_total'
+        with self._lock:
+            snapshot = sorted((k, v.copy()) for k, v in self._histograms.items())
+        lines = ['# HELP %s Analytics database statement latency.' % name,
+                 '# TYPE %s histogram' % name]
+        for (kind, table), histogram in snapshot:
+            labels = 'kind="%s",table="%s"' % (escape(kind), escape(table))
+            lines.extend(format_histogram(name, labels, histogram))
+        lines.append('# HELP %s Rows affected by analytics database statements.' % rows_name)
+        lines.append('# TYPE %s counter' % rows_name)
+        for (kind, table), histogram in snapshot:
+            lines.append('%s{kind="%s",table="%s"} %d'
+                         % (rows_name, escape(kind), escape(table), histogram.rows))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, target):
+        """
+        Write :meth:`prometheus_text` to ``target``; see :func:`write_text`.
+        """
+        write_text(target, self.prometheus_text())
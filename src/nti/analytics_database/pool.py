@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Connection pool instrumentation and adaptive overflow sizing.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import threading
+
+from collections import OrderedDict
+
+from sqlalchemy import exc
+from sqlalchemy import event
+
+from sqlalchemy.pool import QueuePool
+
+from nti.analytics_database.metrics import DEFAULT_BUCKETS
+
+from nti.analytics_database.metrics import escape
+from nti.analytics_database.metrics import Histogram
+from nti.analytics_database.metrics import write_text
+from nti.analytics_database.metrics import format_histogram
+
+try:
+    from greenlet import getcurrent
+except ImportError:  # pragma: no cover
+    getcurrent = threading.current_thread
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class AdaptiveOverflow(object):
+    """
+    Grows a pool's ``max_overflow`` by ``step`` (up to ``maximum``) when
+    checkouts waited ``grow_wait`` seconds on average over the last
+    ``window`` checkouts, and shrinks it (down to ``minimum``, and never
+    below the overflow in use) when they waited less than ``shrink_wait``.
+    """
+
+    window = 100
+    step = 5
+    grow_wait = 0.05
+    shrink_wait = 0.005
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self._waits = []
+        self._lock = threading.Lock()
+
+    def observe(self, pool, wait):
+        with self._lock:
+            self._waits.append(wait)
+            if len(self._waits) < self.window:
+                return
+            mean = sum(self._waits) / len(self._waits)
+            del self._waits[:]
+        # pylint: disable=protected-access
+        with pool._overflow_lock:
+            current = pool._max_overflow
+            if mean >= self.grow_wait:
+                target = min(current + self.step, self.maximum)
+            elif mean < self.shrink_wait:
+                in_use = max(pool._overflow, 0)
+                target = max(current - self.step, self.minimum, in_use)
+            else:
+                target = current
+            pool._max_overflow = target
+        if target != current:
+            logger.info("Analytics pool max_overflow %s -> %s (mean checkout wait %.4fs)",
+                        current, target, mean)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A :class:`QueuePool` that reports how long each checkout waited for a
+    connection (and timeouts) to its ``stats``, and lets its ``sizer``
+    adjust the overflow. ``waiting`` is the number of checkouts in
+    progress.
+    """
+
+    stats = None
+    sizer = None
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.waiting = 0
+        self._waiting_lock = threading.Lock()
+        # The greenlets (or threads) with a checkout in progress
+        self._timing = set()
+
+    def _do_get(self):
+        # QueuePool._do_get retries by calling itself; time the outer call.
+        current = getcurrent()
+        if current in self._timing:
+            return super(InstrumentedQueuePool, self)._do_get()
+        with self._waiting_lock:
+            self._timing.add(current)
+            self.waiting += 1
+        start = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.timeouts += 1
+            raise
+        finally:
+            wait = time.time() - start
+            with self._waiting_lock:
+                self._timing.discard(current)
+                self.waiting -= 1
+            if self.stats is not None:
+                self.stats.wait.observe(wait)
+            if self.sizer is not None:
+                self.sizer.observe(self, wait)
+
+    def recreate(self):
+        result = super(InstrumentedQueuePool, self).recreate()
+        result.stats = self.stats
+        result.sizer = self.sizer
+        return result
+
+
+class PoolStats(object):
+    """
+    Event counts and checkout waits of one engine's pool.
+    """
+
+    def __init__(self, engine, buckets=DEFAULT_BUCKETS):
+        self.engine = engine
+        self.wait = Histogram(buckets)
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+
+    def on_connect(self, *unused_args):
+        self.connects += 1
+
+    def on_checkout(self, *unused_args):
+        self.checkouts += 1
+
+    def on_checkin(self, *unused_args):
+        self.checkins += 1
+
+    def on_invalidate(self, *unused_args):
+        self.invalidations += 1
+
+    def snapshot(self):
+        pool = self.engine.pool
+        # pylint: disable=protected-access
+        result = {'connects': self.connects,
+                  'checkouts': self.checkouts,
+                  'checkins': self.checkins,
+                  'invalidations': self.invalidations,
+                  'timeouts': self.timeouts,
+                  'wait': {'count': self.wait.count,
+                           'sum': self.wait.sum,
+                           'buckets': self.wait.cumulative()},
+                  'checked_out': None,
+                  'overflow': None,
+                  'max_overflow': None,
+                  'waiting': None}
+        if isinstance(pool, QueuePool):
+            result['checked_out'] = pool.checkedout()
+            result['overflow'] = max(pool.overflow(), 0)
+            result['max_overflow'] = pool._max_overflow
+        if isinstance(pool, InstrumentedQueuePool):
+            result['waiting'] = pool.waiting
+        return result
+
+
+class PoolMetrics(object):
+    """
+    Pool statistics of the engines it is attached to, by name.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='nti_analytics_db'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.pools = OrderedDict()
+
+    def attach(self, engine, name):
+        stats = self.pools[name] = PoolStats(engine, self.buckets)
+        event.listen(engine, 'connect', stats.on_connect)
+        event.listen(engine, 'checkout', stats.on_checkout)
+        event.listen(engine, 'checkin', stats.on_checkin)
+        event.listen(engine, 'invalidate', stats.on_invalidate)
+        if isinstance(engine.pool, InstrumentedQueuePool):
+            engine.pool.stats = stats
+        return stats
+
+    def snapshot(self):
+        return {name: stats.snapshot() for name, stats in self.pools.items()}
+
+    def prometheus_text(self):
+        prefix = self.prefix + '_pool_'
+        snapshots = [(name, stats, stats.snapshot())
+                     for name, stats in self.pools.items()]
+        wait_name = prefix + 'checkout_wait_seconds'
+        lines = ['# HELP %s Time spent waiting to check out a connection.' % wait_name,
+                 '# TYPE %s histogram' % wait_name]
+        for name, stats, _ in snapshots:
+            lines.extend(format_histogram(wait_name, 'pool="%s"' % escape(name),
+                                          stats.wait))
+        for key, kind in (('connects', 'counter'),
+                          ('checkouts', 'counter'),
+                          ('checkins', 'counter'),
+                          ('invalidations', 'counter'),
+                          ('timeouts', 'counter'),
+                          ('checked_out', 'gauge'),
+                          ('overflow', 'gauge'),
+                          ('max_overflow', 'gauge'),
+                          ('waiting', 'gauge')):
+            metric = prefix + key + ('_total' if kind == 'counter' else '')
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for name, _, snapshot in snapshots:
+                if snapshot[key] is not None:
+                    lines.append('%s{pool="%s"} %d' % (metric, escape(name), snapshot[key]))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, target):
+        """
+        Write :meth:`prometheus_text` to ``target``; see
+        :func:`nti.analytics_database.metrics.write_text`.
+        """
+        write_text(target, self.prometheus_text())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Compact, read-only rows for reporting queries over large event tables.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import re
+import threading
+
+from collections import namedtuple
+
+from operator import attrgetter
+
+from sqlalchemy import inspect
+from sqlalchemy import select
+
+from nti.analytics_database.resources import Resources
+
+from nti.analytics_database.sessions import Sessions
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The rows fetched from the cursor at a time
+CHUNK_SIZE = 1000
+
+#: Fields read from a joined table: the field, the joined class, and
+#: the column of the queried model joined to its primary key
+JOINED_FIELDS = (
+    ('resource_ds_id', Resources, 'resource_id'),
+)
+
+#: Row properties that are not simple aliases of a column
+ALIASES = {
+    'ResourceId': 'resource_ds_id',
+}
+
+_ALIAS_PATTERN = re.compile(r'^Alias for :attr:`(\w+)`$')
+
+
+def _session_duration(row):
+    if row.end_time and row.start_time:
+        return (row.end_time - row.start_time).seconds
+    return None
+
+
+#: Computed row properties by model: the property, the fields it
+#: needs, and the function computing it from the row
+DERIVED = {
+    Sessions: (('Duration', ('start_time', 'end_time'), _session_duration),),
+}
+
+_row_types = {}
+_row_types_lock = threading.Lock()
+
+
+def default_fields(model):
+    """
+    The column attributes of the given mapped class, and the
+    :data:`JOINED_FIELDS` it can join to.
+    """
+    result = [x.key for x in inspect(model).column_attrs]
+    for name, unused_joined, key in JOINED_FIELDS:
+        if key in result:
+            result.append(name)
+    return tuple(result)
+
+
+def _aliases(model):
+    result = dict(ALIASES)
+    for cls in reversed(model.__mro__):
+        for name, value in vars(cls).items():
+            # nti.property aliases are documented properties
+            if isinstance(value, property):
+                match = _ALIAS_PATTERN.match(value.__doc__ or '')
+                if match is not None:
+                    result[name] = match.group(1)
+    return result
+
+
+def row_type(model, fields=None):
+    """
+    Return the (cached) namedtuple class of the report rows of the given
+    mapped class with the given fields (by default :func:`default_fields`).
+
+    Rows keep the model's aliases (``Duration``, ``SessionID``...) of
+    their fields, and ``ResourceId`` when ``resource_ds_id`` is a field.
+    """
+    fields = tuple(fields or default_fields(model))
+    key = (model, fields)
+    result = _row_types.get(key)
+    if result is None:
+        with _row_types_lock:
+            result = _row_types.get(key)
+            if result is None:
+                base = namedtuple('%sRow' % model.__name__, fields)
+                namespace = {'__slots__': ()}
+                for name, needed, func in DERIVED.get(model, ()):
+                    if set(needed).issubset(fields):
+                        namespace[name] = property(func)
+                for name, target in _aliases(model).items():
+                    # Including aliases of computed properties
+                    # (Sessions.time_length)
+                    if      name not in fields and name not in namespace \
+                        and (target in fields or target in namespace):
+                        namespace[name] = property(attrgetter(target))
+                result = type(base.__name__, (base,), namespace)
+                _row_types[key] = result
+    return result
+
+
+def report_query(model, fields=None):
+    """
+    Return a Core select of the given fields of the given mapped class,
+    outer joining the tables of any :data:`JOINED_FIELDS`.
+    """
+    fields = tuple(fields or default_fields(model))
+    table = model.__table__
+    joined = dict((x[0], x[1:]) for x in JOINED_FIELDS)
+    columns = []
+    from_clause = table
+    for name in fields:
+        if name in joined:
+            other, key = joined[name]
+            other_key = inspect(other).primary_key[0]
+            from_clause = from_clause.outerjoin(other.__table__,
+                                                getattr(model, key) == other_key)
+            columns.append(getattr(other, name).label(name))
+        else:
+            columns.append(getattr(model, name).label(name))
+    return select(columns).select_from(from_clause)
+
+
+def report_rows(session, model, fields=None, criteria=(), order_by=None,
+                chunk_size=CHUNK_SIZE):
+    """
+    Yield compact :func:`row_type` rows of the given mapped class (and
+    fields) matching the given criteria, without building ORM instances
+    or adding to the session's identity map.
+    """
+    fields = tuple(fields or default_fields(model))
+    query = report_query(model, fields)
+    for criterion in criteria:
+        query = query.where(criterion)
+    if order_by is not None:
+        query = query.order_by(order_by)
+    make = row_type(model, fields)._make
+    result = session.execute(query.execution_options(stream_results=True))
+    for rows in result.partitions(chunk_size):
+        for row in rows:
+            yield make(row)
@@ -94,10 +94,19 @@ class NotesCreated(Base, BaseTableMixin, ResourceMixin, DeletedMixin,
 
     note_length = Column('note_length', Integer, nullable=True)
 
+    _note = None
+
     @property
     def Note(self):
-        id_utility = component.getUtility(IAnalyticsIntidIdentifier)
-        return id_utility.get_object(self.note_ds_id)
+        result = self._note
+        if result is None:
+            id_utility = component.getUtility(IAnalyticsIntidIdentifier)
+            result = id_utility.get_object(self.note_ds_id)
+        return result
+
+    @Note.setter
+    def Note(self, note):
+        self._note = note
 
     _file_mime_types = relationship('NotesUserFileUploadMimeTypes',
                                     lazy="select")
@@ -47,6 +47,9 @@ class ResourceViews(Base, ResourceViewMixin, TimeLengthMixin):
 
     __tablename__ = 'ResourceViews'
 
+    # Ids may be reserved in blocks (see sequences.py)
+    __table_args__ = {'sqlite_autoincrement': True}
+
     # Need to have a seq primary key that we will not use to work around primary key limits
     # in mysql, or we could put our resource_ids into another table to conserve space (we did).
     # We'll probably just pull all of these events by indexed course; so, to avoid a join,
@@ -62,6 +65,8 @@ class VideoEvents(Base, ResourceViewMixin, TimeLengthMixin):
 
     __tablename__ = 'VideoEvents'
 
+    __table_args__ = {'sqlite_autoincrement': True}
+
     VideoEndTime = alias('video_end_time')
 
     VideoStartTime = alias('video_start_time')
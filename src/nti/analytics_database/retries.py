@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Retrying analytics writes that fail on deadlocks and lock timeouts.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import random
+import threading
+
+from collections import defaultdict
+
+from sqlalchemy.exc import DBAPIError
+
+from nti.analytics_database.metrics import escape
+from nti.analytics_database.metrics import classify
+from nti.analytics_database.metrics import write_text
+
+logger = __import__('logging').getLogger(__name__)
+
+#: MySQL errors: 1213 deadlock found, 1205 lock wait timeout exceeded
+MYSQL_RETRYABLE = (1213, 1205)
+
+#: PostgreSQL SQLSTATEs: deadlock detected, serialization failure and
+#: lock not available
+POSTGRESQL_RETRYABLE = ('40P01', '40001', '55P03')
+
+#: SQLite errors (by message) raised when the busy timeout expires
+SQLITE_RETRYABLE = ('database is locked', 'database table is locked')
+
+
+def is_retryable(error):
+    """
+    Whether the given (SQLAlchemy) error is a deadlock or lock timeout
+    after which the transaction can simply be run again.
+    """
+    if not isinstance(error, DBAPIError):
+        return False
+    orig = error.orig
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    if code is not None:
+        return code in POSTGRESQL_RETRYABLE
+    args = getattr(orig, 'args', None) or (None,)
+    if args[0] in MYSQL_RETRYABLE:
+        return True
+    message = str(orig)
+    return any(x in message for x in SQLITE_RETRYABLE)
+
+
+def error_table(error):
+    """
+    The table of the statement that failed, or None.
+    """
+    statement = getattr(error, 'statement', None)
+    return classify(statement)[1] if statement else None
+
+
+class RetryMetrics(object):
+    """
+    Counts of retried and failed (retries exhausted) attempts per table.
+    """
+
+    def __init__(self, prefix='nti_analytics_db'):
+        self.prefix = prefix
+        self.retries = defaultdict(int)
+        self.exhausted = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def retried(self, table):
+        with self._lock:
+            self.retries[table or 'unknown'] += 1
+
+    def gave_up(self, table):
+        with self._lock:
+            self.exhausted[table or 'unknown'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'retries': dict(self.retries),
+                    'exhausted': dict(self.exhausted)}
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        for key, help_text in (('retries', 'Writes retried after a deadlock or lock timeout.'),
+                               ('exhausted', 'Writes that failed after all retries.')):
+            metric = '%s_%s_total' % (self.prefix, key)
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s counter' % metric)
+            for table, count in sorted(snapshot[key].items()):
+                lines.append('%s{table="%s"} %d' % (metric, escape(table), count))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, target):
+        """
+        Write :meth:`prometheus_text` to ``target``; see
+        :func:`nti.analytics_database.metrics.write_text`.
+        """
+        write_text(target, self.prometheus_text())
+
+
+class RetryPolicy(object):
+    """
+    Calls a unit of work up to ``attempts`` times while it fails with a
+    retryable error, sleeping a random time of up to
+    ``base_delay * 2 ** retry`` (capped at ``max_delay``) seconds in
+    between ("full jitter", so that the writers that collided do not
+    collide again).
+
+    The unit of work must be a whole transaction: a deadlock rolls back
+    the transaction, not just the failed statement.
+    """
+
+    attempts = 5
+    base_delay = 0.05
+    max_delay = 2.0
+
+    def __init__(self, attempts=None, base_delay=None, max_delay=None, metrics=None):
+        if attempts is not None:
+            self.attempts = attempts
+        if base_delay is not None:
+            self.base_delay = base_delay
+        if max_delay is not None:
+            self.max_delay = max_delay
+        self.metrics = RetryMetrics() if metrics is None else metrics
+
+    def sleep(self, seconds):
+        # Looked up on each call, so gevent's monkey patch applies
+        time.sleep(seconds)
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def __call__(self, func, *args, **kwargs):
+        retry = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-except
+                if not is_retryable(e):
+                    raise
+                table = error_table(e)
+                if retry + 1 >= self.attempts:
+                    self.metrics.gave_up(table)
+                    raise
+                self.metrics.retried(table)
+                delay = self.delay(retry)
+                logger.info("Retrying analytics write to %s in %.3fs (%s)",
+                            table, delay, e.orig)
+                self.sleep(delay)
+                retry += 1
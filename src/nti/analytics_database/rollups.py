@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Daily rollups of resource and video engagement, maintained incrementally
+from the event tables.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from datetime import timedelta
+
+from sqlalchemy import and_
+from sqlalchemy import or_
+from sqlalchemy import func
+from sqlalchemy import Date
+from sqlalchemy import select
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Integer
+
+from sqlalchemy.exc import IntegrityError
+
+from zope import interface
+
+from nti.analytics_database import Base
+
+from nti.analytics_database.batching import get_table
+
+from nti.analytics_database.resource_views import VideoEvents
+from nti.analytics_database.resource_views import ResourceViews
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class DailyRollupMixin(object):
+
+    course_id = Column('course_id', Integer, primary_key=True,
+                       autoincrement=False)
+
+    resource_id = Column('resource_id', Integer, primary_key=True,
+                         autoincrement=False)
+
+    day = Column('day', Date, primary_key=True)
+
+    view_count = Column('view_count', Integer, nullable=False)
+
+    user_count = Column('user_count', Integer, nullable=False)
+
+    total_time = Column('total_time', Integer, nullable=True)
+
+    max_time = Column('max_time', Integer, nullable=True)
+
+
+class ResourceDailyRollups(Base, DailyRollupMixin):
+    """
+    Resource views per course, resource and day.
+    """
+
+    __tablename__ = 'ResourceDailyRollups'
+
+
+class VideoDailyRollups(Base, DailyRollupMixin):
+    """
+    Video events per course, resource and day.
+    """
+
+    __tablename__ = 'VideoDailyRollups'
+
+
+class RollupWatermarks(Base):
+    """
+    The highest source event id folded into each rollup.
+    """
+
+    __tablename__ = 'RollupWatermarks'
+
+    rollup_name = Column('rollup_name', String(64), primary_key=True)
+
+    last_id = Column('last_id', Integer, nullable=False)
+
+
+class Rollup(object):
+    """
+    Describes a daily rollup of the ``source`` event table into the
+    ``target`` rollup table, tracked by the source's ``id_column``.
+
+    Events with an id above the watermark are folded in. Ids do not
+    commit in order (long transactions, preallocated id blocks), so each
+    update also recomputes the groups with events within ``lag`` of the
+    newest event, whatever their ids. Keep ``lag`` about as long as the
+    longest transaction writing events: every group in it is aggregated
+    again on each run. Events committing more than ``lag`` behind are
+    picked up the next time a new event lands in their group, as are
+    changes to events already rolled up (e.g. a ``time_length`` filled
+    in later).
+    """
+
+    #: The number of (course, resource, day) groups recomputed per statement
+    chunk_size = 100
+
+    #: How far behind the newest event groups are always recomputed
+    lag = timedelta(minutes=5)
+
+    #: Attempts at creating the watermark row before giving up
+    max_attempts = 3
+
+    def __init__(self, source, target, id_column, lag=None):
+        self.source = get_table(source)
+        self.target = get_table(target)
+        self.id_column = self.source.c[id_column]
+        if lag is not None:
+            self.lag = lag
+
+    @property
+    def name(self):
+        return self.target.name
+
+    @property
+    def day(self):
+        return func.date(self.source.c.timestamp, type_=Date)
+
+    @property
+    def group_by(self):
+        return (self.source.c.course_id, self.source.c.resource_id, self.day)
+
+    def _groups(self, conn, *criteria):
+        query = select(list(self.group_by)).distinct() \
+                .where(self.source.c.course_id.isnot(None)) \
+                .where(self.source.c.timestamp.isnot(None))
+        for criterion in criteria:
+            query = query.where(criterion)
+        return [tuple(x) for x in conn.execute(query)]
+
+    def touched(self, conn, low, high):
+        """
+        The groups with source events in the id range (low, high].
+        """
+        return self._groups(conn, self.id_column > low, self.id_column <= high)
+
+    def recent(self, conn, high, lag=None):
+        """
+        The groups with source events up to id ``high`` within ``lag``
+        (by default :attr:`lag`) of the newest event.
+        """
+        lag = self.lag if lag is None else lag
+        newest = conn.execute(select([func.max(self.source.c.timestamp)])).scalar()
+        if newest is None:
+            return []
+        return self._groups(conn,
+                            self.source.c.timestamp >= newest - lag,
+                            self.id_column <= high)
+
+    def recompute(self, conn, groups, high):
+        """
+        Replace the rollup rows of the given groups with aggregates over
+        all source events up to ``high``.
+        """
+        source = self.source
+        target = self.target
+        for idx in range(0, len(groups), self.chunk_size):
+            chunk = groups[idx:idx + self.chunk_size]
+            conn.execute(target.delete().where(or_(*[
+                and_(target.c.course_id == course_id,
+                     target.c.resource_id == resource_id,
+                     target.c.day == day)
+                for course_id, resource_id, day in chunk])))
+            # Distinct users cannot be summed across increments, so the
+            # touched groups are always aggregated in full.
+            query = select(list(self.group_by) + [
+                        func.count(),
+                        func.count(source.c.user_id.distinct()),
+                        func.sum(source.c.time_length),
+                        func.max(source.c.time_length)]) \
+                    .where(self.id_column <= high) \
+                    .where(or_(*[
+                        and_(source.c.course_id == course_id,
+                             source.c.resource_id == resource_id,
+                             self.day == day)
+                        for course_id, resource_id, day in chunk])) \
+                    .group_by(*self.group_by)
+            columns = ('course_id', 'resource_id', 'day', 'view_count',
+                       'user_count', 'total_time', 'max_time')
+            conn.execute(target.insert().from_select(columns, query))
+
+    def _create_watermark(self, engine):
+        watermarks = RollupWatermarks.__table__
+        try:
+            with engine.begin() as conn:
+                conn.execute(watermarks.insert(), rollup_name=self.name, last_id=0)
+        except IntegrityError:
+            # Another run created it first
+            logger.debug("Concurrent creation of watermark for %s", self.name)
+
+    def _update(self, engine, lag):
+        watermarks = RollupWatermarks.__table__
+        with engine.begin() as conn:
+            # Lock the watermark row (where supported) so concurrent
+            # runs do not interleave.
+            low = conn.execute(select([watermarks.c.last_id])
+                               .where(watermarks.c.rollup_name == self.name)
+                               .with_for_update()).scalar()
+            if low is None:
+                return None
+            high = conn.execute(select([func.max(self.id_column)])).scalar()
+            if high is None:
+                return 0
+            high = max(high, low)
+            groups = set(self.touched(conn, low, high))
+            groups.update(self.recent(conn, high, lag))
+            groups = sorted(groups)
+            self.recompute(conn, groups, high)
+            conn.execute(watermarks.update()
+                         .where(watermarks.c.rollup_name == self.name)
+                         .values(last_id=high))
+        logger.info("Updated %s groups of rollup %s (ids %s-%s)",
+                    len(groups), self.name, low + 1, high)
+        return len(groups)
+
+    def update(self, engine, lag=None):
+        """
+        Fold source events newer than the stored watermark, and those
+        within ``lag`` (by default :attr:`lag`) of the newest event, into
+        the rollup. Returns the number of groups recomputed.
+        """
+        lag = self.lag if lag is None else lag
+        for _ in range(self.max_attempts):
+            result = self._update(engine, lag)
+            if result is not None:
+                return result
+            self._create_watermark(engine)
+        raise RuntimeError("No watermark for rollup %s" % self.name)
+
+
+ROLLUPS = (
+    Rollup(ResourceViews, ResourceDailyRollups, 'resource_view_id'),
+    Rollup(VideoEvents, VideoDailyRollups, 'video_view_id'),
+)
+
+
+def update_rollups(engine, rollups=ROLLUPS, lag=None):
+    """
+    Incrementally update each of the given rollups, each in its own
+    transaction, recomputing groups within ``lag`` of the newest event
+    (see :class:`Rollup`). Returns a dict of rollup name to groups
+    recomputed.
+    """
+    return {rollup.name: rollup.update(engine, lag) for rollup in rollups}
+
+
+from nti.analytics_database.interfaces import IDatabaseCreator
+interface.moduleProvides(IDatabaseCreator)
@@ -8,7 +8,9 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+from sqlalchemy import event
 from sqlalchemy import Column
+from sqlalchemy import select
 from sqlalchemy import String
 from sqlalchemy import Integer
 from sqlalchemy import DateTime
@@ -18,6 +20,9 @@ from sqlalchemy import ForeignKey
 from sqlalchemy.ext.declarative import declared_attr
 
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm import object_session
+
+from sqlalchemy.orm.attributes import set_committed_value
 
 from sqlalchemy.schema import Sequence
 
@@ -41,6 +46,11 @@ class RootContextId(Base):
     context_id = Column('context_id', Integer,
                         Sequence('context_id_seq', start=1000),
                         nullable=False, primary_key=True)
+
+    # The table holding the root context with this id ('Books' or
+    # 'Courses'); set when the root context is inserted, null for
+    # ids created before this column existed.
+    context_type = Column('context_type', String(16), nullable=True)
 _RootContextId = RootContextId  # alias BWC
 
 
@@ -93,5 +103,66 @@ class Books(Base, RootContext):
     __tablename__ = 'Books'
 
 
+def set_context_types(connection, model, context_ids):
+    """
+    Record the table of the given newly inserted root contexts (of the
+    ``Books`` or ``Courses`` class) on their context ids.
+    """
+    context_ids = list(context_ids)
+    if not context_ids:
+        return
+    table = RootContextId.__table__
+    connection.execute(table.update()
+                       .where(table.c.context_id.in_(context_ids))
+                       .where(table.c.context_type == None)
+                       .values(context_type=model.__tablename__))
+
+
+def _record_context_type(unused_mapper, connection, target):
+    """
+    Record the table of a root context inserted through the ORM on its
+    context id. Core inserts (e.g. the dimension upserts) call
+    :func:`set_context_types` themselves.
+    """
+    context_type = target.__tablename__
+    set_context_types(connection, type(target), (target.context_id,))
+    # Keep an already loaded id row current
+    session = object_session(target)
+    key = session.identity_key(RootContextId, (target.context_id,))
+    record = session.identity_map.get(key)
+    if record is not None:
+        set_committed_value(record, 'context_type', context_type)
+
+for _context_class in (Books, Courses):
+    event.listen(_context_class, 'after_insert', _record_context_type)
+
+
+def backfill_context_types(engine):
+    """
+    Populate ``context_type`` for context ids created before the column
+    existed, or by an earlier version of this package. Returns the
+    number of rows updated.
+
+    ``create_all`` does not alter existing tables; upgrade them with::
+
+        ALTER TABLE ContextId ADD COLUMN context_type VARCHAR(16);
+        -- backfill_context_types(engine)
+
+    Rows without a type still resolve, with one lookup per table.
+    """
+    table = RootContextId.__table__
+    result = 0
+    for model in (Books, Courses):
+        context_ids = select([model.__table__.c.context_id])
+        with engine.begin() as conn:
+            updated = conn.execute(table.update()
+                                   .where(table.c.context_id.in_(context_ids))
+                                   .where(table.c.context_type == None)
+                                   .values(context_type=model.__tablename__))
+            result += updated.rowcount
+    logger.info("Backfilled %s context types", result)
+    return result
+
+
 from nti.analytics_database.interfaces import IDatabaseCreator
 interface.moduleProvides(IDatabaseCreator)
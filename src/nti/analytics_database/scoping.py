@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Session scoping for threaded and greenlet (gevent) deployments.
+
+Scoped sessions join the global ``transaction.manager``, which keeps one
+transaction per thread. Greenlet scoped sessions therefore need gevent to
+have monkey patched :mod:`threading` before :mod:`transaction` is
+imported, so that each greenlet also gets its own transaction; otherwise
+a greenlet beginning or aborting a transaction does so for every greenlet
+of its thread. :func:`greenlet_local` tells whether that is the case.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import weakref
+
+from sqlalchemy.orm import scoped_session
+
+from sqlalchemy.util import ScopedRegistry
+
+try:
+    from greenlet import greenlet
+    from greenlet import getcurrent
+except ImportError:  # pragma: no cover
+    greenlet = getcurrent = None
+
+logger = __import__('logging').getLogger(__name__)
+
+#: How scoped sessions are kept: one per ``thread`` (SQLAlchemy's
+#: default) or one per ``greenlet``.
+SESSION_SCOPES = ('thread', 'greenlet')
+
+
+def _close(session):
+    try:
+        session.close()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to close the session of a finished greenlet")
+
+
+class GreenletRegistry(ScopedRegistry):
+    """
+    A :class:`~sqlalchemy.util.ScopedRegistry` keeping one session per
+    greenlet (the main greenlet of each thread included).
+
+    Sessions are weakly keyed by their greenlet, and the session of a
+    greenlet that has been garbage collected is closed, returning its
+    connection to the pool, so finished greenlets do not leak them.
+    """
+
+    def __init__(self, createfunc):
+        if getcurrent is None:  # pragma: no cover
+            raise ImportError("greenlet is required for greenlet scoped sessions")
+        super(GreenletRegistry, self).__init__(createfunc, getcurrent)
+        self.registry = weakref.WeakKeyDictionary()
+        self._watchers = {}
+
+    def __len__(self):
+        return len(self.registry)
+
+    def __call__(self):
+        current = self.scopefunc()
+        try:
+            return self.registry[current]
+        except KeyError:
+            result = self.registry[current] = self.createfunc()
+            self._watch(current, result)
+            return result
+
+    def set(self, obj):
+        current = self.scopefunc()
+        self.registry[current] = obj
+        self._watch(current, obj)
+
+    def _watch(self, current, session):
+        def finished(ref):
+            self._watchers.pop(id(ref), None)
+            _close(session)
+        ref = weakref.ref(current, finished)
+        self._watchers[id(ref)] = ref
+
+
+def greenlet_local(factory):
+    """
+    Whether instances of the given :class:`threading.local` subclass (such
+    as the class of ``transaction.manager``) keep their state per greenlet,
+    as they do once gevent has monkey patched :mod:`threading`.
+    """
+    local = factory()
+    local.probe = True
+    seen = []
+    greenlet(lambda: seen.append(hasattr(local, 'probe'))).switch()
+    return not seen[0]
+
+
+def make_scoped_session(factory, scope='thread'):
+    """
+    Return a :class:`~sqlalchemy.orm.scoped_session` of the given
+    session factory with one of the :data:`SESSION_SCOPES`.
+    """
+    if scope not in SESSION_SCOPES:
+        raise ValueError("Unknown session scope '%s'" % scope)
+    result = scoped_session(factory)
+    if scope == 'greenlet':
+        result.registry = GreenletRegistry(factory)
+    return result
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Block (hi-lo style) allocation of event primary keys.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import threading
+
+from sqlalchemy import sql
+from sqlalchemy import func
+from sqlalchemy import text
+from sqlalchemy import select
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Integer
+
+from sqlalchemy.schema import Sequence
+
+from zope import interface
+
+from nti.analytics_database import Base
+
+from nti.analytics_database.batching import get_table
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The databases ids can be reserved in blocks on.
+BLOCK_ID_DIALECTS = ('postgresql', 'mysql', 'sqlite')
+
+_sqlite_sequence = sql.table('sqlite_sequence', sql.column('name'), sql.column('seq'))
+
+
+class IdBlocks(Base):
+    """
+    The next unreserved id of each block allocated table on MySQL.
+    """
+
+    __tablename__ = 'IdBlocks'
+
+    table_name = Column('table_name', String(64), primary_key=True)
+
+    next_id = Column('next_id', Integer, nullable=False)
+
+
+def supports_block_ids(engine):
+    """
+    Whether ids can be reserved in blocks on the given engine's database.
+    """
+    return engine.dialect.name in BLOCK_ID_DIALECTS
+
+
+def get_sequence_column(model):
+    """
+    Return the single primary key column of the given mapped class (or
+    table) that is generated by a :class:`Sequence`.
+    """
+    table = get_table(model)
+    columns = list(table.primary_key.columns)
+    if len(columns) != 1 or not isinstance(columns[0].default, Sequence):
+        raise TypeError("%s does not have a sequence primary key" % table.name)
+    return columns[0]
+
+
+class BlockIdAllocator(object):
+    """
+    Reserves ranges of primary key ids for a table, ``block_size`` at a
+    time, and hands them out locally so rows can be inserted with their
+    ids pre-assigned.
+
+    Reserved ids never collide with ids generated per row by ordinary
+    inserts, or with the blocks of other allocators (in any process):
+
+    - On PostgreSQL they come from the table's own sequence.
+
+    - On SQLite they come from the table's ``sqlite_sequence`` row,
+      which SQLite numbers new rows after, so the table must be created
+      with ``sqlite_autoincrement``.
+
+    - On MySQL the next id of the table is kept in ``IdBlocks`` and
+      advanced with a single ``UPDATE`` (never below the table's
+      maximum id). The table's ``AUTO_INCREMENT`` is then moved past the
+      block; that waits for the inserts in progress, after which the
+      block is checked to still be empty (else another is reserved).
+      Reservations of a table are serialized with a named lock, so
+      ``AUTO_INCREMENT`` only ever moves forward.
+    """
+
+    block_size = 1000
+
+    #: Seconds to wait for the MySQL named lock.
+    lock_timeout = 30
+
+    #: Reservations to try on MySQL before giving up.
+    max_attempts = 3
+
+    def __init__(self, engine, model, block_size=None):
+        if block_size is not None:
+            self.block_size = block_size
+        if not supports_block_ids(engine):
+            raise TypeError("Block id allocation is not supported on %s"
+                            % engine.dialect.name)
+        self.engine = engine
+        self.table = get_table(model)
+        self.column = get_sequence_column(model)
+        if     engine.dialect.name == 'sqlite' \
+           and not self.table.dialect_options['sqlite']['autoincrement']:
+            raise TypeError("%s is not created with sqlite_autoincrement"
+                            % self.table.name)
+        self.sequence = self.column.default
+        self._ids = iter(())
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            for result in self._ids:
+                return result
+            self._ids = iter(self.reserve(self.block_size))
+            return next(self._ids)
+
+    def allocate(self, count):
+        """
+        Return ``count`` ids.
+        """
+        return [self.next_id() for _ in range(count)]
+
+    def reserve(self, count):
+        """
+        Reserve ``count`` ids in a transaction of its own and return them.
+        """
+        name = self.engine.dialect.name
+        if name == 'postgresql':
+            return self._reserve_from_sequence(count)
+        if name == 'sqlite':
+            return self._reserve_from_sqlite_sequence(count)
+        return self._reserve_from_table(count)
+
+    def _max_id(self):
+        return select([func.coalesce(func.max(self.column), 0)]).scalar_subquery()
+
+    def _reserve_from_sequence(self, count):
+        query = select([self.sequence.next_value()]) \
+                .select_from(func.generate_series(1, count))
+        with self.engine.begin() as conn:
+            return sorted(x[0] for x in conn.execute(query))
+
+    def _reserve_from_sqlite_sequence(self, count):
+        name = self.table.name
+        with self.engine.begin() as conn:
+            # The update takes the database write lock, so the rest of
+            # the transaction is ours alone.
+            updated = conn.execute(_sqlite_sequence.update()
+                                   .where(_sqlite_sequence.c.name == name)
+                                   .values(seq=func.max(_sqlite_sequence.c.seq,
+                                                        self._max_id()) + count))
+            if not updated.rowcount:
+                # Nothing has been inserted yet
+                conn.execute(_sqlite_sequence.insert()
+                             .values(name=name, seq=self._max_id() + count))
+            end = conn.execute(select([_sqlite_sequence.c.seq])
+                               .where(_sqlite_sequence.c.name == name)).scalar()
+        return range(end - count + 1, end + 1)
+
+    def _reserve_from_table(self, count):
+        blocks = IdBlocks.__table__
+        name = self.table.name
+        lock = 'analytics_ids_%s' % name
+        preparer = self.engine.dialect.identifier_preparer
+        alter = 'ALTER TABLE %s AUTO_INCREMENT = %%d' % preparer.format_table(self.table)
+        with self.engine.connect() as conn:
+            if not conn.execute(select([func.get_lock(lock, self.lock_timeout)])).scalar():
+                raise RuntimeError("Timed out waiting to reserve ids for %s" % name)
+            try:
+                for _ in range(self.max_attempts):
+                    with conn.begin():
+                        updated = conn.execute(blocks.update()
+                                               .where(blocks.c.table_name == name)
+                                               .values(next_id=func.greatest(blocks.c.next_id,
+                                                                             self._max_id() + 1)
+                                                               + count))
+                        if not updated.rowcount:
+                            conn.execute(blocks.insert()
+                                         .values(table_name=name,
+                                                 next_id=self._max_id() + 1 + count))
+                        end = conn.execute(select([blocks.c.next_id])
+                                           .where(blocks.c.table_name == name)).scalar()
+                    start = end - count
+                    conn.execute(text(alter % end))
+                    taken = conn.execute(select([func.count()])
+                                         .select_from(self.table)
+                                         .where(self.column >= start)
+                                         .where(self.column < end)).scalar()
+                    if not taken:
+                        return range(start, end)
+                    logger.warning("Ids %s to %s of %s were taken by inserts, reserving again",
+                                   start, end, name)
+            finally:
+                conn.execute(select([func.release_lock(lock)]))
+        raise RuntimeError("Could not reserve ids for %s" % name)
+
+
+from nti.analytics_database.interfaces import IDatabaseCreator
+interface.moduleProvides(IDatabaseCreator)
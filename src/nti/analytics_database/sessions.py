@@ -8,6 +8,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import hashlib
+
+from sqlalchemy import and_
+from sqlalchemy import select
 from sqlalchemy import Column
 from sqlalchemy import String
 from sqlalchemy import Integer
@@ -18,6 +22,8 @@ from sqlalchemy.orm import relationship
 
 from sqlalchemy.schema import Sequence
 
+from sqlalchemy.sql.expression import bindparam
+
 from zope import interface
 
 from nti.analytics_database import SESSION_COLUMN_TYPE
@@ -134,6 +140,19 @@ class Location(Base):
     country = Column('country', String(128))
 
 
+def user_agent_hash(user_agent):
+    """
+    The fixed width (40 character) hash stored alongside a user agent.
+    """
+    if not isinstance(user_agent, bytes):
+        user_agent = user_agent.encode('utf-8')
+    return hashlib.sha1(user_agent).hexdigest()
+
+
+def _default_user_agent_hash(context):
+    return user_agent_hash(context.get_current_parameters()['user_agent'])
+
+
 class UserAgents(Base):
 
     __tablename__ = 'UserAgents'
@@ -142,13 +161,61 @@ class UserAgents(Base):
                            Sequence('user_agent_id_seq'),
                            index=True, primary_key=True)
 
-    # Indexing this large column could be fairly expensive.  Does it get us anything,
-    # or should we rely on a full column scan before inserting (perhaps also expensive)?
-    # Another alternative would be to hash this value in another column and just check that.
-    # If we do so, would we have to worry about collisions between unequal
-    # user-agents?
-    user_agent = Column('user_agent', String(512), unique=True,
-                        index=True, nullable=False)
+    # Indexing this large column is expensive (and hits key length limits
+    # in mysql), so we index a hash of it instead. Distinct user agents
+    # may share a hash, so the index is not unique and lookups also
+    # compare the full string.
+    user_agent = Column('user_agent', String(512), nullable=False)
+
+    # Nullable until existing rows are backfilled.
+    user_agent_hash = Column('user_agent_hash', String(40),
+                             nullable=True, index=True,
+                             default=_default_user_agent_hash)
+
+
+def user_agent_clause(user_agent):
+    """
+    Criteria matching the given user agent string using the hash index.
+    """
+    return and_(UserAgents.user_agent_hash == user_agent_hash(user_agent),
+                UserAgents.user_agent == user_agent)
+
+
+def backfill_user_agent_hashes(engine, batch_size=1000):
+    """
+    Populate ``user_agent_hash`` for rows created before the column
+    existed, ``batch_size`` rows per transaction. Returns the number of
+    rows updated.
+
+    ``create_all`` does not alter existing tables; upgrade them with::
+
+        ALTER TABLE UserAgents ADD COLUMN user_agent_hash VARCHAR(40);
+        -- backfill_user_agent_hashes(engine)
+        CREATE INDEX ix_UserAgents_user_agent_hash
+            ON UserAgents (user_agent_hash);
+
+    before starting this version, and backfill again for any rows the
+    previous version inserted in the meantime.
+    """
+    table = UserAgents.__table__
+    query = select([table.c.user_agent_id, table.c.user_agent]) \
+            .where(table.c.user_agent_hash == None) \
+            .order_by(table.c.user_agent_id) \
+            .limit(batch_size)
+    update = table.update() \
+                  .where(table.c.user_agent_id == bindparam('_id')) \
+                  .values(user_agent_hash=bindparam('_hash'))
+    result = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(query).fetchall()
+            if not rows:
+                break
+            conn.execute(update, [{'_id': row[0], '_hash': user_agent_hash(row[1])}
+                                  for row in rows])
+        result += len(rows)
+        logger.info("Backfilled %s user agent hashes", result)
+    return result
 
 
 from nti.analytics_database.interfaces import IDatabaseCreator
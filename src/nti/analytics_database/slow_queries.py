@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+A slow-query log that captures the query plan of slow statements.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import re
+import time
+import json
+import random
+import logging
+import threading
+
+from collections import deque
+
+from logging.handlers import RotatingFileHandler
+
+from six.moves import queue
+
+from sqlalchemy import event
+
+from nti.analytics_database.metrics import classify
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The tables whose slow statements are logged by default
+DEFAULT_TABLES = ('ResourceViews', 'VideoEvents', 'Sessions')
+
+#: The statement kinds we log (and can EXPLAIN)
+EXPLAINABLE = ('select', 'insert', 'update', 'delete')
+
+_STOP = object()
+
+
+def explain_prefix(dialect_name):
+    """
+    Return the prefix turning a statement into its query plan on the given
+    dialect, or None.
+    """
+    if dialect_name == 'sqlite':
+        return 'EXPLAIN QUERY PLAN '
+    if dialect_name in ('mysql', 'mariadb', 'postgresql'):
+        return 'EXPLAIN '
+    return None
+
+
+def _redact_value(value):
+    if value is None:
+        return None
+    return '*' * len(str(value))
+
+
+def redact(parameters):
+    """
+    Replace each parameter value with as many stars as its length,
+    the way connection URI passwords are hidden in our logs.
+    """
+    if isinstance(parameters, dict):
+        return {k: _redact_value(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(x) if isinstance(x, (dict, list, tuple)) else _redact_value(x)
+                for x in parameters]
+    return _redact_value(parameters)
+
+
+class SlowQueryLog(object):
+    """
+    Records statements against ``tables`` (all tables if None) that take
+    at least ``threshold`` seconds, sampling ``sample_rate`` of them.
+
+    The dialect's EXPLAIN of each recorded statement is run by a worker
+    thread on a separate connection, so the slow request is not held up
+    further. Records, with redacted parameters, are kept in ``recent``
+    and written as JSON lines to a rotating ``log_file`` (or this
+    module's logger).
+    """
+
+    threshold = 1.0
+    sample_rate = 1.0
+    max_bytes = 10 * 1024 * 1024
+    backup_count = 5
+    #: The number of statements waiting to be explained before we drop some
+    queue_size = 100
+    #: The number of records kept in ``recent``
+    history = 100
+
+    def __init__(self, threshold=None, tables=DEFAULT_TABLES, sample_rate=None,
+                 log_file=None, explain=True):
+        if threshold is not None:
+            self.threshold = threshold
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        self.tables = tables
+        self.explain = explain
+        self.recent = deque(maxlen=self.history)
+        self.dropped = 0
+        self._pattern = None
+        if tables:
+            self._pattern = re.compile(r'\b(?:%s)\b' % '|'.join(re.escape(x) for x in tables))
+        self._handler = None
+        if log_file:
+            self._handler = RotatingFileHandler(log_file,
+                                                maxBytes=self.max_bytes,
+                                                backupCount=self.backup_count)
+            self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self._queue = queue.Queue(self.queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, unused_conn, unused_cursor, unused_statement,
+                              unused_parameters, context, unused_executemany):
+        # On the execution context, which goes away with a failed statement
+        if context is not None:
+            context._analytics_slow_query_start = time.time()
+
+    def after_cursor_execute(self, conn, unused_cursor, statement,
+                             parameters, context, executemany):
+        start = getattr(context, '_analytics_slow_query_start', None)
+        if start is None:
+            return
+        elapsed = time.time() - start
+        if     elapsed < self.threshold \
+            or (self._pattern is not None and not self._pattern.search(statement)) \
+            or random.random() >= self.sample_rate:
+            return
+        kind, table = classify(statement)
+        if kind not in EXPLAINABLE:
+            return
+        if executemany and parameters:
+            parameters = parameters[0]
+        record = {'timestamp': time.time(),
+                  'elapsed': elapsed,
+                  'kind': kind,
+                  'table': table,
+                  'statement': statement,
+                  'parameters': redact(parameters)}
+        self._start()
+        try:
+            self._queue.put_nowait((conn.engine, statement, parameters, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='analytics-slow-queries')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                engine, statement, parameters, record = item
+                if self.explain:
+                    record['plan'] = self._explain(engine, statement, parameters)
+                self._write(record)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to log slow analytics query")
+            finally:
+                self._queue.task_done()
+
+    def _explain(self, engine, statement, parameters):
+        prefix = explain_prefix(engine.dialect.name)
+        if prefix is None:
+            return None
+        # A raw DBAPI connection: our own cursor events do not fire, and
+        # the statement is already in the driver's parameter style.
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters or ())
+                return [[str(x) for x in row] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as e:  # pylint: disable=broad-except
+            return ['EXPLAIN failed: %s' % e]
+        finally:
+            raw.close()
+
+    def _write(self, record):
+        self.recent.append(record)
+        line = json.dumps(record, sort_keys=True)
+        if self._handler is not None:
+            self._handler.handle(logging.makeLogRecord({'msg': line,
+                                                        'levelno': logging.WARNING,
+                                                        'levelname': 'WARNING'}))
+        else:
+            logger.warning("Slow analytics query: %s", line)
+
+    def flush(self):
+        """
+        Wait until all queued statements have been explained and logged.
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self._handler is not None:
+            self._handler.close()
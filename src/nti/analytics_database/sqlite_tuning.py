@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+A tuned profile for single-node SQLite analytics databases.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import atexit
+import threading
+
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The pragmas set on every new connection. In WAL mode readers no longer
+#: block on writers, and with ``synchronous=NORMAL`` commits only fsync at
+#: checkpoints (a power loss may lose the last commits, never corrupt).
+PRAGMAS = OrderedDict((
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    # Negative sizes are in KiB: 64MiB
+    ('cache_size', -64000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+))
+
+
+def set_pragmas(dbapi_connection, pragmas=PRAGMAS):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+    finally:
+        cursor.close()
+
+
+def tune(engine, pragmas=PRAGMAS):
+    """
+    Set the given pragmas on each connection the engine makes.
+
+    Some of them (the page cache in particular) only pay off for as long
+    as the connection lives, so the engine should pool its connections.
+    """
+    def on_connect(dbapi_connection, unused_record):
+        set_pragmas(dbapi_connection, pragmas)
+    event.listen(engine, 'connect', on_connect)
+    return engine
+
+
+class SQLiteMaintenance(object):
+    """
+    Runs ``PRAGMA optimize`` and a passive WAL checkpoint every
+    ``interval`` seconds in a daemon thread, so that the WAL file does not
+    grow unbounded under constant writes and the query planner's
+    statistics stay current.
+    """
+
+    interval = 300
+
+    def __init__(self, engine, interval=None):
+        self.engine = engine
+        if interval is not None:
+            self.interval = interval
+        self.runs = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Optimize and checkpoint once; returns the checkpoint's
+        ``(busy, log pages, checkpointed pages)``.
+        """
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute('PRAGMA optimize')
+                cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+                result = tuple(cursor.fetchone())
+            finally:
+                cursor.close()
+        finally:
+            raw.close()
+        self.runs += 1
+        return result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run()
+            except Exception:  # pylint: disable=broad-except
+                self.failed += 1
+                logger.exception("Failed to optimize the analytics SQLite database")
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='analytics-sqlite-maintenance')
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_maintenance = {}
+_maintenance_lock = threading.Lock()
+
+
+def _database_file(engine):
+    return os.path.abspath(engine.url.database)
+
+
+def acquire_maintenance(engine):
+    """
+    Return the :class:`SQLiteMaintenance` of the engine's database file,
+    started the first time; one runs per file however many engines (and
+    databases) use it. Pair with :func:`release_maintenance`.
+    """
+    path = _database_file(engine)
+    with _maintenance_lock:
+        result = _maintenance.get(path)
+        if result is None:
+            result = _maintenance[path] = SQLiteMaintenance(engine).start()
+            result.users = 0
+        result.users += 1
+    return result
+
+
+def release_maintenance(maintenance):
+    """
+    Stop the given maintenance once all its users released it.
+    """
+    with _maintenance_lock:
+        maintenance.users -= 1
+        if maintenance.users > 0:
+            return
+        _maintenance.pop(_database_file(maintenance.engine), None)
+    maintenance.close()
+
+
+@atexit.register
+def _close_maintenance():
+    with _maintenance_lock:
+        running = list(_maintenance.values())
+        _maintenance.clear()
+    for maintenance in running:
+        maintenance.close()
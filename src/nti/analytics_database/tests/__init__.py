@@ -18,6 +18,8 @@ from sqlalchemy.pool import StaticPool
 
 from nti.analytics_database import Base
 
+from nti.analytics_database import load_models
+
 from zope.component.hooks import setHooks
 
 from nti.testing.layers import GCLayerMixin
@@ -74,6 +76,7 @@ class AnalyticsDatabaseTest(unittest.TestCase):
 
     def setUp(self):
         self.engine = create_engine()
+        load_models()
         self.metadata = getattr(Base, 'metadata')
         self.metadata.create_all(bind=self.engine)
         self.sessionmaker = create_sessionmaker(self.engine)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import assert_that
+
+from datetime import datetime
+
+import transaction
+
+from nti.analytics_database.batching import get_table
+from nti.analytics_database.batching import BatchedWriter
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.resource_views import ResourceViews
+from nti.analytics_database.resource_views import VideoPlaySpeedEvents
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+def _view(idx):
+    return {'user_id': 1,
+            'resource_id': 1,
+            'timestamp': datetime(2018, 1, 1, 0, 0, idx),
+            'time_length': idx}
+
+
+class _FailingDataManager(object):
+
+    transaction_manager = transaction.manager
+
+    def abort(self, unused_txn):
+        pass
+
+    tpc_begin = commit = tpc_abort = abort
+
+    def tpc_vote(self, unused_txn):
+        raise ValueError()
+
+    def sortKey(self):
+        return '~failing'
+
+
+class TestBatchedWriter(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestBatchedWriter, self).setUp()
+        self.db = AnalyticsDB(dburi='sqlite://', testmode=True)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.session.remove()
+        super(TestBatchedWriter, self).tearDown()
+
+    def _count(self):
+        return self.db.session.query(ResourceViews).count()
+
+    def test_get_table(self):
+        table = ResourceViews.__table__
+        assert_that(get_table(ResourceViews), is_(table))
+        assert_that(get_table(table), is_(table))
+
+    def test_commit(self):
+        writer = self.db.batch_writer
+        writer.add(ResourceViews, _view(1))
+        writer.add(ResourceViews, **_view(2))
+        assert_that(writer.pending, is_(2))
+        assert_that(self._count(), is_(0))
+        transaction.commit()
+        assert_that(writer.pending, is_(0))
+        assert_that(self._count(), is_(2))
+
+    def test_abort(self):
+        writer = self.db.batch_writer
+        writer.add_all(ResourceViews, [_view(x) for x in range(3)])
+        transaction.abort()
+        assert_that(writer.pending, is_(0))
+        transaction.commit()
+        assert_that(self._count(), is_(0))
+
+    def test_thresholds(self):
+        writer = BatchedWriter(self.db, batch_size=3)
+        writer.add_all(ResourceViews, [_view(x) for x in range(2)])
+        assert_that(writer.pending, is_(2))
+        writer.add(ResourceViews, _view(3))
+        assert_that(writer.pending, is_(0))
+        assert_that(self._count(), is_(3))
+        # Flushed rows still abort with the transaction
+        transaction.abort()
+        assert_that(self._count(), is_(0))
+
+        writer = BatchedWriter(self.db, flush_interval=0)
+        writer.add(ResourceViews, _view(1))
+        assert_that(writer.pending, is_(0))
+        assert_that(writer.flush(), is_(0))
+
+    def test_savepoint(self):
+        writer = self.db.batch_writer
+        writer.add(ResourceViews, _view(1))
+        savepoint = transaction.savepoint()
+        writer.add_all(ResourceViews, [_view(2), _view(3)])
+        savepoint.rollback()
+        assert_that(writer.pending, is_(1))
+
+        savepoint = transaction.savepoint()
+        writer.add(VideoPlaySpeedEvents, old_play_speed=u'1',
+                   new_play_speed=u'2', video_time=1, resource_id=1)
+        savepoint.rollback()
+        assert_that(writer.pending, is_(1))
+
+        # Rows buffered before the savepoint and flushed after it are
+        # rolled back by the session, and buffered again
+        savepoint = transaction.savepoint()
+        writer.flush()
+        writer.add(get_table(ResourceViews), _view(4))
+        savepoint.rollback()
+        assert_that(writer.pending, is_(1))
+
+        writer.add(ResourceViews, _view(5))
+        writer.discard()
+        assert_that(writer.pending, is_(0))
+
+        savepoint = transaction.savepoint()
+        writer.add(ResourceViews, _view(6))
+        savepoint.rollback()
+        assert_that(writer.pending, is_(0))
+
+    def test_savepoint_after_flush(self):
+        writer = self.db.batch_writer
+        writer.add(ResourceViews, _view(1))
+        savepoint = transaction.savepoint()
+        writer.flush()
+        savepoint.rollback()
+        assert_that(writer.pending, is_(1))
+        transaction.commit()
+        assert_that(self._count(), is_(1))
+
+    def test_tpc_abort(self):
+        writer = self.db.batch_writer
+        writer.add(ResourceViews, _view(1))
+        transaction.get().join(_FailingDataManager())
+        assert_that(calling(transaction.commit), raises(ValueError))
+        assert_that(writer.pending, is_(0))
+        transaction.abort()
+        assert_that(self._count(), is_(0))
+
+    def test_allocate_ids(self):
+        writer = BatchedWriter(self.db, allocate_ids=True)
+        self.db.get_id_allocator(ResourceViews).block_size = 10
+        assert_that(writer.add(ResourceViews, _view(1)), is_(1))
+        assert_that(writer.add_all(ResourceViews, [_view(2), _view(3)]),
+                    is_([2, 3]))
+        transaction.commit()
+        ids = [x.resource_view_id for x in self.db.session.query(ResourceViews)]
+        assert_that(sorted(ids), is_([1, 2, 3]))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import assert_that
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+
+from sqlalchemy import Float
+from sqlalchemy import Column
+from sqlalchemy import Numeric
+from sqlalchemy import PickleType
+from sqlalchemy import LargeBinary
+from sqlalchemy import SmallInteger
+
+from nti.analytics_database.assessments import AssignmentsTaken
+
+from nti.analytics_database.columnar import arrow_type
+from nti.analytics_database.columnar import arrow_schema
+from nti.analytics_database.columnar import export_columnar
+
+from nti.analytics_database.resource_views import VideoEvents
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.rollups import ResourceDailyRollups
+
+from nti.analytics_database.root_context import Courses
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestColumnar(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestColumnar, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+        super(TestColumnar, self).tearDown()
+
+    def test_types(self):
+        schema = arrow_schema(AssignmentsTaken)
+        assert_that(schema.field('submission_id').type, is_(pyarrow.int64()))
+        assert_that(schema.field('user_id').type, is_(pyarrow.int32()))
+        assert_that(schema.field('assignment_id').type, is_(pyarrow.string()))
+        assert_that(schema.field('timestamp').type, is_(pyarrow.timestamp('us')))
+        assert_that(schema.field('is_late').type, is_(pyarrow.bool_()))
+        assert_that(arrow_schema(ResourceDailyRollups).field('day').type,
+                    is_(pyarrow.date32()))
+        assert_that(arrow_schema(Courses).field('duration').type,
+                    is_(pyarrow.duration('us')))
+
+        assert_that(arrow_type(Column('x', SmallInteger)), is_(pyarrow.int16()))
+        assert_that(arrow_type(Column('x', Numeric(10, 2))),
+                    is_(pyarrow.decimal128(10, 2)))
+        assert_that(arrow_type(Column('x', Numeric)), is_(pyarrow.float64()))
+        assert_that(arrow_type(Column('x', Float)), is_(pyarrow.float64()))
+        assert_that(arrow_type(Column('x', LargeBinary)), is_(pyarrow.binary()))
+        assert_that(calling(arrow_type).with_args(Column('x', PickleType)),
+                    raises(TypeError))
+
+    def test_export(self):
+        self.engine.execute(ResourceViews.__table__.insert(),
+                            [{'user_id': 1,
+                              'resource_id': 1,
+                              'course_id': course_id,
+                              'timestamp': timestamp,
+                              'time_length': 10}
+                             for course_id in (1, 2, None)
+                             for timestamp in (datetime(2018, 1, 5),
+                                               datetime(2018, 2, 5),
+                                               None)])
+        path = os.path.join(self.tmp_dir, 'views')
+        assert_that(export_columnar(self.engine, ResourceViews, path, chunk_size=4),
+                    is_(9))
+        partitions = sorted(os.path.relpath(os.path.join(root, name), path)
+                            for root, _, files in os.walk(path)
+                            for name in files)
+        assert_that(partitions, is_([
+            'course_id=1/month=2018-01/part-0.parquet',
+            'course_id=1/month=2018-02/part-0.parquet',
+            'course_id=1/month=__HIVE_DEFAULT_PARTITION__/part-0.parquet',
+            'course_id=2/month=2018-01/part-0.parquet',
+            'course_id=2/month=2018-02/part-0.parquet',
+            'course_id=2/month=__HIVE_DEFAULT_PARTITION__/part-0.parquet',
+            'course_id=__HIVE_DEFAULT_PARTITION__/month=2018-01/part-0.parquet',
+            'course_id=__HIVE_DEFAULT_PARTITION__/month=2018-02/part-0.parquet',
+            'course_id=__HIVE_DEFAULT_PARTITION__/month=__HIVE_DEFAULT_PARTITION__/part-0.parquet',
+        ]))
+        table = pyarrow.parquet.read_table(os.path.join(path, partitions[0]))
+        assert_that('course_id' in table.schema.names, is_(False))
+        assert_that(table.column('time_length').to_pylist(), is_([10]))
+        assert_that(table.column('timestamp').to_pylist(), is_([datetime(2018, 1, 5)]))
+
+    def test_bounded(self):
+        self.engine.execute(ResourceViews.__table__.insert(),
+                            [{'user_id': 1,
+                              'resource_id': 1,
+                              'course_id': idx % 3,
+                              'timestamp': datetime(2018, 1, 5),
+                              'time_length': idx}
+                             for idx in range(12)])
+        path = os.path.join(self.tmp_dir, 'views')
+        assert_that(export_columnar(self.engine, ResourceViews, path, chunk_size=3,
+                                    row_group_size=2, max_buffered=3, max_open=2),
+                    is_(12))
+        files = sorted(os.path.relpath(os.path.join(root, name), path)
+                       for root, _, files in os.walk(path)
+                       for name in files)
+        assert_that(files, is_([
+            'course_id=0/month=2018-01/part-0.parquet',
+            'course_id=0/month=2018-01/part-1.parquet',
+            'course_id=1/month=2018-01/part-0.parquet',
+            'course_id=1/month=2018-01/part-1.parquet',
+            'course_id=2/month=2018-01/part-0.parquet',
+            'course_id=2/month=2018-01/part-1.parquet',
+        ]))
+        for course_id in range(3):
+            lengths = []
+            for name in files:
+                if name.startswith('course_id=%s/' % course_id):
+                    parquet = pyarrow.parquet.ParquetFile(os.path.join(path, name))
+                    assert_that(parquet.metadata.num_row_groups, is_(1))
+                    lengths.extend(parquet.read().column('time_length').to_pylist())
+            assert_that(lengths, is_(list(range(course_id, 12, 3))))
+
+        path = os.path.join(self.tmp_dir, 'arrow')
+        assert_that(export_columnar(self.engine, ResourceViews, path, chunk_size=12,
+                                    file_format='arrow', row_group_size=3),
+                    is_(12))
+        name = os.path.join(path, 'course_id=0', 'month=2018-01', 'part-0.arrow')
+        with pyarrow.memory_map(name) as source:
+            reader = pyarrow.ipc.open_file(source)
+            assert_that(reader.num_record_batches, is_(2))
+
+        # Too many rows buffered writes the largest buffer
+        path = os.path.join(self.tmp_dir, 'buffered')
+        assert_that(export_columnar(self.engine, ResourceViews, path, chunk_size=3,
+                                    row_group_size=4, max_buffered=5),
+                    is_(12))
+        name = os.path.join(path, 'course_id=0', 'month=2018-01', 'part-0.parquet')
+        parquet = pyarrow.parquet.ParquetFile(name)
+        assert_that(parquet.metadata.num_row_groups, is_(2))
+        assert_that(parquet.read().column('time_length').to_pylist(), is_([0, 3, 6, 9]))
+
+    def test_arrow(self):
+        self.engine.execute(Users.__table__.insert(), user_ds_id=1, username=u'ichigo')
+        self.engine.execute(VideoEvents.__table__.insert(),
+                            user_id=1, resource_id=1, course_id=1,
+                            timestamp=datetime(2018, 1, 1),
+                            video_event_type=u'WATCH',
+                            video_start_time=0, with_transcript=False,
+                            time_length=60)
+
+        path = os.path.join(self.tmp_dir, 'users')
+        assert_that(export_columnar(self.engine, Users, path, file_format='arrow'),
+                    is_(1))
+        with pyarrow.memory_map(os.path.join(path, 'part-0.arrow')) as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+        assert_that(table.column('username').to_pylist(), is_([u'ichigo']))
+
+        path = os.path.join(self.tmp_dir, 'videos')
+        assert_that(export_columnar(self.engine, VideoEvents, path, partition=False),
+                    is_(1))
+        table = pyarrow.parquet.read_table(os.path.join(path, 'part-0.parquet'))
+        assert_that(table.column('course_id').to_pylist(), is_([1]))
+        assert_that(table.column('video_event_type').to_pylist(), is_([u'WATCH']))
+
+        assert_that(calling(export_columnar).with_args(self.engine, Users, path,
+                                                       file_format='orc'),
+                    raises(ValueError))
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_string
+
+import threading
+
+import fudge
+
+import transaction
+
+from sqlalchemy import Table
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import UniqueConstraint
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.dimensions import Dimension
+from nti.analytics_database.dimensions import DimensionCache
+
+from nti.analytics_database.dimensions import get_or_create
+from nti.analytics_database.dimensions import get_dimension
+from nti.analytics_database.dimensions import _insert_ignore
+from nti.analytics_database.dimensions import get_or_create_many
+
+from nti.analytics_database.enrollments import EnrollmentTypes
+
+from nti.analytics_database.mime_types import FileMimeTypes
+
+from nti.analytics_database.resources import Resources
+
+from nti.analytics_database.root_context import Books
+from nti.analytics_database.root_context import Courses
+from nti.analytics_database.root_context import RootContextId
+
+from nti.analytics_database.sessions import Location
+from nti.analytics_database.sessions import Sessions
+from nti.analytics_database.sessions import UserAgents
+from nti.analytics_database.sessions import user_agent_hash
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+from nti.analytics_database.users import Users
+
+
+class TestDimensions(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestDimensions, self).setUp()
+        self.db = AnalyticsDB(dburi='sqlite://', testmode=True)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.session.remove()
+        super(TestDimensions, self).tearDown()
+
+    def test_resolve(self):
+        session = self.db.session
+        session.add(Users(user_id=1, user_ds_id=100))
+        session.add(Users(user_id=2, user_ds_id=200))
+        session.add(Users(user_id=3, user_ds_id=200))
+        session.add(Resources(resource_id=1, resource_ds_id=u'tag:nti:1'))
+        session.add(RootContextId(context_id=1000))
+        session.add(Courses(context_id=1000, context_ds_id=u'tag:nti:course'))
+        transaction.commit()
+
+        assert_that(self.db.get_dimension_ids(Users, (100, 200, 300)),
+                    is_({100: 1, 200: 2}))
+        assert_that(self.db.get_dimension_id(Resources, u'tag:nti:1'), is_(1))
+        assert_that(self.db.get_dimension_id(Courses, u'tag:nti:course'), is_(1000))
+
+        cache = self.db.dimension_cache
+        # Shared once the transaction commits
+        assert_that(cache, has_length(0))
+        transaction.commit()
+        assert_that(cache, has_length(4))
+        assert_that(cache.misses, is_(5))
+        # Now from the cache
+        assert_that(self.db.get_dimension_id(Users, 100), is_(1))
+        assert_that(cache.hits, is_(1))
+        assert_that(self.db.get_dimension_id(Users, 300), is_(none()))
+
+        cache.invalidate(Users, (100,))
+        assert_that(cache.get(Users, 100), is_(none()))
+        cache.put(Users, 400, 4)
+        cache.invalidate(Users, (400,))
+        assert_that(cache.get(Users, 400), is_(none()))
+        cache.put(Users, 400, 4)
+        cache.clear()
+        assert_that(cache, has_length(0))
+        assert_that(cache.get(Users, 400), is_(none()))
+
+        assert_that(calling(cache.get).with_args(Sessions, 1),
+                    raises(TypeError))
+
+        dimension = Dimension(Users, 'user_ds_id', 'user_id')
+        dimension.chunk_size = 1
+        assert_that(dimension.lookup(session, (100, 200)),
+                    is_({100: 1, 200: 2}))
+
+    def test_rollback(self):
+        self.db.cache_dimension_id(Users, 100, 1)
+        assert_that(self.db.dimension_cache.get(Users, 100), is_(1))
+        transaction.abort()
+        assert_that(self.db.dimension_cache.get(Users, 100), is_(none()))
+
+        self.db.cache_dimension_id(Users, 100, 1)
+        transaction.commit()
+        assert_that(self.db.dimension_cache.get(Users, 100), is_(1))
+
+        savepoint = transaction.savepoint()
+        self.db.cache_dimension_id(Users, 200, 2)
+        savepoint.rollback()
+        assert_that(self.db.dimension_cache.get(Users, 200), is_(none()))
+
+        # With the cache already in the transaction
+        self.db.cache_dimension_id(Users, 300, 3)
+        savepoint = transaction.savepoint()
+        self.db.cache_dimension_id(Users, 400, 4)
+        savepoint.rollback()
+        assert_that(self.db.dimension_cache.get(Users, 400), is_(none()))
+
+    def test_uncommitted(self):
+        self.db.cache_dimension_id(Users, 100, 1)
+        assert_that(self.db.dimension_cache.get(Users, 100), is_(1))
+        seen = []
+
+        def lookup():
+            with transaction.manager:
+                seen.append(self.db.dimension_cache.get(Users, 100))
+        # Other threads miss until the inserting transaction commits
+        thread = threading.Thread(target=lookup)
+        thread.start()
+        thread.join()
+        transaction.commit()
+        thread = threading.Thread(target=lookup)
+        thread.start()
+        thread.join()
+        assert_that(seen, is_([None, 1]))
+
+    def test_lru(self):
+        cache = DimensionCache(maxsize=2)
+        for idx in (1, 2):
+            cache.put(Users, idx, idx)
+            transaction.commit()
+        cache.get(Users, 1)
+        cache.put(Users, 3, 3)
+        transaction.commit()
+        assert_that(cache.get_many(Users, (1, 2, 3)), is_({1: 1, 3: 3}))
+
+
+class TestGetOrCreate(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestGetOrCreate, self).setUp()
+        self.db = AnalyticsDB(dburi='sqlite://', testmode=True)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.session.remove()
+        super(TestGetOrCreate, self).tearDown()
+
+    def test_unique(self):
+        assert_that(get_dimension(UserAgents).unique, is_(False))
+        assert_that(get_dimension(EnrollmentTypes).unique, is_(True))
+        assert_that(get_dimension(Resources).unique, is_(False))
+        assert_that(get_dimension(Location).unique, is_(False))
+
+        metadata = MetaData()
+        table = Table('Points', metadata,
+                      Column('point_id', Integer, primary_key=True),
+                      Column('x', Integer),
+                      Column('y', Integer),
+                      UniqueConstraint('x', 'y'))
+        model = type('Points', (object,), {'__table__': table})
+        assert_that(Dimension(model, ('x', 'y'), 'point_id').unique, is_(True))
+        assert_that(Dimension(model, 'x', 'point_id').unique, is_(False))
+
+    def test_get_or_create(self):
+        session = self.db.session
+        first = get_or_create(session, UserAgents, {'user_agent': u'Mozilla'})
+        assert_that(get_or_create(session, UserAgents, {'user_agent': u'Mozilla'}),
+                    is_(first))
+        other = get_or_create(session, UserAgents, {'user_agent': u'Chrome'})
+        assert_that(other, is_not(first))
+
+        resource = get_or_create(session, Resources,
+                                 {'resource_ds_id': u'tag:nti:1',
+                                  'max_time_length': 10})
+        assert_that(get_or_create(session, Resources, {'resource_ds_id': u'tag:nti:1'}),
+                    is_(resource))
+
+        values = {'latitude': u'35.2226', 'longitude': u'97.4395', 'city': u'Norman'}
+        location = get_or_create(session, Location, values)
+        assert_that(get_or_create(session, Location, values), is_(location))
+
+        transaction.commit()
+        assert_that(session.query(UserAgents).count(), is_(2))
+        assert_that(session.query(Resources).one().max_time_length, is_(10))
+        assert_that(session.query(Location).one().city, is_(u'Norman'))
+
+    def test_get_or_create_many(self):
+        session = self.db.session
+        existing = get_or_create(session, EnrollmentTypes, {'type_name': u'Public'})
+        result = get_or_create_many(session, EnrollmentTypes,
+                                    [{'type_name': u'Public'},
+                                     {'type_name': u'ForCredit'},
+                                     {'type_name': u'ForCredit'}])
+        assert_that(result, has_length(2))
+        assert_that(result[u'Public'], is_(existing))
+
+        result = get_or_create_many(session, FileMimeTypes,
+                                    [{'mime_type': u'text/plain'},
+                                     {'mime_type': u'image/png'}])
+        assert_that(result, has_length(2))
+        assert_that(get_or_create_many(session, FileMimeTypes,
+                                       [{'mime_type': u'image/png'}]),
+                    is_({u'image/png': result[u'image/png']}))
+        transaction.commit()
+        assert_that(session.query(EnrollmentTypes).count(), is_(2))
+        assert_that(session.query(FileMimeTypes).count(), is_(2))
+
+    def test_analytics_db(self):
+        values = {'user_agent': u'Mozilla'}
+        first = self.db.get_or_create_dimension_id(UserAgents, values)
+        assert_that(self.db.get_or_create_dimension_id(UserAgents, values),
+                    is_(first))
+        assert_that(self.db.dimension_cache.hits, is_(1))
+        result = self.db.get_or_create_dimension_ids(UserAgents,
+                                                     [values, {'user_agent': u'Chrome'}])
+        assert_that(result[u'Mozilla'], is_(first))
+        assert_that(self.db.get_or_create_dimension_ids(UserAgents, [values]),
+                    is_({u'Mozilla': first}))
+        # Another user agent with the same hash is a different row
+        values = {'user_agent': u'Mozilla/5.0',
+                  'user_agent_hash': user_agent_hash(u'Mozilla')}
+        self.db.session.execute(UserAgents.__table__.insert().values(**values))
+        assert_that(get_or_create(self.db.session, UserAgents, {'user_agent': u'Mozilla'}),
+                    is_(first))
+        other = get_or_create(self.db.session, UserAgents, {'user_agent': u'Mozilla/5.0'})
+        assert_that(other, is_not(first))
+
+    def test_root_contexts(self):
+        session = self.db.session
+        for idx in (1, 2, 3):
+            session.add(RootContextId(context_id=idx))
+        session.flush()
+        course = {'context_ds_id': u'tag:nti:course', 'context_id': 1}
+        assert_that(self.db.get_or_create_dimension_id(Courses, course), is_(1))
+        assert_that(get_or_create(session, Courses, course), is_(1))
+        books = [{'context_ds_id': u'tag:nti:book', 'context_id': 2}]
+        assert_that(self.db.get_or_create_dimension_ids(Books, books),
+                    is_({u'tag:nti:book': 2}))
+        # The context type is recorded as for ORM inserts
+        session.expire_all()
+        assert_that([x.context_type for x in session.query(RootContextId)],
+                    is_(['Courses', 'Books', None]))
+
+    @fudge.patch('nti.analytics_database.dimensions.mark_changed')
+    def test_dialects(self, mock_mark_changed):
+        mock_mark_changed.is_callable()
+        dimension = get_dimension(EnrollmentTypes)
+        stmt = _insert_ignore('postgresql', dimension)
+        assert_that(str(stmt.compile(dialect=postgresql.dialect())),
+                    contains_string('ON CONFLICT (type_name) DO NOTHING'))
+        stmt = _insert_ignore('mysql', dimension)
+        assert_that(str(stmt.compile(dialect=mysql.dialect())),
+                    contains_string('ON DUPLICATE KEY UPDATE'))
+        assert_that(_insert_ignore('oracle', dimension), is_(none()))
+        assert_that(_insert_ignore('mysql', get_dimension(Resources)), is_(none()))
+        assert_that(_insert_ignore('postgresql', get_dimension(UserAgents)), is_(none()))
+
+        statements = []
+
+        def execute(stmt):
+            statements.append(stmt)
+            return fudge.Fake().has_attr(lastrowid=7).provides('scalar').returns(8)
+
+        def session(name):
+            bind = fudge.Fake().has_attr(dialect=fudge.Fake().has_attr(name=name))
+            return fudge.Fake().provides('get_bind').returns(bind) \
+                               .provides('execute').calls(execute)
+
+        values = {'type_name': u'Public'}
+        assert_that(get_or_create(session('postgresql'), EnrollmentTypes, values), is_(8))
+        assert_that(str(statements[-1].compile(dialect=postgresql.dialect())),
+                    contains_string('DO UPDATE SET type_name = excluded.type_name '
+                                    'RETURNING "EnrollmentTypes".type_id'))
+        assert_that(get_or_create(session('mysql'), EnrollmentTypes, values), is_(7))
+        assert_that(str(statements[-1].compile(dialect=mysql.dialect())),
+                    contains_string('type_id = last_insert_id(`EnrollmentTypes`.type_id)'))
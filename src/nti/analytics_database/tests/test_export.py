@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_entry
+from hamcrest import assert_that
+
+import csv
+import json
+
+from datetime import datetime
+
+from six import StringIO
+
+from nti.analytics_database.enrollments import CourseEnrollments
+
+from nti.analytics_database.export import iter_rows
+from nti.analytics_database.export import iter_chunks
+from nti.analytics_database.export import export_csv
+from nti.analytics_database.export import export_jsonl
+from nti.analytics_database.export import _json_default
+
+from nti.analytics_database.resources import Resources
+
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestExport(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        self.engine.execute(Users.__table__.insert(),
+                            [{'user_id': 1, 'user_ds_id': 1, 'allow_research': True},
+                             {'user_id': 2, 'user_ds_id': 2, 'allow_research': False},
+                             {'user_id': 3, 'user_ds_id': 3, 'allow_research': None}])
+        self.engine.execute(ResourceViews.__table__.insert(),
+                            [{'user_id': (idx % 3) + 1,
+                              'resource_id': 1,
+                              'timestamp': datetime(2018, 1, 1, 0, 0, idx),
+                              'time_length': idx} for idx in range(10)])
+
+    def test_iter_chunks(self):
+        chunks = list(iter_chunks(self.engine, ResourceViews, chunk_size=4))
+        assert_that([len(x) for x in chunks], is_([4, 4, 2]))
+        assert_that([x.time_length for x in iter_rows(self.engine, ResourceViews, chunk_size=5)],
+                    is_(list(range(10))))
+
+        rows = list(iter_rows(self.engine, ResourceViews, chunk_size=2, research=True))
+        assert_that([x.time_length for x in rows], is_([0, 3, 6, 9]))
+        rows = list(iter_rows(self.engine, Users, research=True))
+        assert_that([x.user_id for x in rows], is_([1]))
+
+        where = ResourceViews.time_length > 6
+        rows = list(iter_rows(self.engine, ResourceViews, chunk_size=2, where=where))
+        assert_that([x.time_length for x in rows], is_([7, 8, 9]))
+
+        assert_that(calling(list).with_args(iter_rows(self.engine, Resources, research=True)),
+                    raises(TypeError))
+
+    def test_composite_keys(self):
+        self.engine.execute(CourseEnrollments.__table__.insert(),
+                            [{'course_id': course_id, 'user_id': user_id, 'type_id': 1}
+                             for course_id in (2, 1) for user_id in (3, 1, 2)])
+        rows = list(iter_rows(self.engine, CourseEnrollments, chunk_size=2))
+        assert_that([(x.course_id, x.user_id) for x in rows],
+                    is_([(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3)]))
+
+    def test_export(self):
+        stream = StringIO()
+        assert_that(export_csv(self.engine, ResourceViews, stream, chunk_size=3),
+                    is_(10))
+        rows = list(csv.reader(StringIO(stream.getvalue())))
+        assert_that(len(rows), is_(11))
+        assert_that(rows[0], is_(ResourceViews.__table__.c.keys()))
+
+        stream = StringIO()
+        assert_that(export_jsonl(self.engine, ResourceViews, stream, research=True),
+                    is_(4))
+        lines = stream.getvalue().splitlines()
+        assert_that(json.loads(lines[1]), has_entry('timestamp', '2018-01-01T00:00:03'))
+        assert_that(json.loads(lines[1]), has_entry('user_id', 1))
+
+        assert_that(calling(_json_default).with_args(object()),
+                    raises(TypeError))
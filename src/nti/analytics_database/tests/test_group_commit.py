@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import less_than
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_entries
+from hamcrest import instance_of
+
+import os
+import shutil
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+import fudge
+
+import transaction
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from zope.sqlalchemy.datamanager import SessionDataManager
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.group_commit import _STOP
+from nti.analytics_database.group_commit import _Submission
+from nti.analytics_database.group_commit import GroupCommitter
+from nti.analytics_database.group_commit import _GroupCommitDataManager
+
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+def _view(idx):
+    return {'user_id': 1, 'resource_id': 1, 'time_length': idx}
+
+
+class TestGroupCommit(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestGroupCommit, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        dburi = 'sqlite:///%s' % os.path.join(self.tmp_dir, 'analytics.db')
+        self.db = AnalyticsDB(dburi=dburi, testmode=True, group_commit=True,
+                              group_commit_window=0.2)
+        self.writer = self.db.group_commit_writer
+
+    def tearDown(self):
+        self.writer.committer.close()
+        shutil.rmtree(self.tmp_dir, True)
+        super(TestGroupCommit, self).tearDown()
+
+    def _count(self):
+        query = select([func.count()]).select_from(ResourceViews.__table__)
+        return self.db.engine.execute(query).scalar()
+
+    def test_group(self):
+        errors = {}
+
+        def record(idx):
+            try:
+                with transaction.manager:
+                    if idx == 3:
+                        # Not null resource_id
+                        self.writer.add(ResourceViews, user_id=1)
+                    else:
+                        self.writer.add(ResourceViews, _view(idx))
+                    self.writer.add_all(Users, [{'user_ds_id': idx}])
+            except Exception as e:  # pylint: disable=broad-except
+                errors[idx] = e
+        threads = [threading.Thread(target=record, args=(idx,)) for idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Each transaction gets its own outcome
+        assert_that(list(errors), is_([3]))
+        assert_that(self._count(), is_(7))
+        stats = self.writer.committer.stats()
+        assert_that(stats, has_entries('submissions', 8,
+                                       'rows', 14,
+                                       'failed', 1))
+        assert_that(stats['commits'], less_than(8))
+        assert_that(self.writer.committer.retry_policy, is_(self.db.retry_policy))
+
+    def test_votes_last(self):
+        transaction.begin()
+        self.db.session.add(Users(user_ds_id=1))
+        self.db.session.flush()
+        self.writer.add(ResourceViews, _view(1))
+        # After the one-phase session, which commits when it votes
+        resources = sorted(transaction.get()._resources, key=lambda x: x.sortKey())
+        assert_that(resources[-2], instance_of(SessionDataManager))
+        assert_that(resources[-1], instance_of(_GroupCommitDataManager))
+        transaction.abort()
+
+    def test_abort(self):
+        transaction.begin()
+        self.writer.add(ResourceViews, _view(1))
+        savepoint = transaction.savepoint()
+        self.writer.add(ResourceViews, _view(2))
+        self.writer.add(Users, user_ds_id=1)
+        savepoint.rollback()
+        assert_that(self.writer.pending, is_(1))
+        savepoint = transaction.savepoint()
+        savepoint.rollback()
+        assert_that(self.writer.pending, is_(1))
+        transaction.abort()
+        assert_that(self.writer.pending, is_(0))
+
+        transaction.begin()
+        transaction.commit()
+        assert_that(self._count(), is_(0))
+
+    def test_stopping(self):
+        committer = GroupCommitter(self.db.engine, window=1)
+        first = _Submission(OrderedDict([(ResourceViews.__table__, [_view(1)])]))
+        second = _Submission(OrderedDict([(ResourceViews.__table__, [_view(2)])]))
+        for item in (first, _STOP, second, _STOP):
+            committer._queue.put(item)
+        committer.start()
+        committer._thread.join()
+        assert_that(first.done.is_set(), is_(True))
+        assert_that(second.done.is_set(), is_(True))
+        assert_that(self._count(), is_(2))
+
+        committer._queue.put(_STOP)
+        committer.start()
+        committer._thread.join()
+        assert_that(committer.stats(), has_entries('submissions', 2,
+                                                   'commits', 2))
+        committer.close()
+
+        committer.start = lambda: committer
+        committer.timeout = 0.01
+        assert_that(calling(committer.submit).with_args(first.buffers),
+                    raises(RuntimeError))
+        # The timed out submission is cancelled, not written later
+        GroupCommitter.start(committer)
+        committer.close()
+        assert_that(self._count(), is_(2))
+        assert_that(committer.stats(), has_entries('submissions', 2,
+                                                   'cancelled', 1))
+
+        # Once the worker is writing it, the submitter waits for it
+        def put(submission):
+            submission.claim()
+            threading.Timer(0.05, submission.done.set).start()
+        committer._queue = fudge.Fake().provides('put').calls(put)
+        committer.submit(first.buffers)
+
+    def test_disabled(self):
+        db = AnalyticsDB(dburi='sqlite://', testmode=True)
+        assert_that(db.group_commit_writer, is_(none()))
+        assert_that(self.writer._state.buffers, has_length(0))
+
+        committer = GroupCommitter(self.db.engine, window=0, max_rows=10)
+        committer.submit(OrderedDict([(ResourceViews.__table__, [_view(1)])]))
+        committer.close()
+        assert_that(self._count(), is_(1))
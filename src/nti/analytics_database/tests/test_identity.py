@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_inanyorder
+
+from datetime import datetime
+
+from sqlalchemy import event
+
+from zope import component
+
+from nti.analytics_database.assessments import AssignmentsTaken
+from nti.analytics_database.assessments import SelfAssessmentsTaken
+
+from nti.analytics_database.boards import TopicsCreated
+from nti.analytics_database.boards import ForumsCreated
+from nti.analytics_database.boards import ForumCommentsCreated
+
+from nti.analytics_database.enrollments import CourseEnrollments
+
+from nti.analytics_database.identity import preload
+from nti.analytics_database.identity import AnalyticsDSIdentifier
+from nti.analytics_database.identity import get_objects
+from nti.analytics_database.identity import preload_root_contexts
+
+from nti.analytics_database.interfaces import IAnalyticsDSIdentifier
+from nti.analytics_database.interfaces import IAnalyticsIntidIdentifier
+from nti.analytics_database.interfaces import IAnalyticsRootContextResolver
+
+from nti.analytics_database.resource_tags import NotesViewed
+from nti.analytics_database.resource_tags import NotesCreated
+
+from nti.analytics_database.root_context import Books
+from nti.analytics_database.root_context import Courses
+from nti.analytics_database.root_context import RootContextId
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class _Identifier(AnalyticsDSIdentifier):
+
+    def __init__(self):
+        self.lookups = []
+
+    def get_object(self, obj_id):
+        self.lookups.append(obj_id)
+        return 'object%s' % obj_id
+
+
+class _BatchIdentifier(_Identifier):
+
+    def get_objects(self, obj_ids):
+        self.lookups.append(sorted(obj_ids))
+        return {x: 'object%s' % x for x in obj_ids if x != 30}
+
+
+class TestIdentity(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestIdentity, self).setUp()
+        for idx in range(1, 4):
+            self.session.add(Users(user_id=idx, user_ds_id=idx * 10))
+        self.session.add(NotesCreated(note_id=1, note_ds_id=100, user_id=1,
+                                      resource_id=1, sharing=u'GLOBAL'))
+        self.session.add(ForumsCreated(forum_id=1, forum_ds_id=200))
+        self.session.add(TopicsCreated(topic_id=1, topic_ds_id=300, forum_id=1))
+        timestamp = datetime(2018, 1, 1)
+        for idx in range(1, 4):
+            self.session.add(NotesViewed(note_id=1, user_id=idx, resource_id=1,
+                                         timestamp=timestamp))
+            self.session.add(ForumCommentsCreated(comment_id=idx, topic_id=1, forum_id=1,
+                                                  user_id=idx, parent_user_id=1))
+        self.session.commit()
+
+    def test_get_objects(self):
+        utility = _Identifier()
+        assert_that(IAnalyticsDSIdentifier.providedBy(utility), is_(True))
+        assert_that(get_objects(utility, [1, 2, 2]),
+                    is_({1: 'object1', 2: 'object2'}))
+        assert_that(utility.lookups, contains_inanyorder(1, 2))
+
+        # Utilities not deriving from the base
+        class Identifier(object):
+
+            def get_object(self, obj_id):
+                return obj_id * 2
+        assert_that(get_objects(Identifier(), [1, 2]), is_({1: 2, 2: 4}))
+
+        utility = AnalyticsDSIdentifier()
+        assert_that(calling(utility.get_id).with_args(object()),
+                    raises(NotImplementedError))
+        assert_that(calling(utility.get_objects).with_args([1]),
+                    raises(NotImplementedError))
+
+    def test_preload_detached(self):
+        utility = _BatchIdentifier()
+        comments = self.session.query(ForumCommentsCreated) \
+                               .order_by(ForumCommentsCreated.comment_id).all()
+        self.session.expunge_all()
+        # Detached rows need a session to query
+        preload(comments, ('user', 'Comment'), utility)
+        assert_that(utility.lookups, is_([[1, 2, 3]]))
+        assert_that(comments[0]._user, is_(none()))
+        preload(comments, ('user',), utility, session=self.session)
+        assert_that([x._user for x in comments], is_(['object10', 'object20', None]))
+
+    def test_preload(self):
+        utility = _BatchIdentifier()
+        component.getGlobalSiteManager().registerUtility(utility,
+                                                         IAnalyticsIntidIdentifier)
+        try:
+            views = self.session.query(NotesViewed).all()
+            comments = self.session.query(ForumCommentsCreated).all()
+            views[0].user = 'mine'
+            assert_that(preload(views + comments), has_length(6))
+            # One lookup per property
+            assert_that(utility.lookups, is_([[10, 20, 30],
+                                              [10],
+                                              [200],
+                                              [300],
+                                              [100],
+                                              [1, 2, 3]]))
+            assert_that(views[0].user, is_('mine'))
+            assert_that(comments[2]._user, is_(none()))
+            # Unresolved objects are looked up as before
+            assert_that([x.user for x in comments],
+                        is_(['object10', 'object20', 'object30']))
+            assert_that(views[1].Note, is_('object100'))
+            assert_that(comments[0].RepliedToUser, is_('object10'))
+            assert_that(comments[0].Topic, is_('object300'))
+            assert_that(comments[0].Forum, is_('object200'))
+
+            utility.lookups[:] = []
+            preload(comments, names=('Topic',), id_utility=_Identifier())
+            assert_that(utility.lookups, is_([]))
+        finally:
+            component.getGlobalSiteManager().unregisterUtility(utility,
+                                                               IAnalyticsIntidIdentifier)
+
+    def test_preload_own_ids(self):
+        utility = _BatchIdentifier()
+        users = self.session.query(Users).order_by(Users.user_id).all()
+        notes = self.session.query(NotesCreated).all()
+        topics = self.session.query(TopicsCreated).all()
+        comments = self.session.query(ForumCommentsCreated) \
+                               .order_by(ForumCommentsCreated.comment_id).all()
+        taken = [AssignmentsTaken(submission_id=500),
+                 SelfAssessmentsTaken(submission_id=600)]
+        names = ('user', 'Topic', 'Note', 'Comment', 'Submission')
+        preload(users + notes + topics + comments + taken, names, utility)
+        # Rows holding the dataserver id need no query
+        assert_that(utility.lookups, is_([[10, 20, 30],
+                                          [300],
+                                          [10, 20, 30],
+                                          [300],
+                                          [100],
+                                          [1, 2, 3],
+                                          [500],
+                                          [600]]))
+        assert_that([x._user for x in users], is_(['object10', 'object20', None]))
+        assert_that(notes[0].Note, is_('object100'))
+        assert_that(topics[0].Topic, is_('object300'))
+        assert_that([x.Comment for x in comments],
+                    is_(['object1', 'object2', 'object3']))
+        assert_that([x.Submission for x in taken], is_(['object500', 'object600']))
+
+        for row, name in ((users[2], 'user'), (notes[0], 'Note'),
+                          (topics[0], 'Topic'), (comments[0], 'Comment'),
+                          (taken[0], 'Submission'), (taken[1], 'Submission')):
+            setattr(row, name, 'mine')
+            assert_that(getattr(row, name), is_('mine'))
+
+    def test_preload_root_contexts(self):
+        for idx in (1, 2):
+            self.session.add(RootContextId(context_id=idx))
+        self.session.add(Courses(context_id=1, context_name=u'course'))
+        self.session.add(Books(context_id=2, context_name=u'book'))
+        for idx in range(2, 8):
+            self.session.add(ForumsCreated(forum_id=idx, forum_ds_id=idx * 100,
+                                           course_id=idx % 3))
+        self.session.add(CourseEnrollments(course_id=1, user_id=1, type_id=1))
+        self.session.commit()
+        self.session.expunge_all()
+
+        rows = self.session.query(ForumsCreated).all()
+        rows.extend(self.session.query(CourseEnrollments))
+        calls = []
+
+        def resolver(row):
+            calls.append(row.root_context_id)
+            return row.root_context_id or None
+        component.getGlobalSiteManager().registerUtility(resolver,
+                                                         IAnalyticsRootContextResolver)
+        statements = []
+
+        def record(unused_conn, unused_cursor, statement, *unused_args):
+            statements.append(statement)
+        event.listen(self.engine, 'before_cursor_execute', record)
+        try:
+            rows[1].RootContext = 'mine'
+            assert_that(preload_root_contexts(rows), has_length(8))
+            # One query, one resolver call per context
+            assert_that(statements, has_length(1))
+            assert_that(sorted(calls, key=str), is_([0, 1, 2, None]))
+            assert_that([x.RootContext for x in rows[:7]],
+                        is_([None, 'mine', None, 1, 2, None, 1]))
+            assert_that([getattr(x._root_context_record, 'context_name', None)
+                         for x in rows[:7]],
+                        is_([None, 'book', None, 'course', 'book', None, 'course']))
+            assert_that(rows[7]._course_record.context_name, is_('course'))
+            assert_that(statements, has_length(1))
+
+            preload_root_contexts(rows[:1], resolve=False)
+            # Detached rows are only loaded with a session
+            rows = [ForumsCreated(forum_id=10, course_id=1)]
+            preload_root_contexts(rows, resolve=False)
+            assert_that(statements, has_length(1))
+            preload_root_contexts(rows, resolve=False, session=self.session)
+            assert_that(rows[0]._root_context_record.context_name, is_('course'))
+            preload_root_contexts([self.session.query(Users).first()])
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', record)
+            component.getGlobalSiteManager().unregisterUtility(resolver,
+                                                               IAnalyticsRootContextResolver)
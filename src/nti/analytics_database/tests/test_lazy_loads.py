@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_entries
+from hamcrest import contains_string
+
+import fudge
+
+from fudge.inspector import arg
+
+import transaction
+
+from nti.analytics_database.boards import TopicsCreated
+from nti.analytics_database.boards import ForumsCreated
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.lazy_loads import LazyLoadDetector
+
+from nti.analytics_database.lazy_loads import call_site
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestLazyLoads(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestLazyLoads, self).setUp()
+        self.db = AnalyticsDB(dburi='sqlite://', testmode=True, lazy_load_threshold=3)
+        self.detector = self.db.lazy_loads
+        with transaction.manager:
+            session = self.db.session
+            session.add(ForumsCreated(forum_id=1, forum_ds_id=1))
+            for idx in range(1, 6):
+                session.add(Users(user_id=idx, user_ds_id=idx))
+                session.add(TopicsCreated(topic_id=idx, topic_ds_id=idx,
+                                          forum_id=1, user_id=idx))
+        self.detector.recent.clear()
+        self.db.session.remove()
+
+    def tearDown(self):
+        self.db.session.remove()
+        super(TestLazyLoads, self).tearDown()
+
+    @fudge.patch('nti.analytics_database.lazy_loads.logger')
+    def test_detector(self, mock_logger):
+        mock_logger.expects('warning').with_args('%s lazily loaded %s times in one transaction, at %s',
+                                                 'TopicsCreated._user_record', 3,
+                                                 arg.contains('test_lazy_loads.py'))
+        self.detector.set_endpoint('feed')
+        with transaction.manager:
+            topics = self.db.session.query(TopicsCreated).all()
+            assert_that([x._user_record.user_ds_id for x in topics], is_([1, 2, 3, 4, 5]))
+            assert_that(topics[0]._forum_record.forum_id, is_(1))
+            # From the identity map
+            assert_that(topics[1]._forum_record.forum_id, is_(1))
+        self.detector.set_endpoint()
+        with transaction.manager:
+            self.db.session.query(Users).count()
+        with transaction.manager:
+            pass
+
+        assert_that(self.detector.recent, has_length(2))
+        assert_that(self.detector.recent[0],
+                    is_({'endpoint': 'feed',
+                         'statements': 7,
+                         'lazy_loads': {'TopicsCreated._user_record': 5,
+                                        'TopicsCreated._forum_record': 1},
+                         'repeated': ['TopicsCreated._user_record']}))
+        assert_that(self.detector.recent[1], has_entries('endpoint', '',
+                                                         'statements', 1))
+
+        snapshot = self.detector.snapshot()
+        assert_that(snapshot['statements']['feed'], has_entries('count', 1, 'sum', 7))
+        assert_that(snapshot['lazy_loads'], is_({'TopicsCreated._user_record': 5,
+                                                 'TopicsCreated._forum_record': 1}))
+        assert_that(snapshot['repeated'], is_({'TopicsCreated._user_record': 1}))
+
+        text = self.detector.prometheus_text()
+        assert_that(text, contains_string(
+            'nti_analytics_db_transaction_statements_bucket{endpoint="feed",le="10"} 1\n'))
+        assert_that(text, contains_string(
+            'nti_analytics_db_lazy_loads_total{relationship="TopicsCreated._user_record"} 5\n'))
+        assert_that(text, contains_string(
+            'nti_analytics_db_repeated_lazy_loads_total{relationship="TopicsCreated._user_record"} 1\n'))
+        exported = []
+        self.detector.export(exported.append)
+        assert_that(exported, is_([text]))
+
+    def test_disabled(self):
+        db = AnalyticsDB(dburi='sqlite://', testmode=True)
+        assert_that(db.lazy_loads, is_(none()))
+        assert_that(call_site(), contains_string('test_lazy_loads.py'))
+
+        self.db.reader_session.query(Users).count()
+        self.db.reader_session.remove()
+        assert_that(self.detector.recent, has_length(1))
+        # Without statements
+        session = self.db.sessionmaker()
+        session.connection()
+        session.close()
+        assert_that(self.detector.recent, has_length(1))
+
+        detector = LazyLoadDetector()
+        detector.attach(db.engine)
+        detector.detach(db.engine)
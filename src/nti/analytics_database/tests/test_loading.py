@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_length
+from hamcrest import assert_that
+
+from sqlalchemy import func
+from sqlalchemy import event
+
+from sqlalchemy.exc import InvalidRequestError
+
+from nti.analytics_database.assessments import AssignmentGrades
+from nti.analytics_database.assessments import AssignmentsTaken
+from nti.analytics_database.assessments import AssignmentDetails
+from nti.analytics_database.assessments import AssignmentFeedback
+from nti.analytics_database.assessments import AssignmentDetailGrades
+from nti.analytics_database.assessments import FeedbackUserFileUploadMimeTypes
+
+from nti.analytics_database.loading import EXPORT
+from nti.analytics_database.loading import GRADEBOOK
+from nti.analytics_database.loading import LoadingProfile
+
+from nti.analytics_database.loading import get_profile
+from nti.analytics_database.loading import load_profile
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestLoading(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestLoading, self).setUp()
+        for idx in range(1, 4):
+            self.session.add(Users(user_id=idx, user_ds_id=idx))
+            self.session.add(AssignmentsTaken(assignment_taken_id=idx, assignment_id=u'1',
+                                              submission_id=idx, course_id=1, user_id=idx))
+            self.session.add(AssignmentGrades(grade_id=idx, assignment_taken_id=idx,
+                                              grade=u'A', grade_num=100, grader=1))
+            self.session.add(AssignmentDetails(assignment_details_id=idx, question_id=u'1',
+                                               question_part_id=1, assignment_taken_id=idx,
+                                               submission='1', user_id=idx + 3))
+            self.session.add(AssignmentDetailGrades(assignment_details_id=idx,
+                                                    question_id=u'1', question_part_id=1,
+                                                    assignment_taken_id=idx, grade=u'A'))
+            self.session.add(AssignmentFeedback(feedback_id=idx, feedback_ds_id=idx,
+                                                assignment_taken_id=idx, grade_id=idx,
+                                                user_id=idx))
+            self.session.add(FeedbackUserFileUploadMimeTypes(count=1, feedback_id=idx,
+                                                             file_mime_type_id=1))
+        self.session.commit()
+        self.session.expunge_all()
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+        super(TestLoading, self).tearDown()
+
+    def _record(self, unused_conn, unused_cursor, statement, *unused_args):
+        self.statements.append(statement)
+
+    def _taken(self, name, strict=None):
+        query = self.session.query(AssignmentsTaken).order_by(AssignmentsTaken.assignment_taken_id)
+        return load_profile(query, name, strict=strict).all()
+
+    def test_gradebook(self):
+        taken = self._taken('gradebook', strict=True)
+        # The rows with users and grades, then the details with theirs
+        assert_that(self.statements, has_length(2))
+        assert_that([x.user_id for x in taken], is_([1, 2, 3]))
+        assert_that([x._user_record.user_ds_id for x in taken], is_([1, 2, 3]))
+        assert_that([x.grade.Grader.user_id for x in taken], is_([1, 1, 1]))
+        assert_that([x.details[0].grade.grade for x in taken], is_(['A', 'A', 'A']))
+        assert_that(self.statements, has_length(2))
+        # Not in the profile
+        assert_that(calling(getattr).with_args(taken[0], '_course_record'),
+                    raises(InvalidRequestError))
+        assert_that(calling(getattr).with_args(taken[0].details[0], '_user_record'),
+                    raises(InvalidRequestError))
+
+        feedback = load_profile(self.session.query(AssignmentFeedback),
+                                'gradebook', strict=True).all()
+        assert_that([x._file_mime_types[0].count for x in feedback], is_([1, 1, 1]))
+
+    def test_activity_feed(self):
+        taken = self._taken('activity-feed', strict=True)
+        assert_that(self.statements, has_length(1))
+        # Eager by mapping
+        assert_that(taken[0].grade.grade, is_('A'))
+        assert_that(taken[0]._user_record.user_id, is_(1))
+        assert_that(calling(getattr).with_args(taken[0], 'details'),
+                    raises(InvalidRequestError))
+
+    def test_export(self):
+        taken = self._taken('export')
+        # One query per relationship, not per row
+        assert_that(self.statements, has_length(5))
+        assert_that([x.details[0].grade.grade for x in taken], is_(['A', 'A', 'A']))
+        # Not strict
+        assert_that(taken[0]._course_record, is_(none()))
+
+    def test_profiles(self):
+        assert_that(get_profile('export'), is_(EXPORT))
+        assert_that(repr(GRADEBOOK), is_('<LoadingProfile gradebook>'))
+        assert_that(calling(get_profile).with_args('unknown'), raises(ValueError))
+        assert_that(GRADEBOOK.options(Users), has_length(0))
+        assert_that(GRADEBOOK.options(Users, strict=True), has_length(1))
+
+        query = self.session.query(func.count())
+        assert_that(GRADEBOOK.apply(query), is_(query))
+
+        LoadingProfile.strict = True
+        try:
+            taken = self._taken('export')
+        finally:
+            LoadingProfile.strict = False
+        assert_that(calling(getattr).with_args(taken[0], '_course_record'),
+                    raises(InvalidRequestError))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import assert_that
+from hamcrest import has_property
+
+import os
+import shutil
+import tempfile
+
+import fudge
+
+from sqlalchemy import exc
+from sqlalchemy import Index
+from sqlalchemy import Table
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import create_engine
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.metadata import store_fingerprint
+from nti.analytics_database.metadata import schema_fingerprint
+from nti.analytics_database.metadata import stored_fingerprint
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestMetadata(AnalyticsDatabaseTest):
+
+    def test_fingerprint(self):
+        metadata = MetaData()
+        table = Table('Foo', metadata,
+                      Column('id', Integer, primary_key=True),
+                      Column('name', String(64), server_default='x'))
+        fingerprint = schema_fingerprint(metadata)
+        assert_that(fingerprint, is_(schema_fingerprint(metadata)))
+        Index('ix_foo_name', table.c.name)
+        assert_that(schema_fingerprint(metadata), is_not(fingerprint))
+
+    def test_startup(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            dburi = 'sqlite:///%s' % os.path.join(tmp_dir, 'analytics.db')
+            assert_that(stored_fingerprint(create_engine(dburi)), is_(none()))
+
+            db = AnalyticsDB(dburi=dburi, testmode=True)
+            fingerprint = db.metadata.fingerprint
+            assert_that(db.metadata, has_property('created', True))
+            assert_that(stored_fingerprint(db.engine), is_(fingerprint))
+
+            db = AnalyticsDB(dburi=dburi, testmode=True)
+            assert_that(db.metadata, has_property('created', False))
+            db = AnalyticsDB(dburi=dburi, testmode=True, force_schema=True)
+            assert_that(db.metadata, has_property('created', True))
+
+            store_fingerprint(db.engine, 'stale')
+            db = AnalyticsDB(dburi=dburi, testmode=True)
+            assert_that(db.metadata, has_property('created', True))
+            assert_that(stored_fingerprint(db.engine), is_(fingerprint))
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_concurrent_store(self):
+        engine = fudge.Fake().provides('begin').raises(exc.IntegrityError('', {}, None))
+        store_fingerprint(engine, 'abc')
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_key
+from hamcrest import has_entry
+from hamcrest import assert_that
+from hamcrest import contains_string
+
+import os
+import shutil
+import tempfile
+
+from sqlalchemy.exc import OperationalError
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.metrics import classify
+from nti.analytics_database.metrics import Histogram
+from nti.analytics_database.metrics import StatementMetrics
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestMetrics(AnalyticsDatabaseTest):
+
+    def test_classify(self):
+        assert_that(classify('SELECT "Users".user_id FROM "Users" WHERE x = ?'),
+                    is_(('select', 'Users')))
+        assert_that(classify('INSERT INTO `ResourceViews` (a) VALUES (%s)'),
+                    is_(('insert', 'ResourceViews')))
+        assert_that(classify('  update Sessions set end_time = 1'),
+                    is_(('update', 'Sessions')))
+        assert_that(classify('BEGIN DEFERRED TRANSACTION'),
+                    is_(('begin', '')))
+        assert_that(classify(''), is_(('other', '')))
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1))
+        histogram.observe(0.05, rows=2)
+        histogram.observe(0.5, rows=-1)
+        histogram.observe(5)
+        assert_that(histogram.cumulative(),
+                    is_([(0.1, 1), (1, 2), (float('inf'), 3)]))
+        assert_that(histogram.rows, is_(2))
+        assert_that(histogram.sum, is_(5.55))
+
+    def test_engine(self):
+        db = AnalyticsDB(dburi='sqlite://', testmode=True, metrics=True)
+        metrics = db.statement_metrics
+        metrics.reset()
+        db.engine.execute(Users.__table__.insert(),
+                          [{'user_ds_id': 1}, {'user_ds_id': 2}])
+        db.engine.execute(Users.__table__.select()).fetchall()
+        # Unmatched after events are ignored
+        metrics.after_cursor_execute(db.engine.connect(), None, 'SELECT 1',
+                                     (), None, False)
+        # Failed statements leave nothing behind on the (pooled) connection
+        conn = db.engine.connect()
+        for unused in range(3):
+            assert_that(calling(conn.execute).with_args('SELECT * FROM Nope'),
+                        raises(OperationalError))
+        conn.execute(Users.__table__.select()).fetchall()
+        assert_that([x for x in conn.info if 'start' in x], is_([]))
+        conn.close()
+
+        snapshot = metrics.snapshot()
+        assert_that(snapshot, has_entry(('insert', 'Users'),
+                                        has_entry('rows', 2)))
+        assert_that(snapshot, has_entry(('select', 'Users'),
+                                        has_entry('count', 2)))
+
+        text = metrics.prometheus_text()
+        assert_that(text, contains_string('# TYPE nti_analytics_db_statement_seconds histogram'))
+        assert_that(text, contains_string(
+            'nti_analytics_db_statement_seconds_bucket{kind="insert",table="Users",le="+Inf"} 1\n'))
+        assert_that(text, contains_string(
+            'nti_analytics_db_statement_rows_total{kind="insert",table="Users"} 2\n'))
+
+        exported = []
+        metrics.export(exported.append)
+        assert_that(exported, is_([text]))
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'analytics.prom')
+            metrics.export(path)
+            with open(path) as stream:
+                assert_that(stream.read(), is_(text))
+            assert_that(os.listdir(tmp_dir), is_(['analytics.prom']))
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+        metrics.detach(db.engine)
+        metrics.reset()
+        db.engine.execute(Users.__table__.select()).fetchall()
+        assert_that(metrics.snapshot(), is_({}))
+
+        assert_that(AnalyticsDB(dburi='sqlite://', metadata=False).statement_metrics,
+                    is_(none()))
+
+    def test_classification_cache(self):
+        metrics = StatementMetrics()
+        metrics.cache_size = 1
+        metrics.observe('SELECT 1 FROM a', 0.1)
+        metrics.observe('SELECT 1 FROM b', 0.1)
+        assert_that(metrics._classified, has_key('SELECT 1 FROM b'))
+        assert_that(len(metrics._classified), is_(1))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import same_instance
+
+from datetime import datetime
+
+from nti.analytics_database.reporting import row_type
+from nti.analytics_database.reporting import report_rows
+
+from nti.analytics_database.resource_views import VideoEvents
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.resources import Resources
+
+from nti.analytics_database.sessions import Sessions
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestReporting(AnalyticsDatabaseTest):
+
+    def test_resource_views(self):
+        self.session.add(Resources(resource_id=1, resource_ds_id=u'tag:nti:video'))
+        timestamp = datetime(2018, 1, 1)
+        for idx in range(1, 4):
+            self.session.add(ResourceViews(resource_view_id=idx, resource_id=idx % 2,
+                                           user_id=idx, session_id=idx * 10,
+                                           time_length=idx * 60, timestamp=timestamp))
+        self.session.commit()
+        self.session.expunge_all()
+
+        rows = list(report_rows(self.session, ResourceViews,
+                                criteria=(ResourceViews.user_id > 1,),
+                                order_by=ResourceViews.resource_view_id,
+                                chunk_size=1))
+        assert_that(rows, has_length(2))
+        assert_that([x.Duration for x in rows], is_([120, 180]))
+        assert_that([x.SessionID for x in rows], is_([20, 30]))
+        assert_that([x.ResourceId for x in rows], is_([None, u'tag:nti:video']))
+        assert_that(rows[0].timestamp, is_(timestamp))
+        # Not ORM instances
+        assert_that(self.session.identity_map, has_length(0))
+        assert_that(hasattr(rows[0], '__dict__'), is_(False))
+
+        rows = list(report_rows(self.session, ResourceViews,
+                                fields=('resource_view_id', 'time_length')))
+        assert_that(rows, has_length(3))
+        assert_that(rows[0]._fields, is_(('resource_view_id', 'time_length')))
+        assert_that(hasattr(rows[0], 'ResourceId'), is_(False))
+
+    def test_row_types(self):
+        row = row_type(Sessions)(session_id=1, user_id=1, ip_addr=None,
+                                 user_agent_id=None,
+                                 start_time=datetime(2018, 1, 1),
+                                 end_time=datetime(2018, 1, 1, 0, 1))
+        assert_that(row.Duration, is_(60))
+        assert_that(row.time_length, is_(60))
+        assert_that(row.SessionStartTime, is_(datetime(2018, 1, 1)))
+        assert_that(row._replace(end_time=None).Duration, is_(none()))
+        assert_that(hasattr(row_type(Sessions, ('session_id',))(1), 'Duration'),
+                    is_(False))
+
+        assert_that(row_type(VideoEvents), same_instance(row_type(VideoEvents)))
+        assert_that(row_type(VideoEvents).__name__, is_('VideoEventsRow'))
+        assert_that(row_type(VideoEvents)._fields[-1], is_('resource_ds_id'))
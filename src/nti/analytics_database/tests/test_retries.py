@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import less_than_or_equal_to
+from hamcrest import contains_string
+
+import os
+import shutil
+import tempfile
+
+import transaction
+
+from transaction.interfaces import AlreadyInTransaction
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import OperationalError
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.retries import RetryPolicy
+from nti.analytics_database.retries import is_retryable
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+_INSERT = 'INSERT INTO CourseEnrollments (course_id, user_id) VALUES (%s, %s)'
+
+
+class _PGError(Exception):
+
+    def __init__(self, pgcode):
+        super(_PGError, self).__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def _error(orig, statement=_INSERT, factory=OperationalError):
+    return factory(statement, (), orig)
+
+
+class TestRetries(AnalyticsDatabaseTest):
+
+    def test_is_retryable(self):
+        for orig in (Exception(1213, 'Deadlock found when trying to get lock'),
+                     Exception(1205, 'Lock wait timeout exceeded'),
+                     _PGError('40P01'),
+                     _PGError('40001'),
+                     Exception('database is locked')):
+            assert_that(is_retryable(_error(orig)), is_(True))
+        for orig in (Exception(1062, 'Duplicate entry'),
+                     _PGError('23505'),
+                     Exception()):
+            assert_that(is_retryable(_error(orig, factory=IntegrityError)), is_(False))
+        assert_that(is_retryable(ValueError()), is_(False))
+
+    def test_policy(self):
+        policy = RetryPolicy(attempts=3, base_delay=1, max_delay=1.5)
+        sleeps = []
+        policy.sleep = sleeps.append
+        failures = [_error(Exception(1213, 'Deadlock')), _error(Exception(1205, 'Lock wait'))]
+
+        def work(value):
+            if failures:
+                raise failures.pop()
+            return value
+        assert_that(policy(work, 'ok'), is_('ok'))
+        assert_that(sleeps, has_length(2))
+        assert_that(max(sleeps), less_than_or_equal_to(1.5))
+
+        failures.extend([_error(Exception(1213, 'Deadlock'))] * 3)
+        assert_that(calling(policy).with_args(work, 'ok'), raises(OperationalError))
+        failures[:] = [ValueError()]
+        assert_that(calling(policy).with_args(work, 'ok'), raises(ValueError))
+
+        failures.append(_error(Exception('database is locked'), statement=None))
+        policy(work, 'ok')
+        assert_that(policy.metrics.snapshot(),
+                    is_({'retries': {'CourseEnrollments': 4, 'unknown': 1},
+                         'exhausted': {'CourseEnrollments': 1}}))
+
+        text = policy.metrics.prometheus_text()
+        assert_that(text, contains_string(
+            'nti_analytics_db_retries_total{table="CourseEnrollments"} 4\n'))
+        assert_that(text, contains_string(
+            'nti_analytics_db_exhausted_total{table="CourseEnrollments"} 1\n'))
+        exported = []
+        policy.metrics.export(exported.append)
+        assert_that(exported, is_([text]))
+
+    def test_sleep(self):
+        RetryPolicy().sleep(0)
+
+    def test_run_in_transaction(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            dburi = 'sqlite:///%s' % os.path.join(tmp_dir, 'analytics.db')
+            db = AnalyticsDB(dburi=dburi, testmode=True, retry_attempts=2)
+            db.retry_policy.sleep = lambda unused: None
+            failures = [_error(Exception('database is locked'))]
+
+            def work():
+                db.session.add(Users(user_ds_id=1))
+                db.session.flush()
+                if failures:
+                    raise failures.pop()
+                return 'done'
+            assert_that(db.run_in_transaction(work), is_('done'))
+            assert_that(db.run_in_transaction(db.session.query(Users).count), is_(1))
+
+            # The caller's pending work is not aborted
+            transaction.begin()
+            transaction.get().addBeforeCommitHook(lambda: None)
+            assert_that(calling(db.run_in_transaction).with_args(work),
+                        raises(AlreadyInTransaction))
+            transaction.begin()
+            db.session.add(Users(user_ds_id=2))
+            db.session.flush()
+            assert_that(calling(db.run_in_transaction).with_args(work),
+                        raises(AlreadyInTransaction))
+            transaction.commit()
+            assert_that(db.run_in_transaction(db.session.query(Users).count), is_(2))
+        finally:
+            shutil.rmtree(tmp_dir, True)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import assert_that
+
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from nti.analytics_database.resource_views import VideoEvents
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.rollups import ROLLUPS
+from nti.analytics_database.rollups import Rollup
+from nti.analytics_database.rollups import RollupWatermarks
+from nti.analytics_database.rollups import VideoDailyRollups
+from nti.analytics_database.rollups import ResourceDailyRollups
+
+from nti.analytics_database.rollups import update_rollups
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestRollups(AnalyticsDatabaseTest):
+
+    def _view(self, user_id, resource_id, day, time_length, course_id=1, **kwargs):
+        kwargs.setdefault('timestamp', datetime(2018, 1, day, 12))
+        self.engine.execute(ResourceViews.__table__.insert(),
+                            user_id=user_id,
+                            resource_id=resource_id,
+                            course_id=course_id,
+                            time_length=time_length,
+                            **kwargs)
+
+    def _rollups(self):
+        query = ResourceDailyRollups.__table__.select() \
+                .order_by('course_id', 'resource_id', 'day')
+        return [tuple(x) for x in self.engine.execute(query)]
+
+    def test_update(self):
+        assert_that(update_rollups(self.engine),
+                    is_({'ResourceDailyRollups': 0, 'VideoDailyRollups': 0}))
+        # Events without a time are not rolled up
+        self._view(1, 1, 1, 10, timestamp=None)
+        assert_that(update_rollups(self.engine, ROLLUPS[:1]),
+                    is_({'ResourceDailyRollups': 0}))
+
+        self._view(1, 1, 1, 10)
+        self._view(1, 1, 1, 20)
+        self._view(2, 1, 1, 5)
+        self._view(1, 2, 2, None)
+        self._view(1, 2, 2, 7, course_id=None)
+        rollups = (Rollup(ResourceViews, ResourceDailyRollups, 'resource_view_id',
+                          lag=timedelta(hours=1)),)
+        assert_that(update_rollups(self.engine, rollups),
+                    is_({'ResourceDailyRollups': 2}))
+        assert_that(self._rollups(),
+                    is_([(1, 1, date(2018, 1, 1), 3, 2, 35, 20),
+                         (1, 2, date(2018, 1, 2), 1, 1, None, None)]))
+
+        # Only the touched and recent groups are recomputed; distinct
+        # users stay exact
+        self._view(2, 1, 1, 30)
+        self._view(3, 1, 1, 1)
+        assert_that(update_rollups(self.engine, rollups),
+                    is_({'ResourceDailyRollups': 2}))
+        assert_that(self._rollups(),
+                    is_([(1, 1, date(2018, 1, 1), 5, 3, 66, 30),
+                         (1, 2, date(2018, 1, 2), 1, 1, None, None)]))
+        assert_that(update_rollups(self.engine, rollups),
+                    is_({'ResourceDailyRollups': 1}))
+        assert_that(update_rollups(self.engine, rollups, lag=timedelta(days=2)),
+                    is_({'ResourceDailyRollups': 2}))
+
+        watermarks = self.engine.execute(RollupWatermarks.__table__.select())
+        assert_that(sorted(tuple(x) for x in watermarks),
+                    is_([('ResourceDailyRollups', 8), ('VideoDailyRollups', 0)]))
+
+    def test_late_commits(self):
+        rollup = Rollup(ResourceViews, ResourceDailyRollups, 'resource_view_id',
+                        lag=timedelta(hours=1))
+        self._view(1, 1, 1, 10, resource_view_id=1)
+        self._view(1, 2, 2, 10, resource_view_id=10)
+        assert_that(rollup.update(self.engine), is_(2))
+
+        # Events committing after a higher id, within the lag of the
+        # newest event, are counted
+        self._view(2, 2, 2, 20, resource_view_id=5)
+        # Those further behind wait for their group to be touched again
+        self._view(2, 1, 1, 20, resource_view_id=6)
+        assert_that(rollup.update(self.engine), is_(1))
+        assert_that(self._rollups(),
+                    is_([(1, 1, date(2018, 1, 1), 1, 1, 10, 10),
+                         (1, 2, date(2018, 1, 2), 2, 2, 30, 20)]))
+        self._view(3, 1, 1, 30, resource_view_id=11)
+        assert_that(rollup.update(self.engine), is_(2))
+        assert_that(self._rollups()[0], is_((1, 1, date(2018, 1, 1), 3, 3, 60, 30)))
+
+    def test_video(self):
+        self.engine.execute(VideoEvents.__table__.insert(),
+                            user_id=1, resource_id=1, course_id=1,
+                            timestamp=datetime(2018, 1, 1),
+                            video_event_type=u'WATCH',
+                            video_start_time=0, with_transcript=False,
+                            time_length=60)
+        assert_that(update_rollups(self.engine, ROLLUPS[1:]),
+                    is_({'VideoDailyRollups': 1}))
+        rollup = self.session.query(VideoDailyRollups).one()
+        assert_that(rollup.total_time, is_(60))
+        assert_that(rollup.day, is_(date(2018, 1, 1)))
+
+    def test_concurrent_watermark(self):
+        rollup = ROLLUPS[0]
+        rollup._create_watermark(self.engine)
+        # Another run got there first
+        rollup._create_watermark(self.engine)
+        self._view(1, 1, 1, 10)
+        assert_that(rollup.update(self.engine), is_(1))
+
+        # Other integrity errors are not retried
+        class Engine(object):
+
+            def begin(self):
+                raise IntegrityError('insert', (), Exception())
+        assert_that(calling(rollup.update).with_args(Engine()),
+                    raises(IntegrityError))
+
+        # Nor is a watermark that cannot be created
+        rollup = Rollup(VideoEvents, VideoDailyRollups, 'video_view_id')
+        rollup._create_watermark = lambda unused_engine: None
+        assert_that(calling(rollup.update).with_args(self.engine),
+                    raises(RuntimeError))
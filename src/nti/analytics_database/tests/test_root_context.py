@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import has_key
+from hamcrest import has_length
+from hamcrest import assert_that
+
+from sqlalchemy import event
+
+from nti.analytics_database.boards import ForumsCreated
+
+from nti.analytics_database.root_context import Books
+from nti.analytics_database.root_context import Courses
+from nti.analytics_database.root_context import RootContextId
+from nti.analytics_database.root_context import set_context_types
+from nti.analytics_database.root_context import backfill_context_types
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestRootContext(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestRootContext, self).setUp()
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+        super(TestRootContext, self).tearDown()
+
+    def _record(self, unused_conn, unused_cursor, statement, *unused_args):
+        self.statements.append(statement)
+
+    def test_context_type(self):
+        self.session.add(RootContextId(context_id=1))
+        self.session.add(RootContextId(context_id=2))
+        self.session.add(RootContextId(context_id=3))
+        self.session.flush()
+        # Loaded id rows are kept current
+        record = self.session.query(RootContextId).get(1)
+        self.session.add(Courses(context_id=1, context_name=u'course'))
+        self.session.add(Books(context_id=2, context_name=u'book'))
+        for idx in range(1, 5):
+            # Context 3 has no type, context 4 no id row
+            for forum_id in range(idx * 10, idx * 10 + 5):
+                self.session.add(ForumsCreated(forum_id=forum_id, forum_ds_id=forum_id,
+                                               course_id=idx))
+        self.session.commit()
+        assert_that(record.context_type, is_('Courses'))
+        assert_that([x.context_type for x in self.session.query(RootContextId)],
+                    is_(['Courses', 'Books', None]))
+        self.session.expunge_all()
+
+        forums = self.session.query(ForumsCreated).filter(ForumsCreated.root_context_id == 1).all()
+        del self.statements[:]
+        assert_that({x._root_context_record.context_name for x in forums}, is_({'course'}))
+        # One id row and one course, not two lookups per forum
+        assert_that(self.statements, has_length(2))
+        assert_that(forums[0].__dict__, is_not(has_key('_book_context_record')))
+
+        forums = self.session.query(ForumsCreated).filter(ForumsCreated.root_context_id == 2).all()
+        assert_that(forums[0]._root_context_record.context_name, is_('book'))
+        forums = self.session.query(ForumsCreated).filter(ForumsCreated.root_context_id > 2).all()
+        assert_that({x._root_context_record for x in forums}, is_({None}))
+
+    def test_set_record(self):
+        forum = ForumsCreated(forum_id=1, forum_ds_id=1)
+        forum._root_context_record = None
+        book = Books(context_id=1, context_name=u'book')
+        forum._root_context_record = book
+        assert_that(forum._book_context_record, is_(book))
+        course = Courses(context_id=2, context_name=u'course')
+        forum._root_context_record = course
+        assert_that(forum._course_context_record, is_(course))
+
+    def test_backfill(self):
+        # Rows inserted without the ORM event, as by earlier versions
+        for idx in (1, 2, 3):
+            self.engine.execute(RootContextId.__table__.insert(), context_id=idx)
+        self.engine.execute(Courses.__table__.insert(), context_id=1)
+        self.engine.execute(Books.__table__.insert(), context_id=2)
+        assert_that(backfill_context_types(self.engine), is_(2))
+        assert_that([x.context_type for x in self.session.query(RootContextId)],
+                    is_(['Courses', 'Books', None]))
+        assert_that(backfill_context_types(self.engine), is_(0))
+        # Nothing to record
+        set_context_types(None, Courses, ())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import instance_of
+from hamcrest import has_property
+
+import gc
+import os
+import shutil
+import weakref
+import tempfile
+import threading
+
+import fudge
+
+from greenlet import greenlet
+from greenlet import getcurrent
+
+import transaction
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.pool import InstrumentedQueuePool
+
+from nti.analytics_database.scoping import GreenletRegistry
+from nti.analytics_database.scoping import greenlet_local
+from nti.analytics_database.scoping import make_scoped_session
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class _Session(object):
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _BrokenSession(object):
+
+    def close(self):
+        raise ValueError()
+
+
+class _GreenletLocal(object):
+    # What threading.local becomes once gevent has patched it
+
+    def __init__(self):
+        object.__setattr__(self, 'values', weakref.WeakKeyDictionary())
+
+    def __getattr__(self, name):
+        try:
+            return self.values[getcurrent()][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self.values.setdefault(getcurrent(), {})[name] = value
+
+
+class TestScoping(AnalyticsDatabaseTest):
+
+    def test_greenlet_scope(self):
+        session = make_scoped_session(_Session, 'greenlet')
+        registry = session.registry
+        assert_that(registry, instance_of(GreenletRegistry))
+
+        main = registry()
+        assert_that(registry(), is_(main))
+        seen = []
+        child = greenlet(lambda: seen.extend([registry(), registry()]))
+        child.switch()
+        assert_that(seen[0], is_(seen[1]))
+        assert_that(seen[0], is_not(main))
+        assert_that(registry, has_length(2))
+
+        # Finished greenlets close their session and drop out
+        del child
+        gc.collect()
+        assert_that(registry, has_length(1))
+        assert_that(seen[0], has_property('closed', True))
+        assert_that(main, has_property('closed', False))
+
+        replacement = _Session()
+        registry.set(replacement)
+        assert_that(registry(), is_(replacement))
+        registry.clear()
+        assert_that(registry.has(), is_(False))
+
+        child = greenlet(lambda: registry.set(_BrokenSession()))
+        child.switch()
+        del child
+        gc.collect()
+        assert_that(registry, has_length(0))
+
+        assert_that(make_scoped_session(_Session).registry,
+                    is_not(instance_of(GreenletRegistry)))
+        assert_that(calling(make_scoped_session).with_args(_Session, 'fiber'),
+                    raises(ValueError))
+
+    def test_database(self):
+        assert_that(calling(AnalyticsDB).with_args(dburi='sqlite://', session_scope='fiber'),
+                    raises(ValueError))
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            dburi = 'sqlite:///%s' % os.path.join(tmp_dir, 'analytics.db')
+            db = AnalyticsDB(dburi=dburi, testmode=True, session_scope='greenlet',
+                             pool_size=2, max_overflow=1, pool_timeout=5)
+            pool = db.engine.pool
+            assert_that(pool, instance_of(InstrumentedQueuePool))
+            assert_that(pool.size(), is_(2))
+            assert_that(pool._timeout, is_(5))
+            assert_that(db.session.registry, instance_of(GreenletRegistry))
+            assert_that(db.reader_session.registry, instance_of(GreenletRegistry))
+
+            def _add():
+                transaction.begin()
+                db.session.add(Users(user_ds_id=1))
+                transaction.commit()
+            child = greenlet(_add)
+            child.switch()
+            transaction.begin()
+            assert_that(db.session.query(Users).count(), is_(1))
+            transaction.abort()
+            assert_that(pool.waiting, is_(0))
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_greenlet_local(self):
+        assert_that(greenlet_local(threading.local), is_(False))
+        assert_that(greenlet_local(_GreenletLocal), is_(True))
+
+    @fudge.patch('nti.analytics_database.database.logger')
+    def test_thread_local_transactions(self, fake_logger):
+        # transaction.manager is thread local here, not greenlet local
+        fake_logger.provides('info').expects('warning')
+        AnalyticsDB(dburi='sqlite://', testmode=True, session_scope='greenlet')
+
+    @fudge.patch('sqlalchemy.pool.QueuePool._do_get')
+    def test_waiting(self, fake_get):
+        pool = InstrumentedQueuePool(_Session)
+        fake_get.expects_call().calls(lambda: pool.waiting)
+        assert_that(pool._do_get(), is_(1))
+        assert_that(pool.waiting, is_(0))
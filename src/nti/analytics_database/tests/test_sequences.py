@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_string
+
+import os
+import shutil
+import tempfile
+import threading
+
+import fudge
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from sqlalchemy.dialects import mssql
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.enrollments import CourseEnrollments
+
+from nti.analytics_database.resource_views import ResourceViews
+from nti.analytics_database.resource_views import VideoPlaySpeedEvents
+
+from nti.analytics_database.sequences import BlockIdAllocator
+from nti.analytics_database.sequences import supports_block_ids
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestSequences(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestSequences, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        dburi = 'sqlite:///%s' % os.path.join(self.tmp_dir, 'analytics.db')
+        self.db = AnalyticsDB(dburi=dburi, testmode=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+        super(TestSequences, self).tearDown()
+
+    def _insert(self, **kwargs):
+        result = self.db.engine.execute(ResourceViews.__table__.insert(),
+                                        user_id=1, resource_id=1, **kwargs)
+        return result.inserted_primary_key[0]
+
+    def test_unsupported(self):
+        engine = fudge.Fake().has_attr(dialect=mssql.dialect())
+        assert_that(supports_block_ids(engine), is_(False))
+        assert_that(calling(BlockIdAllocator).with_args(engine, ResourceViews),
+                    raises(TypeError))
+        # Tables need a sequence primary key, and on SQLite an
+        # autoincrement one
+        engine = self.db.engine
+        assert_that(supports_block_ids(engine), is_(True))
+        assert_that(calling(BlockIdAllocator).with_args(engine, CourseEnrollments),
+                    raises(TypeError))
+        assert_that(calling(self.db.get_id_allocator).with_args(VideoPlaySpeedEvents),
+                    raises(TypeError))
+
+    def test_sqlite(self):
+        engine = self.db.engine
+        allocator = BlockIdAllocator(engine, ResourceViews, block_size=3)
+        assert_that(allocator.allocate(2), is_([1, 2]))
+
+        self._insert(resource_view_id=41)
+        assert_that(allocator.allocate(4), is_([3, 42, 43, 44]))
+
+        # Another process reserves the following block, and ordinary
+        # inserts are numbered after both
+        other = BlockIdAllocator(engine, ResourceViews, block_size=3)
+        assert_that(other.next_id(), is_(45))
+        assert_that(self._insert(), is_(48))
+        assert_that(allocator.allocate(2), is_([49, 50]))
+
+        assert_that(self.db.get_id_allocator(ResourceViews),
+                    is_(self.db.get_id_allocator(ResourceViews.__table__)))
+
+    def test_sqlite_concurrent(self):
+        engine = self.db.engine
+        ids = []
+
+        def allocate():
+            allocator = BlockIdAllocator(engine, ResourceViews, block_size=5)
+            result = allocator.allocate(50)
+            for idx in result:
+                self._insert(resource_view_id=idx)
+            self._insert()
+            ids.extend(result)
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_that(set(ids), has_length(200))
+        count = engine.execute(select([func.count()])
+                               .select_from(ResourceViews.__table__)).scalar()
+        assert_that(count, is_(204))
+
+    def test_mysql(self):
+        queries = []
+        results = []
+
+        class Result(object):
+
+            def __init__(self, value):
+                self.rowcount = self.value = value
+
+            def scalar(self):
+                return self.value
+
+        class Conn(object):
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *unused_args):
+                pass
+
+            def begin(self):
+                return self
+
+            def execute(self, query):
+                queries.append(str(query.compile(dialect=mysql.dialect())))
+                return Result(results.pop(0))
+
+        engine = fudge.Fake().has_attr(dialect=mysql.dialect()) \
+                             .provides('connect').returns(Conn())
+        assert_that(supports_block_ids(engine), is_(True))
+        allocator = BlockIdAllocator(engine, ResourceViews, block_size=10)
+
+        # The row is created; an insert took an id of the first block
+        results.extend([1, 0, None, 11, None, 1,
+                        1, 21, None, 0, None])
+        assert_that(allocator.reserve(10), is_(range(11, 21)))
+        assert_that(queries[0], is_('SELECT get_lock(%s, %s) AS get_lock_1'))
+        assert_that(queries[1],
+                    is_('UPDATE `IdBlocks` SET next_id=(greatest(`IdBlocks`.next_id, '
+                        '(SELECT coalesce(max(`ResourceViews`.resource_view_id), %s) AS coalesce_1 \n'
+                        'FROM `ResourceViews`) + %s) + %s) '
+                        'WHERE `IdBlocks`.table_name = %s'))
+        assert_that(queries[2], contains_string('INSERT INTO `IdBlocks`'))
+        assert_that(queries[4], is_('ALTER TABLE `ResourceViews` AUTO_INCREMENT = 11'))
+        assert_that(queries[5],
+                    contains_string('WHERE `ResourceViews`.resource_view_id >= %s '
+                                    'AND `ResourceViews`.resource_view_id < %s'))
+        assert_that(queries[8], is_('ALTER TABLE `ResourceViews` AUTO_INCREMENT = 21'))
+        assert_that(queries[-1], is_('SELECT release_lock(%s) AS release_lock_1'))
+
+        # Every block is taken
+        del queries[:]
+        results.extend([1, 1, 21, None, 1,
+                        1, 31, None, 1,
+                        1, 41, None, 1, None])
+        assert_that(calling(allocator.reserve).with_args(10),
+                    raises(RuntimeError))
+        assert_that(queries[-1], is_('SELECT release_lock(%s) AS release_lock_1'))
+
+        # The lock is held elsewhere
+        results.append(0)
+        assert_that(calling(allocator.reserve).with_args(10),
+                    raises(RuntimeError))
+
+    def test_postgresql(self):
+        queries = []
+
+        class Conn(object):
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *unused_args):
+                pass
+
+            def execute(self, query):
+                queries.append(query)
+                return [(3,), (2,)]
+
+        engine = fudge.Fake().has_attr(dialect=postgresql.dialect()) \
+                             .provides('begin').returns(Conn())
+        assert_that(supports_block_ids(engine), is_(True))
+        allocator = BlockIdAllocator(engine, ResourceViews, block_size=2)
+        assert_that(allocator.allocate(2), is_([2, 3]))
+        assert_that(str(queries[0].compile(dialect=postgresql.dialect())),
+                    contains_string("SELECT nextval('resource_view_id_seq') AS next_value_1 \n"
+                                    "FROM generate_series("))
+
+        assert_that(calling(BlockIdAllocator).with_args(engine, CourseEnrollments),
+                    raises(TypeError))
+
+        # One allocator per table
+        db = AnalyticsDB(dburi='sqlite://', metadata=False)
+        db.engine = engine
+        allocator = db.get_id_allocator(ResourceViews)
+        assert_that(allocator.table, is_(ResourceViews.__table__))
+        assert_that(db.get_id_allocator(ResourceViews.__table__), is_(allocator))
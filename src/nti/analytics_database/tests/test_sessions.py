@@ -9,6 +9,7 @@ from __future__ import absolute_import
 # pylint: disable=no-member
 
 from hamcrest import is_
+from hamcrest import has_length
 from hamcrest import assert_that
 from hamcrest import has_property
 
@@ -16,8 +17,13 @@ from datetime import datetime
 
 from nti.analytics_database.sessions import Location
 from nti.analytics_database.sessions import Sessions
+from nti.analytics_database.sessions import UserAgents
 from nti.analytics_database.sessions import IpGeoLocation
 
+from nti.analytics_database.sessions import user_agent_hash
+from nti.analytics_database.sessions import user_agent_clause
+from nti.analytics_database.sessions import backfill_user_agent_hashes
+
 from nti.analytics_database.users import Users
 
 from nti.analytics_database.tests import AnalyticsDatabaseTest
@@ -54,3 +60,26 @@ class TestSessions(AnalyticsDatabaseTest):
 
         assert_that(session,
                     has_property('Location', is_(location)))
+
+    def test_user_agent_hash(self):
+        agent = UserAgents(user_agent_id=1, user_agent=u'Mozilla/5.0')
+        self.session.add(agent)
+        self.session.commit()
+        assert_that(agent,
+                    has_property('user_agent_hash', user_agent_hash(u'Mozilla/5.0')))
+        assert_that(user_agent_hash(b'Mozilla/5.0'), has_length(40))
+
+        found = self.session.query(UserAgents) \
+                            .filter(user_agent_clause(u'Mozilla/5.0')).one()
+        assert_that(found, is_(agent))
+
+    def test_backfill(self):
+        table = UserAgents.__table__
+        self.engine.execute(table.insert(),
+                            [{'user_agent': u'agent %s' % x, 'user_agent_hash': None}
+                             for x in range(5)])
+        assert_that(backfill_user_agent_hashes(self.engine, batch_size=2), is_(5))
+        assert_that(backfill_user_agent_hashes(self.engine), is_(0))
+        rows = self.engine.execute(table.select()).fetchall()
+        assert_that([x.user_agent_hash for x in rows],
+                    is_([user_agent_hash(x.user_agent) for x in rows]))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import raises
+from hamcrest import calling
+from hamcrest import has_item
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import starts_with
+from hamcrest import contains_string
+
+import os
+import json
+import shutil
+import tempfile
+
+from six.moves import queue
+
+from sqlalchemy.exc import OperationalError
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.slow_queries import redact
+from nti.analytics_database.slow_queries import SlowQueryLog
+from nti.analytics_database.slow_queries import explain_prefix
+
+from nti.analytics_database.users import Users
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class _Context(object):
+    pass
+
+
+class TestSlowQueries(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestSlowQueries, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+        super(TestSlowQueries, self).tearDown()
+
+    def test_redact(self):
+        assert_that(redact((u'secret', 12, None)), is_(['******', '**', None]))
+        assert_that(redact({'user': u'bob'}), is_({'user': '***'}))
+        assert_that(redact([(1,), (22,)]), is_([['*'], ['**']]))
+        assert_that(redact(u'x'), is_('*'))
+
+    def test_explain_prefix(self):
+        assert_that(explain_prefix('sqlite'), is_('EXPLAIN QUERY PLAN '))
+        assert_that(explain_prefix('postgresql'), is_('EXPLAIN '))
+        assert_that(explain_prefix('mysql'), is_('EXPLAIN '))
+        assert_that(explain_prefix('oracle'), is_(none()))
+
+    def test_log(self):
+        log_file = os.path.join(self.tmp_dir, 'slow.log')
+        db = AnalyticsDB(dburi='sqlite:///%s' % os.path.join(self.tmp_dir, 'analytics.db'),
+                         testmode=True, slow_query_threshold=0,
+                         slow_query_log=log_file)
+        slow_queries = db.slow_queries
+        engine = db.engine
+        engine.execute(Users.__table__.insert(), user_ds_id=1)
+        engine.execute(ResourceViews.__table__.insert(),
+                       [{'user_id': 1, 'resource_id': 1, 'time_length': 5},
+                        {'user_id': 1, 'resource_id': 2, 'time_length': 6}])
+        engine.execute(ResourceViews.__table__.select()
+                       .where(ResourceViews.time_length == 12345)).fetchall()
+        slow_queries.flush()
+
+        records = list(slow_queries.recent)
+        # Only statements against the configured tables
+        assert_that([x['kind'] for x in records], is_(['insert', 'select']))
+        insert, select = records
+        assert_that(insert, has_entry('table', 'ResourceViews'))
+        assert_that(insert, has_entry('parameters', has_length(3)))
+        assert_that(select, has_entry('parameters', has_item('*****')))
+        assert_that(select, has_entry('plan', has_item(has_item(starts_with('SCAN')))))
+
+        with open(log_file) as stream:
+            lines = [json.loads(x) for x in stream]
+        assert_that(lines, has_length(2))
+        assert_that(lines[1], has_entry('statement', select['statement']))
+        slow_queries.close()
+
+        assert_that(AnalyticsDB(dburi='sqlite://', metadata=False).slow_queries,
+                    is_(none()))
+
+    def test_explain(self):
+        engine = self.engine
+        slow_queries = SlowQueryLog(threshold=0, tables=None)
+        engine.dialect.name = 'oracle'
+        try:
+            assert_that(slow_queries._explain(engine, 'SELECT 1', ()), is_(none()))
+        finally:
+            engine.dialect.name = 'sqlite'
+        assert_that(slow_queries._explain(engine, 'SELECT * FROM Nope', ()),
+                    has_item(contains_string('EXPLAIN failed')))
+
+        slow_queries.attach(engine)
+        engine.execute(Users.__table__.select()).fetchall()
+        slow_queries.flush()
+        assert_that(slow_queries.recent[-1], has_entry('table', 'Users'))
+        # Failed statements leave nothing behind on the connection
+        conn = engine.connect()
+        assert_that(calling(conn.execute).with_args('SELECT * FROM Nope'),
+                    raises(OperationalError))
+        assert_that([x for x in conn.info if 'start' in x], is_([]))
+        conn.close()
+        slow_queries.detach(engine)
+
+        # Unmatched after events, other statements and failures are ignored
+        slow_queries.after_cursor_execute(engine.connect(), None, 'SELECT 1',
+                                          (), None, False)
+        context = _Context()
+        slow_queries.before_cursor_execute(engine.connect(), None, None, None, context, None)
+        slow_queries.after_cursor_execute(engine.connect(), None, 'PRAGMA foo',
+                                          (), context, False)
+        slow_queries._queue.put((None, None, None, None))
+        slow_queries.flush()
+        slow_queries.close()
+        slow_queries.close()
+
+        slow_queries = SlowQueryLog(threshold=0, tables=None, explain=False)
+        slow_queries._start = lambda: None
+        slow_queries._queue = queue.Queue(1)
+        slow_queries.attach(engine)
+        engine.execute(Users.__table__.select()).fetchall()
+        engine.execute(Users.__table__.select()).fetchall()
+        assert_that(slow_queries.dropped, is_(1))
+        slow_queries.detach(engine)
+
+        slow_queries = SlowQueryLog(threshold=0, sample_rate=0, tables=None)
+        slow_queries.attach(engine)
+        engine.execute(Users.__table__.select()).fetchall()
+        assert_that(slow_queries.recent, has_length(0))
+        slow_queries.detach(engine)
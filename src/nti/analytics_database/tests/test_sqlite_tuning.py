@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import not_none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import instance_of
+from hamcrest import greater_than
+
+import os
+import time
+import shutil
+import tempfile
+
+import fudge
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.pool import InstrumentedQueuePool
+
+from nti.analytics_database.sqlite_tuning import SQLiteMaintenance
+from nti.analytics_database.sqlite_tuning import _close_maintenance
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+
+class TestSQLiteTuning(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestSQLiteTuning, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dburi = 'sqlite:///%s' % os.path.join(self.tmp_dir, 'analytics.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+        super(TestSQLiteTuning, self).tearDown()
+
+    def _pragma(self, engine, name):
+        return engine.execute('PRAGMA %s' % name).scalar()
+
+    def test_tuned(self):
+        db = AnalyticsDB(dburi=self.dburi, testmode=True, sqlite_tuning=True)
+        try:
+            engine = db.engine
+            assert_that(self._pragma(engine, 'journal_mode'), is_('wal'))
+            assert_that(self._pragma(engine, 'synchronous'), is_(1))
+            assert_that(self._pragma(engine, 'cache_size'), is_(-64000))
+            assert_that(self._pragma(engine, 'busy_timeout'), is_(5000))
+            assert_that(self._pragma(engine, 'temp_store'), is_(2))
+            # Tuned connections are pooled, not reopened per checkout
+            assert_that(engine.pool, instance_of(InstrumentedQueuePool))
+            raw = engine.raw_connection()
+            dbapi_connection = raw.connection
+            raw.close()
+            raw = engine.raw_connection()
+            assert_that(raw.connection, is_(dbapi_connection))
+            raw.close()
+
+            maintenance = db.sqlite_maintenance
+            assert_that(maintenance.run(), has_length(3))
+            assert_that(maintenance.runs, is_(1))
+        finally:
+            db.close()
+        assert_that(db.sqlite_maintenance, is_(none()))
+        assert_that(maintenance._thread, is_(none()))
+        db.close()
+
+    def test_shared_maintenance(self):
+        db = AnalyticsDB(dburi=self.dburi, testmode=True, sqlite_tuning=True)
+        other = AnalyticsDB(dburi=self.dburi, testmode=True, sqlite_tuning=True)
+        maintenance = db.sqlite_maintenance
+        assert_that(other.sqlite_maintenance, is_(maintenance))
+        assert_that(maintenance.users, is_(2))
+        db.close()
+        assert_that(maintenance._thread, is_(not_none()))
+        other.close()
+        assert_that(maintenance._thread, is_(none()))
+
+        # Started again for new users; stopped at exit
+        db = AnalyticsDB(dburi=self.dburi, testmode=True, sqlite_tuning=True)
+        assert_that(db.sqlite_maintenance, is_not(maintenance))
+        _close_maintenance()
+        assert_that(db.sqlite_maintenance._thread, is_(none()))
+
+    def test_default(self):
+        db = AnalyticsDB(dburi=self.dburi, testmode=True)
+        assert_that(self._pragma(db.engine, 'journal_mode'), is_('delete'))
+        assert_that(db.sqlite_maintenance, is_(none()))
+
+        os.environ['DATASERVER_DATA_DIR'] = self.tmp_dir
+        try:
+            db = AnalyticsDB(defaultSQLite=True, metadata=False)
+        finally:
+            del os.environ['DATASERVER_DATA_DIR']
+        # Opt-in
+        assert_that(db.sqlite_tuning, is_(False))
+
+    def test_maintenance(self):
+        db = AnalyticsDB(dburi=self.dburi, testmode=True)
+        maintenance = SQLiteMaintenance(db.engine, interval=0.01).start()
+        maintenance.start()
+        try:
+            for _ in range(100):
+                if maintenance.runs:
+                    break
+                time.sleep(0.01)
+        finally:
+            maintenance.close()
+        assert_that(maintenance.runs, greater_than(0))
+
+        engine = fudge.Fake().provides('raw_connection').raises(ValueError())
+        maintenance = SQLiteMaintenance(engine, interval=0.01).start()
+        try:
+            for _ in range(100):
+                if maintenance.failed:
+                    break
+                time.sleep(0.01)
+        finally:
+            maintenance.close()
+        assert_that(maintenance.failed, greater_than(0))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,no-member
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import not_none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_entries
+from hamcrest import greater_than
+
+import os
+import shutil
+import tempfile
+import threading
+
+import fudge
+
+from datetime import datetime
+
+from nti.analytics_database.database import AnalyticsDB
+
+from nti.analytics_database.resource_views import ResourceViews
+
+from nti.analytics_database.tests import AnalyticsDatabaseTest
+
+from nti.analytics_database.write_behind import WriteBehindQueue
+
+
+def _view(idx):
+    return {'user_id': 1,
+            'resource_id': 1,
+            'timestamp': datetime(2018, 1, 1, 0, 0, idx),
+            'time_length': idx}
+
+
+class TestWriteBehind(AnalyticsDatabaseTest):
+
+    def setUp(self):
+        super(TestWriteBehind, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dburi = 'sqlite:///%s' % os.path.join(self.tmp_dir, 'analytics.db')
+        self.db = AnalyticsDB(dburi=self.dburi, testmode=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+        super(TestWriteBehind, self).tearDown()
+
+    def _count(self):
+        return self.db.session.query(ResourceViews).count()
+
+    def test_worker(self):
+        wbq = WriteBehindQueue(self.dburi, batch_size=2, flush_interval=0.01)
+        wbq.start()
+        assert_that(wbq.running, is_(True))
+        for idx in range(5):
+            assert_that(wbq.put(ResourceViews, _view(idx)), is_(True))
+        wbq.close()
+        wbq.close()
+        assert_that(wbq.running, is_(False))
+        assert_that(self._count(), is_(5))
+        assert_that(wbq.stats(),
+                    has_entries('queue_depth', 0,
+                                'written', 5,
+                                'dropped', 0,
+                                'failed', 0,
+                                'flushes', greater_than(2),
+                                'max_flush_latency', not_none()))
+        # Closed queues drop
+        assert_that(wbq.put(ResourceViews, **_view(6)), is_(False))
+        assert_that(wbq.dropped, is_(1))
+
+    def test_backpressure(self):
+        wbq = WriteBehindQueue(self.dburi, maxsize=1, put_timeout=0)
+        assert_that(wbq.stats(), has_entries('avg_flush_latency', none()))
+        assert_that(wbq.put(ResourceViews, _view(1)), is_(True))
+        assert_that(wbq.put(ResourceViews, _view(2)), is_(False))
+        assert_that(wbq.queue_depth, is_(1))
+        assert_that(wbq.dropped, is_(1))
+        # Never started, drains on close
+        wbq.close()
+        assert_that(self._count(), is_(1))
+
+    def test_failure(self):
+        wbq = WriteBehindQueue(self.dburi)
+        wbq.put(ResourceViews, user_id=1)
+        wbq.close()
+        assert_that(wbq.stats(), has_entries('failed', 1, 'written', 0))
+
+    def test_retry_policy(self):
+        attempts = []
+
+        def policy(func):
+            attempts.append(func)
+            return func()
+        wbq = WriteBehindQueue(self.dburi, retry_policy=policy)
+        wbq.put(ResourceViews, _view(1))
+        wbq.close()
+        assert_that(attempts, has_length(1))
+        assert_that(self._count(), is_(1))
+
+    def test_close_timeout(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def policy(func):
+            started.set()
+            release.wait(5)
+            return func()
+        wbq = WriteBehindQueue(self.dburi, maxsize=1, flush_interval=0.01,
+                               retry_policy=policy)
+        wbq.start()
+        wbq.put(ResourceViews, _view(1))
+        started.wait(5)
+        # The worker is stuck and the queue full
+        wbq.put(ResourceViews, _view(2))
+        wbq.close(timeout=0.01)
+        assert_that(wbq.running, is_(True))
+        release.set()
+        wbq._thread.join(5)
+        assert_that(self._count(), is_(2))
+
+    def test_dropped(self):
+        wbq = WriteBehindQueue(self.dburi)
+        wbq.close()
+
+        def put():
+            for _ in range(100):
+                wbq.put(ResourceViews, _view(1))
+        threads = [threading.Thread(target=put) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_that(wbq.stats(), has_entries('dropped', 800))
+
+    def test_collect(self):
+        wbq = WriteBehindQueue(self.dburi, flush_interval=0)
+        assert_that(wbq._collect(), is_(([], False)))
+        wbq._write([])
+        assert_that(wbq.stats(), has_entries('flushes', 0))
+
+    @fudge.patch('nti.analytics_database.write_behind.create_engine')
+    def test_pooled_engine(self, mock_create):
+        mock_create.expects_call().with_args('mysql://db/analytics',
+                                             pool_size=2,
+                                             max_overflow=0,
+                                             pool_recycle=300).returns(self.db.engine)
+        wbq = WriteBehindQueue('mysql://db/analytics')
+        assert_that(wbq.engine, is_(self.db.engine))
+
+    def test_analytics_db(self):
+        assert_that(self.db.writebehind_queue, is_(none()))
+        db = AnalyticsDB(dburi='sqlite://', testmode=True, writebehind=True)
+        wbq = db.writebehind_queue
+        assert_that(wbq.running, is_(True))
+        assert_that(wbq.engine, is_(db.engine))
+        assert_that(wbq.retry_policy, is_(db.retry_policy))
+        wbq.put(ResourceViews, _view(1))
+        wbq.close()
+        assert_that(db.session.query(ResourceViews).count(), is_(1))
@@ -12,6 +12,7 @@ from hamcrest import none
 from hamcrest import not_none
 from hamcrest import assert_that
 from hamcrest import has_property
+from hamcrest import has_properties
 
 import os
 import shutil
@@ -49,7 +50,10 @@ ZCML_STRING = """
     <configure>
         <adb:registerAnalyticsDB defaultSQLite="True"
                                  twophase="True"
-                                 autocommit="False" />
+                                 autocommit="False"
+                                 pool_size="5"
+                                 adaptive_max_overflow="20"
+                                 session_scope="greenlet" />
     </configure>
 </configure>
 
@@ -65,6 +69,9 @@ class TestZcml(nti.testing.base.ConfiguringTestBase):
         assert_that(db, is_(not_none()))
         assert_that(db, has_property('twophase', True))
         assert_that(db, has_property('autocommit', False))
+        assert_that(db, has_property('pool_size', 5))
+        assert_that(db, has_property('adaptive_max_overflow', 20))
+        assert_that(db, has_property('session_scope', 'greenlet'))
 
 
 class TestConfig(nti.testing.base.ConfiguringTestBase):
@@ -77,6 +84,23 @@ class TestConfig(nti.testing.base.ConfiguringTestBase):
             config.set('analytics', 'dburi', 'sqlite://')
             config.set('analytics', 'twophase', 'True')
             config.set('analytics', 'autocommit', 'True')
+            config.set('analytics', 'writebehind', 'True')
+            config.set('analytics', 'readers', 'sqlite:///a.db sqlite:///b.db')
+            config.set('analytics', 'reader_policy', 'least-busy')
+            config.set('analytics', 'metrics', 'True')
+            config.set('analytics', 'slow_query_threshold', '0.5')
+            config.set('analytics', 'slow_query_log', '/tmp/slow.log')
+            config.set('analytics', 'pool_size', '5')
+            config.set('analytics', 'adaptive_max_overflow', '40')
+            config.set('analytics', 'pool_timeout', '2.5')
+            config.set('analytics', 'session_scope', 'greenlet')
+            config.set('analytics', 'sqlite_tuning', 'True')
+            config.set('analytics', 'force_schema', 'True')
+            config.set('analytics', 'retry_attempts', '3')
+            config.set('analytics', 'retry_max_delay', '0.5')
+            config.set('analytics', 'group_commit', 'True')
+            config.set('analytics', 'group_commit_window', '0.01')
+            config.set('analytics', 'lazy_load_threshold', '5')
 
             config_file = os.path.join(tmp_dir, 'analytics.cfg')
             with open(config_file, 'w') as configfile:
@@ -85,6 +109,25 @@ class TestConfig(nti.testing.base.ConfiguringTestBase):
             db = AnalyticsDB(config=config_file)
             assert_that(db, has_property('twophase', is_(True)))
             assert_that(db, has_property('dburi', 'sqlite://'))
+            assert_that(db, has_property('writebehind', is_(True)))
+            assert_that(db, has_property('readers',
+                                         ('sqlite:///a.db', 'sqlite:///b.db')))
+            assert_that(db, has_property('reader_policy', 'least-busy'))
+            assert_that(db, has_property('metrics', is_(True)))
+            assert_that(db, has_property('slow_query_threshold', 0.5))
+            assert_that(db, has_property('slow_query_log', '/tmp/slow.log'))
+            assert_that(db, has_property('pool_size', 5))
+            assert_that(db, has_property('max_overflow', 10))
+            assert_that(db, has_property('adaptive_max_overflow', 40))
+            assert_that(db, has_property('pool_timeout', 2.5))
+            assert_that(db, has_property('session_scope', 'greenlet'))
+            assert_that(db, has_property('sqlite_tuning', is_(True)))
+            assert_that(db, has_property('force_schema', is_(True)))
+            assert_that(db.retry_policy, has_properties('attempts', 3,
+                                                        'max_delay', 0.5))
+            assert_that(db, has_properties('group_commit', True,
+                                           'group_commit_window', 0.01))
+            assert_that(db.lazy_loads, has_property('threshold', 5))
             assert_that(db,
                         has_property('session', is_(not_none())))
         finally:
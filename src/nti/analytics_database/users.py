@@ -48,10 +48,19 @@ class Users(Base):
 
     create_date = Column('create_date', DateTime, nullable=True)
 
+    _user = None
+
     @property
     def user(self):
-        id_utility = component.getUtility(IAnalyticsIntidIdentifier)
-        return id_utility.get_object(self.user_ds_id)
+        result = self._user
+        if result is None:
+            id_utility = component.getUtility(IAnalyticsIntidIdentifier)
+            result = id_utility.get_object(self.user_ds_id)
+        return result
+
+    @user.setter
+    def user(self, user):
+        self._user = user
 
 
 from nti.analytics_database.interfaces import IDatabaseCreator
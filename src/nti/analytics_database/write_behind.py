@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*
+"""
+Write-behind ingestion of analytics events, decoupled from the request
+transaction.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import threading
+
+from collections import OrderedDict
+
+from six.moves import queue
+
+from sqlalchemy import create_engine
+
+from nti.analytics_database.batching import get_table
+
+logger = __import__('logging').getLogger(__name__)
+
+_marker = object()
+
+#: Placed on the queue by :meth:`WriteBehindQueue.close` to stop the worker
+_STOP = object()
+
+
+class WriteBehindQueue(object):
+    """
+    A bounded, in-memory queue of event rows persisted by a background
+    worker thread using its own engine (and connection pool).
+
+    Producers call :meth:`put`, which waits up to ``put_timeout`` seconds
+    for room (``None`` waits forever) before dropping the row. The worker
+    writes rows in per-table ``executemany`` batches of up to ``batch_size``
+    rows, or whatever has arrived after ``flush_interval`` seconds; with a
+    ``retry_policy`` batches failing on a deadlock are written again.
+    """
+
+    maxsize = 10000
+    batch_size = 500
+    flush_interval = 1
+    put_timeout = 0.1
+
+    pool_size = 2
+    max_overflow = 0
+    pool_recycle = 300
+
+    def __init__(self, dburi=None, engine=None, maxsize=None, batch_size=None,
+                 flush_interval=None, put_timeout=_marker, retry_policy=None):
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if put_timeout is not _marker:
+            self.put_timeout = put_timeout
+        self.dburi = dburi
+        self.retry_policy = retry_policy
+        self._engine = engine
+        self._queue = queue.Queue(self.maxsize)
+        self._thread = None
+        self._closed = False
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # metrics
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.total_flush_latency = 0
+        self.last_flush_latency = None
+        self.max_flush_latency = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            if self.dburi.startswith('sqlite') or self.dburi.startswith('gevent+sqlite'):
+                self._engine = create_engine(self.dburi)
+            else:
+                self._engine = create_engine(self.dburi,
+                                             pool_size=self.pool_size,
+                                             max_overflow=self.max_overflow,
+                                             pool_recycle=self.pool_recycle)
+        return self._engine
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if not self.running and not self._closed:
+                self._thread = threading.Thread(target=self._run,
+                                                name='analytics-write-behind')
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def put(self, model, values=None, **kwargs):
+        """
+        Queue a row for the given mapped class (or table). Returns
+        False if the row was dropped.
+        """
+        row = dict(values or (), **kwargs)
+        if not self._closed:
+            try:
+                self._queue.put((get_table(model), row),
+                                block=self.put_timeout != 0,
+                                timeout=self.put_timeout or None)
+                return True
+            except queue.Full:
+                pass
+        with self._lock:
+            self.dropped += 1
+        return False
+
+    def close(self, timeout=None):
+        """
+        Stop accepting rows, write everything already queued and stop
+        the worker, waiting up to ``timeout`` seconds for it.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.running:
+            self._stop.set()
+            try:
+                # Wake the worker if it waits for rows; a full queue
+                # keeps it busy until it sees the stop event.
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+            if self.running:
+                logger.warning("Timed out draining analytics write-behind queue (%s rows)",
+                               self.queue_depth)
+        else:
+            # Never started; drain on the caller's thread.
+            self._drain()
+
+    def stats(self):
+        return {'queue_depth': self.queue_depth,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'last_flush_latency': self.last_flush_latency,
+                'max_flush_latency': self.max_flush_latency,
+                'avg_flush_latency': (self.total_flush_latency / self.flushes
+                                      if self.flushes else None)}
+
+    def _collect(self):
+        """
+        Gather up to a batch of rows; returns the batch and whether
+        we have been told to stop.
+        """
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                item = self._queue.get(timeout=max(remaining, 0.001))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            self._write(batch)
+            stop = stop or self._stop.is_set()
+        self._drain()
+
+    def _drain(self):
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        batch.append(item)
+            except queue.Empty:
+                pass
+            if not batch:
+                break
+            self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        by_table = OrderedDict()
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        def write():
+            with self.engine.begin() as conn:
+                for table, rows in by_table.items():
+                    conn.execute(table.insert(), rows)
+        start = time.time()
+        try:
+            if self.retry_policy is not None:
+                self.retry_policy(write)
+            else:
+                write()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to write %s analytics rows", len(batch))
+            self.failed += len(batch)
+            return
+        latency = time.time() - start
+        self.written += len(batch)
+        self.flushes += 1
+        self.total_flush_latency += latency
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(latency, self.max_flush_latency or 0)
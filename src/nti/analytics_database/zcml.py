@@ -17,13 +17,19 @@ from zope import interface
 from zope.component.zcml import utility
 
 from zope.configuration.fields import Bool
+from zope.configuration.fields import Tokens
 
+from zope.schema import Int
+from zope.schema import Float
+from zope.schema import Choice
 from zope.schema import TextLine
 
 from nti.analytics_database.database import AnalyticsDB
 
 from nti.analytics_database.interfaces import IAnalyticsDB
 
+from nti.analytics_database.scoping import SESSION_SCOPES
+
 logger = __import__('logging').getLogger(__name__)
 
 
@@ -38,10 +44,52 @@ class IRegisterAnalyticsDB(interface.Interface):
     defaultSQLite = Bool(title=u"default to SQLite", required=False)
     testmode = Bool(title=u"start the db in test mode", required=False)
     config = TextLine(title=u"path to config file", required=False)
+    writebehind = Bool(title=u"queue events for a background writer", required=False)
+    readers = Tokens(title=u"read replica db uris",
+                     value_type=TextLine(),
+                     required=False)
+    reader_policy = Choice(title=u"how a read replica is chosen",
+                           values=AnalyticsDB.READER_POLICIES,
+                           required=False)
+    metrics = Bool(title=u"record statement timing metrics", required=False)
+    slow_query_threshold = Float(title=u"seconds after which statements are logged with their plan",
+                                 required=False)
+    slow_query_log = TextLine(title=u"path to the slow query log file", required=False)
+    pool_size = Int(title=u"connection pool size", required=False)
+    max_overflow = Int(title=u"connections allowed beyond the pool size", required=False)
+    pool_recycle = Int(title=u"seconds after which connections are recycled", required=False)
+    adaptive_max_overflow = Int(title=u"grow the overflow up to this many connections when checkouts wait",
+                                required=False)
+    pool_timeout = Float(title=u"seconds to wait for a pooled connection", required=False)
+    session_scope = Choice(title=u"whether sessions are thread or greenlet local",
+                           description=u"greenlet needs threading monkey patched "
+                                       u"(gevent) so transactions are greenlet local too",
+                           values=SESSION_SCOPES,
+                           required=False)
+    sqlite_tuning = Bool(title=u"use WAL and tuned pragmas for SQLite files",
+                         required=False)
+    force_schema = Bool(title=u"create missing tables even if the schema fingerprint matches",
+                        required=False)
+    retry_attempts = Int(title=u"attempts of a transaction failing on deadlocks", required=False)
+    retry_max_delay = Float(title=u"maximum seconds between attempts", required=False)
+    group_commit = Bool(title=u"write rows of concurrent transactions in one commit",
+                        required=False)
+    group_commit_window = Float(title=u"seconds a group commit waits for more transactions",
+                                required=False)
+    lazy_load_threshold = Int(title=u"log relationships lazily loaded this many times in a transaction",
+                              required=False)
 
 
 def registerAnalyticsDB(_context, dburi=None, twophase=False, autocommit=False,
-                        defaultSQLite=False, testmode=False, config=None, echo=False):
+                        defaultSQLite=False, testmode=False, config=None, echo=False,
+                        writebehind=False, readers=None, reader_policy='round-robin',
+                        metrics=False, slow_query_threshold=None, slow_query_log=None,
+                        pool_size=None, max_overflow=None, pool_recycle=None,
+                        adaptive_max_overflow=None, pool_timeout=None,
+                        session_scope='thread', sqlite_tuning=False,
+                        force_schema=False, retry_attempts=None, retry_max_delay=None,
+                        group_commit=False, group_commit_window=None,
+                        lazy_load_threshold=None):
     """
     Register the db
     """
@@ -52,5 +100,24 @@ def registerAnalyticsDB(_context, dburi=None, twophase=False, autocommit=False,
                                 defaultSQLite=defaultSQLite,
                                 testmode=testmode,
                                 echo=echo,
-                                config=config)
+                                config=config,
+                                writebehind=writebehind,
+                                readers=readers,
+                                reader_policy=reader_policy,
+                                metrics=metrics,
+                                slow_query_threshold=slow_query_threshold,
+                                slow_query_log=slow_query_log,
+                                pool_size=pool_size,
+                                max_overflow=max_overflow,
+                                pool_recycle=pool_recycle,
+                                adaptive_max_overflow=adaptive_max_overflow,
+                                pool_timeout=pool_timeout,
+                                session_scope=session_scope,
+                                sqlite_tuning=sqlite_tuning,
+                                force_schema=force_schema,
+                                retry_attempts=retry_attempts,
+                                retry_max_delay=retry_max_delay,
+                                group_commit=group_commit,
+                                group_commit_window=group_commit_window,
+                                lazy_load_threshold=lazy_load_threshold)
     utility(_context, provides=IAnalyticsDB, factory=factory)